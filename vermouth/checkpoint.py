@@ -0,0 +1,469 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 University of Groningen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Save and restore the state of a system between the stages of a pipeline.
+
+A pipeline is described as a sequence of named stages. Each stage is
+identified by a key that is the hash of the key of the previous stage, of the
+name of the stage, and of the options that affect the stage. The first key is
+derived from the input of the pipeline, typically the content of the input
+file. Changing an option of a stage therefore invalidates the checkpoint for
+that stage and for all the stages after it, while the earlier checkpoints
+remain usable.
+
+Force fields are not stored in the checkpoints. They are stored by name and
+restored from the force fields known when the checkpoint is loaded.
+
+Successive structures of a same system, such as the frames of a simulation,
+differ by their coordinates but not by their topology. A
+:class:`TopologyArtifact` stores the result of the topology stages keyed by
+:func:`topology_key`, which only describes the topology of the input. When a
+structure with the same topology comes, the stored systems are reused and
+only the coordinates are updated, see :func:`refresh_positions`.
+"""
+
+import hashlib
+import os
+import pickle
+from pathlib import Path
+
+import numpy as np
+
+from .forcefield import ForceField
+from .processors.average_beads import DoAverageBead
+from .log_helpers import StyleAdapter, get_logger
+
+LOGGER = StyleAdapter(get_logger(__name__))
+
+CHECKPOINT_SUFFIX = '.pickle'
+
+
+class CheckpointError(Exception):
+    """
+    Raised when a checkpoint exists but cannot be restored.
+    """
+
+
+class _Pickler(pickle.Pickler):
+    """
+    Pickler that stores force fields as a reference to their name.
+    """
+    def persistent_id(self, obj):  # pylint: disable=method-hidden
+        if isinstance(obj, ForceField):
+            return ('force_field', obj.name)
+        return None
+
+
+class _Unpickler(pickle.Unpickler):
+    """
+    Unpickler that restores force fields from their name.
+    """
+    def __init__(self, file, force_fields):
+        super().__init__(file)
+        self.force_fields = force_fields
+
+    def persistent_load(self, pid):
+        kind, name = pid
+        if kind != 'force_field':
+            raise pickle.UnpicklingError('Unknown persistent id "{}".'.format(kind))
+        try:
+            return self.force_fields[name]
+        except KeyError:
+            raise pickle.UnpicklingError('Unknown force field "{}".'.format(name))
+
+
+def hash_file(path):
+    """
+    Compute the SHA-256 hash of the content of a file.
+
+    Parameters
+    ----------
+    path: str or pathlib.Path
+
+    Returns
+    -------
+    str
+        The hexadecimal digest.
+    """
+    hasher = hashlib.sha256()
+    with open(str(path), 'rb') as infile:
+        for chunk in iter(lambda: infile.read(1 << 20), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def stage_key(previous_key, name, options=None):
+    """
+    Compute the key of a stage from the key of the previous one.
+
+    Parameters
+    ----------
+    previous_key: str
+        The key of the previous stage, or of the input of the pipeline for the
+        first stage.
+    name: str
+        The name of the stage.
+    options: dict or None
+        The options that affect the result of the stage. The values are
+        hashed through their :func:`repr`, so they must have a stable
+        representation.
+
+    Returns
+    -------
+    str
+        The hexadecimal digest identifying the stage.
+    """
+    if options is None:
+        options = {}
+    hasher = hashlib.sha256()
+    hasher.update(previous_key.encode('utf-8'))
+    hasher.update(name.encode('utf-8'))
+    for option_name, value in sorted(options.items()):
+        hasher.update('{}={!r};'.format(option_name, value).encode('utf-8'))
+    return hasher.hexdigest()
+
+
+class Checkpointer:
+    """
+    Store and retrieve systems on disk, keyed by pipeline stage.
+
+    Parameters
+    ----------
+    directory: str or pathlib.Path
+        The directory where the checkpoints are written. It is created if
+        needed.
+    input_key: str
+        A key describing the input of the pipeline. See :func:`hash_file`.
+        This is the key the first stage is chained to.
+    force_fields: dict[str, vermouth.forcefield.ForceField]
+        The force fields known to the program, used to restore the force
+        fields referred to in the checkpoints.
+
+    Attributes
+    ----------
+    directory: pathlib.Path
+    key: str
+        The key of the last stage that went through :meth:`run`. Successive
+        calls to :meth:`run` chain their stages after this key.
+    force_fields: dict[str, vermouth.forcefield.ForceField]
+    """
+    def __init__(self, directory, input_key, force_fields):
+        self.directory = Path(directory)
+        self.key = input_key
+        self.force_fields = force_fields
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def path(self, key):
+        """
+        The path to the checkpoint file for a given key.
+        """
+        return self.directory / (key + CHECKPOINT_SUFFIX)
+
+    def save(self, system, key):
+        """
+        Write a checkpoint for a system.
+
+        The file is written under a temporary name first, so an interrupted
+        run does not leave a truncated checkpoint behind.
+
+        Parameters
+        ----------
+        system: vermouth.system.System
+        key: str
+        """
+        path = self.path(key)
+        tmp_path = path.with_suffix('.tmp')
+        with open(str(tmp_path), 'wb') as outfile:
+            _Pickler(outfile, protocol=pickle.HIGHEST_PROTOCOL).dump(system)
+        os.replace(str(tmp_path), str(path))
+
+    def load(self, key):
+        """
+        Read the checkpoint for a given key.
+
+        Parameters
+        ----------
+        key: str
+
+        Returns
+        -------
+        vermouth.system.System or None
+            The stored system, or ``None`` if there is no checkpoint for that
+            key.
+
+        Raises
+        ------
+        CheckpointError
+            The checkpoint exists but cannot be read.
+        """
+        path = self.path(key)
+        if not path.exists():
+            return None
+        try:
+            with open(str(path), 'rb') as infile:
+                return _Unpickler(infile, self.force_fields).load()
+        except Exception as error:
+            raise CheckpointError('Could not read checkpoint "{}": {}'
+                                  .format(path, error)) from error
+
+    def run(self, stages, system=None):
+        """
+        Run a sequence of stages, resuming from the latest valid checkpoint.
+
+        Each stage is a ``(name, options, function)`` tuple. ``function``
+        receives the system produced by the previous stage (or the `system`
+        argument for the first stage) and returns the system for the next
+        stage. A checkpoint is written after each stage that is run.
+
+        The stages are chained after :attr:`key`, which is then updated to
+        the key of the last stage. Options that affect a stage therefore
+        invalidate the checkpoints of all the following stages, including
+        those of subsequent calls.
+
+        Parameters
+        ----------
+        stages: list[tuple[str, dict, collections.abc.Callable]]
+        system: vermouth.system.System or None
+
+        Returns
+        -------
+        vermouth.system.System
+            The system produced by the last stage.
+        """
+        keys = []
+        key = self.key
+        for name, options, _ in stages:
+            key = stage_key(key, name, options)
+            keys.append(key)
+
+        start = 0
+        for idx in reversed(range(len(stages))):
+            try:
+                loaded = self.load(keys[idx])
+            except CheckpointError as error:
+                LOGGER.warning('{}', error, type='checkpoint')
+                continue
+            if loaded is not None:
+                LOGGER.info('Resuming from the checkpoint after the "{}" stage.',
+                            stages[idx][0], type='step')
+                system = loaded
+                start = idx + 1
+                break
+
+        for (_, _, function), key in zip(stages[start:], keys[start:]):
+            system = function(system)
+            self.save(system, key)
+        if keys:
+            self.key = keys[-1]
+        return system
+
+
+#: Version of the format of the topology artifacts. Artifacts written with an
+#: other version are ignored.
+TOPOLOGY_ARTIFACT_FORMAT = 1
+#: Node attributes that describe the topology of an input structure.
+TOPOLOGY_ATTRIBUTES = ('atomname', 'resname', 'resid', 'chain',
+                       'insertion_code', 'element')
+
+
+def topology_key(system, options=None):
+    """
+    Compute a key that describes the topology of a system as read from a
+    structure file.
+
+    The key accounts for the node keys and the attributes listed in
+    :data:`TOPOLOGY_ATTRIBUTES` of every atom, in order, and ignores the
+    coordinates.
+
+    Parameters
+    ----------
+    system: vermouth.system.System
+    options: dict or None
+        The options that affect the topology stages. The values are hashed
+        through their :func:`repr`, so they must have a stable
+        representation.
+
+    Returns
+    -------
+    str
+        The hexadecimal digest.
+    """
+    hasher = hashlib.sha256()
+    hasher.update(stage_key('', 'topology', options).encode('utf-8'))
+    for molecule in system.molecules:
+        hasher.update(b'molecule;')
+        for key, node in molecule.nodes.items():
+            hasher.update(repr(
+                (key, ) + tuple(node.get(name) for name in TOPOLOGY_ATTRIBUTES)
+            ).encode('utf-8'))
+    return hasher.hexdigest()
+
+
+def system_positions(system):
+    """
+    Gather the positions of the atoms of a system by node key.
+
+    Returns
+    -------
+    dict[collections.abc.Hashable, numpy.ndarray]
+    """
+    return {
+        key: node['position']
+        for molecule in system.molecules
+        for key, node in molecule.nodes.items()
+        if 'position' in node
+    }
+
+
+def _has_position(node):
+    position = node.get('position')
+    return position is not None and not np.isnan(position).any()
+
+
+def refresh_positions(molecule, positions):
+    """
+    Update the coordinates of a molecule from new atom positions.
+
+    The atoms that have a position take the new position with their key; the
+    atoms without a position, such as those added when repairing the
+    graph, are left without. The particles with a "graph" attribute are
+    updated recursively, and placed again from their underlying atoms as
+    :class:`~vermouth.processors.average_beads.DoAverageBead` does. Particles
+    with an empty graph, such as charge dummies, are left untouched.
+
+    Parameters
+    ----------
+    molecule: vermouth.molecule.Molecule
+        The molecule to update in place.
+    positions: dict[collections.abc.Hashable, numpy.ndarray]
+        The new positions of the atoms, keyed like the atoms of the input
+        structure. See :func:`system_positions`.
+    """
+    average = False
+    copies = []
+    for key, node in molecule.nodes.items():
+        graph = node.get('graph')
+        if graph is None:
+            if key in positions and _has_position(node):
+                node['position'] = positions[key]
+            continue
+        if not graph:
+            continue
+        refresh_positions(graph, positions)
+        subnodes = list(graph.nodes.values())
+        if len(subnodes) == 1 and 'graph' in subnodes[0]:
+            # After ApplyBlocks, a bead is built on a single intermediate
+            # bead, from which it got its position.
+            copies.append((node, subnodes[0]))
+        else:
+            average = True
+    if average:
+        DoAverageBead(ignore_missing_graphs=True).run_molecule(molecule)
+    for node, subnode in copies:
+        node['position'] = subnode['position']
+
+
+class TopologyArtifact:
+    """
+    The systems built from an input structure by the topology stages.
+
+    Parameters
+    ----------
+    key: str
+        The key of the input topology, see :func:`topology_key`.
+    universal: vermouth.system.System
+        The atomistic system once the graph is repaired and canonicalized.
+    annotated_keys: list[str] or None
+        The keys of the atomistic molecules once annotated, as computed by
+        :func:`vermouth.moltype_library.moltype_key`. The coarse grained
+        system is only valid for molecules annotated the same way.
+    coarse: vermouth.system.System or None
+        The coarse grained system.
+    relink: bool
+        If ``True``, `coarse` is the system before the links are applied, as
+        the links have parameters that depend on the coordinates.
+
+    Attributes
+    ----------
+    key: str
+    universal: vermouth.system.System
+    annotated_keys: list[str] or None
+    coarse: vermouth.system.System or None
+    relink: bool
+    """
+    def __init__(self, key, universal, annotated_keys=None, coarse=None,
+                 relink=False):
+        self.key = key
+        self.universal = universal
+        self.annotated_keys = annotated_keys
+        self.coarse = coarse
+        self.relink = relink
+
+    def save(self, path):
+        """
+        Write the artifact to a file.
+
+        The file is written under a temporary name first, so an interrupted
+        run does not leave a truncated artifact behind.
+        """
+        path = Path(path)
+        tmp_path = path.with_suffix('.tmp')
+        content = {
+            'format': TOPOLOGY_ARTIFACT_FORMAT,
+            'key': self.key,
+            'universal': self.universal,
+            'annotated_keys': self.annotated_keys,
+            'coarse': self.coarse,
+            'relink': self.relink,
+        }
+        with open(str(tmp_path), 'wb') as outfile:
+            _Pickler(outfile, protocol=pickle.HIGHEST_PROTOCOL).dump(content)
+        os.replace(str(tmp_path), str(path))
+
+    @classmethod
+    def load(cls, path, force_fields):
+        """
+        Read an artifact from a file.
+
+        Parameters
+        ----------
+        path: str or pathlib.Path
+        force_fields: dict[str, vermouth.forcefield.ForceField]
+
+        Returns
+        -------
+        TopologyArtifact or None
+            The artifact, or ``None`` if the file does not exist or was
+            written in an other format.
+
+        Raises
+        ------
+        CheckpointError
+            The file exists but cannot be read.
+        """
+        path = Path(path)
+        if not path.exists():
+            return None
+        try:
+            with open(str(path), 'rb') as infile:
+                content = _Unpickler(infile, force_fields).load()
+        except Exception as error:
+            raise CheckpointError('Could not read the topology artifact '
+                                  '"{}": {}'.format(path, error)) from error
+        if content.get('format') != TOPOLOGY_ARTIFACT_FORMAT:
+            return None
+        return cls(content['key'], content['universal'],
+                   content['annotated_keys'], content['coarse'],
+                   content['relink'])
@@ -17,15 +17,28 @@ Assign protein secondary structures using DSSP.
 """
 
 import collections
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import os
 import subprocess
 import logging
 
+import numpy as np
+
 from ..pdb import pdb
 from ..system import System
 from ..processors.processor import Processor
 from ..selectors import is_protein, selector_has_position, filter_minimal, select_all
 from .. import utils
+from . import kabsch_sander
+
+#: Value of the "executable" argument that selects the built-in
+#: implementation of DSSP from :mod:`vermouth.dssp.kabsch_sander`.
+BUILTIN_DSSP = 'builtin'
+
+
+#: Version of the format written by :meth:`SecondaryStructureCache.save`.
+SECONDARY_STRUCTURE_CACHE_FORMAT = 2
 
 
 class DSSPError(Exception):
@@ -35,6 +48,54 @@ class DSSPError(Exception):
     pass
 
 
+def secondary_structure_key(molecule, executable='dssp'):
+    """
+    Build a key that identifies the secondary structure assignation of a
+    molecule.
+
+    The key is a hash of the positions of the backbone atoms, of the residue
+    names, and of the chains of the molecule, and of the DSSP executable. The
+    positions are rounded to the precision of a PDB file. Other atoms do not
+    affect the secondary structure.
+
+    Parameters
+    ----------
+    molecule: vermouth.molecule.Molecule
+    executable: str
+        The DSSP executable, or :data:`BUILTIN_DSSP`.
+
+    Returns
+    -------
+    str
+        The hexadecimal digest describing the molecule.
+    """
+    positions, chains, resnames = kabsch_sander.backbone_positions(molecule)
+    # Normalize -0.0 to 0.0 so they hash the same.
+    positions = np.round(positions, 4) + 0.0
+    digest = hashlib.sha256()
+    digest.update(repr((executable, chains, resnames, positions.shape)).encode('utf-8'))
+    digest.update(np.ascontiguousarray(positions).tobytes())
+    return digest.hexdigest()
+
+
+class SecondaryStructureCache(utils.LRUCache):
+    """
+    A bounded cache for secondary structure assignations.
+
+    The keys are built by :func:`secondary_structure_key`, and the values
+    are the sequences of secondary structure codes. See
+    :class:`vermouth.utils.LRUCache` for how the cache behaves.
+
+    Parameters
+    ----------
+    maxsize: int or None
+        The maximum number of assignations to keep. The cache is not bounded
+        if ``None``.
+    """
+    file_format = SECONDARY_STRUCTURE_CACHE_FORMAT
+    description = 'secondary structure cache'
+
+
 def read_dssp2(lines):
     """
     Read the secondary structure from a DSSP output.
@@ -219,7 +280,8 @@ def _savefile_path(molecule, savedir=None):
     return savefile
 
 
-def annotate_dssp(molecule, executable='dssp', savedir=None, attribute='secstruct'):
+def annotate_dssp(molecule, executable='dssp', savedir=None, attribute='secstruct',
+                  cache=None):
     """
     Adds the DSSP assignation to the atoms of a molecule.
 
@@ -245,13 +307,19 @@ def annotate_dssp(molecule, executable='dssp', savedir=None, attribute='secstruc
         to write a PDB file; other atom attributes, edges, or molecule
         attributes are not used.
     executable: str
-        The path or name in the research PATH of the DSSP executable.
+        The path or name in the research PATH of the DSSP executable. If set
+        to :data:`BUILTIN_DSSP`, the secondary structure is assigned in
+        process by :func:`vermouth.dssp.kabsch_sander.dssp_molecule` instead.
     savedir: None or str
         If set to a path, the DSSP output will be written in this **directory**.
         The option is only available if chains are defined with the 'chain'
         atom attribute.
     attribute: str
         The name of the atom attribute in which to store the annotation.
+    cache: None or SecondaryStructureCache
+        If set, the assignation is looked for in the cache before running
+        DSSP, and stored in the cache afterwards. Nothing is written in
+        "savedir" when the assignation is found in the cache.
 
     See Also
     --------
@@ -260,6 +328,23 @@ def annotate_dssp(molecule, executable='dssp', savedir=None, attribute='secstruc
     if not is_protein(molecule):
         return
 
+    if cache is not None:
+        key = secondary_structure_key(molecule, executable)
+        try:
+            secstructs = cache[key]
+        except KeyError:
+            pass
+        else:
+            annotate_residues_from_sequence(molecule, attribute, secstructs)
+            return
+        annotate_dssp(molecule, executable, savedir, attribute)
+        cache[key] = list(sequence_from_residues(molecule, attribute))
+        return
+
+    if executable == BUILTIN_DSSP:
+        annotate_builtin_dssp(molecule, savedir, attribute)
+        return
+
     clean_pos = molecule.subgraph(
         filter_minimal(molecule, selector=selector_has_position)
     )
@@ -277,6 +362,44 @@ def annotate_dssp(molecule, executable='dssp', savedir=None, attribute='secstruc
     annotate_residues_from_sequence(molecule, attribute, secstructs)
 
 
+def annotate_builtin_dssp(molecule, savedir=None, attribute='secstruct'):
+    """
+    Adds the assignation of the built-in DSSP to the atoms of a molecule.
+
+    This is the in process equivalent of :func:`annotate_dssp`. Residues for
+    which a backbone atom is missing, or has no position, are assigned as
+    coil. If "savedir" is set, a minimal DSSP file with the assignation is
+    written in that directory.
+
+    .. warning::
+
+        The molecule is annotated **in-place**.
+
+    Parameters
+    ----------
+    molecule: Molecule
+        The molecule to annotate.
+    savedir: None or str
+        If set to a path, the assignation will be written in this
+        **directory**. The option is only available if chains are defined
+        with the 'chain' atom attribute.
+    attribute: str
+        The name of the atom attribute in which to store the annotation.
+
+    See Also
+    --------
+    vermouth.dssp.kabsch_sander.dssp_molecule
+    """
+    if not molecule:
+        return
+    secstructs = kabsch_sander.dssp_molecule(molecule)
+    savefile = _savefile_path(molecule, savedir)
+    if savefile is not None:
+        with open(str(savefile), 'w') as outfile:
+            outfile.write(kabsch_sander.format_dssp(molecule, secstructs))
+    annotate_residues_from_sequence(molecule, attribute, secstructs)
+
+
 def convert_dssp_to_martini(sequence):
     """
     Convert a sequence of secondary structure to martini secondary sequence.
@@ -433,17 +556,58 @@ def convert_dssp_annotation_to_martini(
 
 
 class AnnotateDSSP(Processor):
+    """
+    Annotate the secondary structure of the proteins with DSSP.
+
+    See :func:`annotate_dssp` for the details.
+
+    Parameters
+    ----------
+    executable: str
+        The path or name in the research PATH of the DSSP executable, or
+        :data:`BUILTIN_DSSP`.
+    savedir: None or str
+        If set to a path, the DSSP output will be written in this directory.
+    processes: None or int
+        The maximum number of DSSP executables to run concurrently, one per
+        molecule. The molecules are annotated one after the other if
+        ``None`` or 1, or if the built-in DSSP is used.
+    cache: None or SecondaryStructureCache
+        A cache of secondary structure assignations to use.
+    """
     name = 'AnnotateDSSP'
 
-    def __init__(self, executable='dssp', savedir=None):
+    def __init__(self, executable='dssp', savedir=None, processes=None, cache=None):
         super().__init__()
         self.executable = executable
         self.savedir = savedir
+        self.processes = processes
+        self.cache = cache
 
     def run_molecule(self, molecule):
-        annotate_dssp(molecule, self.executable, self.savedir)
+        annotate_dssp(molecule, self.executable, self.savedir, cache=self.cache)
         return molecule
 
+    def run_system(self, system):
+        """
+        Run the processor on a system.
+
+        DSSP runs in a separate process for each molecule, so the
+        executables can run concurrently while this process waits for them.
+        The first error, in the order of the molecules, is raised.
+
+        Parameters
+        ----------
+        system: vermouth.system.System
+        """
+        if (self.processes is None or self.processes <= 1
+                or self.executable == BUILTIN_DSSP
+                or len(system.molecules) <= 1):
+            super().run_system(system)
+            return
+        with ThreadPoolExecutor(max_workers=self.processes) as executor:
+            system.molecules = list(executor.map(self.run_molecule, system.molecules))
+
 
 class AnnotateMartiniSecondaryStructures(Processor):
     name = 'AnnotateMartiniSecondaryStructures'
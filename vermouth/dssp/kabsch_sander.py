@@ -0,0 +1,517 @@
+# Copyright 2018 University of Groningen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Assign protein secondary structures with a numpy implementation of DSSP.
+
+This follows the algorithm of Kabsch and Sander [KS1983]_, as implemented in
+DSSP version 2. Hydrogen bonds are detected from the electrostatic energy
+between the backbone N-H and C=O groups, and the secondary structures are
+assigned from the patterns of hydrogen bonds. Only the backbone atoms (N, CA,
+C, and O) are used; the amide hydrogens are placed the same way DSSP places
+them. Accessible surfaces are not computed.
+
+.. [KS1983] W. Kabsch and C. Sander, Dictionary of protein secondary
+   structure: pattern recognition of hydrogen-bonded and geometrical
+   features, Biopolymers 22 (1983) 2577-2637.
+"""
+
+import numpy as np
+
+from .. import KDTree
+
+#: Backbone atoms needed for a residue to be taken into account.
+BACKBONE_ATOMS = ('N', 'CA', 'C', 'O')
+
+# The constants below come from DSSP. Distances are in Ångström and energies
+# in kcal/mol.
+_COUPLING_CONSTANT = -27.888  # -332 * 0.42 * 0.2
+_MIN_DISTANCE = 0.5
+_MIN_HBOND_ENERGY = -9.9
+_MAX_HBOND_ENERGY = -0.5
+_MAX_CA_DISTANCE = 9.0
+_MAX_PEPTIDE_BOND_LENGTH = 2.5
+_MIN_BEND_ANGLE = 70
+
+_ONE_LETTER = {
+    'ALA': 'A', 'ARG': 'R', 'ASN': 'N', 'ASP': 'D', 'CYS': 'C', 'GLN': 'Q',
+    'GLU': 'E', 'GLY': 'G', 'HIS': 'H', 'ILE': 'I', 'LEU': 'L', 'LYS': 'K',
+    'MET': 'M', 'PHE': 'F', 'PRO': 'P', 'SER': 'S', 'THR': 'T', 'TRP': 'W',
+    'TYR': 'Y', 'VAL': 'V',
+}
+
+
+def hbond_energies(donor_n, donor_h, acceptor_c, acceptor_o):
+    """
+    Compute the DSSP electrostatic energy of backbone hydrogen bonds.
+
+    All the arguments are arrays of positions, in Ångström, with one row per
+    pair of donor and acceptor.
+
+    Parameters
+    ----------
+    donor_n: numpy.ndarray
+        Positions of the nitrogen of the donors.
+    donor_h: numpy.ndarray
+        Positions of the hydrogen of the donors.
+    acceptor_c: numpy.ndarray
+        Positions of the carbon of the acceptors.
+    acceptor_o: numpy.ndarray
+        Positions of the oxygen of the acceptors.
+
+    Returns
+    -------
+    numpy.ndarray
+        The energy of each hydrogen bond in kcal/mol, rounded to 3 decimals.
+    """
+    distance_ho = np.linalg.norm(donor_h - acceptor_o, axis=-1)
+    distance_hc = np.linalg.norm(donor_h - acceptor_c, axis=-1)
+    distance_nc = np.linalg.norm(donor_n - acceptor_c, axis=-1)
+    distance_no = np.linalg.norm(donor_n - acceptor_o, axis=-1)
+    distances = np.stack([distance_ho, distance_hc, distance_nc, distance_no])
+    too_close = np.any(distances < _MIN_DISTANCE, axis=0)
+    with np.errstate(divide='ignore'):
+        energies = _COUPLING_CONSTANT * (
+            1 / distance_ho - 1 / distance_hc + 1 / distance_nc - 1 / distance_no
+        )
+    energies = np.round(energies, 3)
+    energies[too_close] = _MIN_HBOND_ENERGY
+    return np.maximum(energies, _MIN_HBOND_ENERGY)
+
+
+def _hydrogen_positions(positions_n, positions_c, positions_o, breaks):
+    """
+    Place the amide hydrogens the way DSSP does.
+
+    The hydrogen is 1 Å away from the nitrogen, in the direction from the
+    oxygen to the carbon of the previous residue. Residues that start a
+    chain segment have their hydrogen on the nitrogen.
+    """
+    positions_h = positions_n.copy()
+    previous_co = positions_c[:-1] - positions_o[:-1]
+    previous_co /= np.linalg.norm(previous_co, axis=1)[:, np.newaxis]
+    follows = ~breaks[1:]
+    positions_h[1:][follows] += previous_co[follows]
+    return positions_h
+
+
+def _hbonds(positions_n, positions_ca, positions_c, positions_o,
+            breaks, prolines):
+    """
+    Find the backbone hydrogen bonds.
+
+    Like in DSSP, only the two hydrogen bonds with the lowest energy are kept
+    for each donor, and they are only accounted for if their energy is lower
+    than -0.5 kcal/mol.
+
+    Returns
+    -------
+    numpy.ndarray
+        The sorted codes ``donor * n_residues + acceptor`` of the hydrogen
+        bonds.
+    """
+    n_residues = len(positions_ca)
+    positions_h = _hydrogen_positions(positions_n, positions_c, positions_o, breaks)
+    tree = KDTree(positions_ca)
+    try:
+        pairs = tree.query_pairs(_MAX_CA_DISTANCE, output_type='ndarray')
+    except TypeError:
+        # The redistributed KDTree only returns sets.
+        pairs = np.array(sorted(tree.query_pairs(_MAX_CA_DISTANCE)), dtype=int)
+    pairs = np.sort(pairs.reshape(-1, 2), axis=1)
+    pairs = pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+    first, second = pairs.T
+    # DSSP evaluates the residue i as a donor for every acceptor j > i, and
+    # the residue j as a donor for every acceptor i < j - 1.
+    reverse = second != first + 1
+    donors = np.concatenate([first, second[reverse]])
+    acceptors = np.concatenate([second, first[reverse]])
+    can_donate = ~prolines[donors]
+    donors = donors[can_donate]
+    acceptors = acceptors[can_donate]
+
+    energies = hbond_energies(
+        positions_n[donors], positions_h[donors],
+        positions_c[acceptors], positions_o[acceptors],
+    )
+    candidates = energies < 0
+    donors = donors[candidates]
+    acceptors = acceptors[candidates]
+    energies = energies[candidates]
+
+    order = np.lexsort((energies, donors))
+    donors = donors[order]
+    acceptors = acceptors[order]
+    energies = energies[order]
+    group_starts = np.flatnonzero(np.r_[True, donors[1:] != donors[:-1]])
+    group_sizes = np.diff(np.r_[group_starts, len(donors)])
+    ranks = np.arange(len(donors)) - np.repeat(group_starts, group_sizes)
+    keep = (ranks < 2) & (energies < _MAX_HBOND_ENERGY)
+    return np.unique(donors[keep] * n_residues + acceptors[keep])
+
+
+class _Backbone:
+    """
+    Hydrogen bonds and chain breaks of a protein backbone.
+    """
+    def __init__(self, bonds, breaks):
+        self.n_residues = len(breaks)
+        self.bonds = bonds
+        self.breaks_before = np.cumsum(breaks)
+
+    def no_break(self, start, stop):
+        """
+        Whether there is no chain break between residues `start` and `stop`.
+        """
+        start = np.clip(start, 0, self.n_residues - 1)
+        stop = np.clip(stop, 0, self.n_residues - 1)
+        return self.breaks_before[stop] == self.breaks_before[start]
+
+    def test_bond(self, donor, acceptor):
+        """
+        Whether residue `donor` donates a hydrogen bond to residue `acceptor`.
+        """
+        donor = np.asarray(donor)
+        acceptor = np.asarray(acceptor)
+        valid = ((donor >= 0) & (donor < self.n_residues)
+                 & (acceptor >= 0) & (acceptor < self.n_residues))
+        codes = donor * self.n_residues + acceptor
+        return valid & np.isin(codes, self.bonds)
+
+
+def _unsigned_less(left, right, limit):
+    """
+    Compare ``left - right < limit`` as unsigned integers, like DSSP does.
+    """
+    return 0 <= left - right < limit
+
+
+def _bridges(backbone):
+    """
+    Find the beta bridges and group them in ladders.
+
+    Returns
+    -------
+    list[tuple[str, list[int], list[int]]]
+        The type ("parallel" or "antiparallel") of each ladder, and the
+        residues involved on each side.
+    """
+    n_residues = backbone.n_residues
+    test = backbone.test_bond
+    bonds = backbone.bonds
+    donors = bonds // n_residues
+    acceptors = bonds % n_residues
+    # Each bridge pattern involves at least one hydrogen bond; build the
+    # candidate pairs of residues from the known bonds rather than testing
+    # all the pairs.
+    candidates = np.concatenate([
+        np.stack([donors - 1, acceptors], axis=1),
+        np.stack([acceptors + 1, donors], axis=1),
+        np.stack([acceptors, donors - 1], axis=1),
+        np.stack([donors, acceptors + 1], axis=1),
+        np.stack([donors - 1, acceptors + 1], axis=1),
+        np.stack([acceptors + 1, donors - 1], axis=1),
+        np.stack([acceptors, donors], axis=1),
+        np.stack([donors, acceptors], axis=1),
+    ]).reshape(-1, 2)
+    first, second = candidates.T
+    valid = (first >= 1) & (first + 4 < n_residues) & (second >= first + 3) & (second + 1 < n_residues)
+    candidates = np.unique(candidates[valid], axis=0)
+    first, second = candidates.T
+    connected = backbone.no_break(first - 1, first + 1) & backbone.no_break(second - 1, second + 1)
+    first = first[connected]
+    second = second[connected]
+    parallel = (
+        (test(first + 1, second) & test(second, first - 1))
+        | (test(second + 1, first) & test(first, second - 1))
+    )
+    antiparallel = ~parallel & (
+        (test(first + 1, second - 1) & test(second + 1, first - 1))
+        | (test(second, first) & test(first, second))
+    )
+
+    ladders = []
+    for i, j, is_parallel, is_antiparallel in zip(
+            first.tolist(), second.tolist(), parallel.tolist(), antiparallel.tolist()):
+        if not (is_parallel or is_antiparallel):
+            continue
+        kind = 'parallel' if is_parallel else 'antiparallel'
+        for ladder_kind, ladder_i, ladder_j in ladders:
+            if kind != ladder_kind or i != ladder_i[-1] + 1:
+                continue
+            if kind == 'parallel' and ladder_j[-1] + 1 == j:
+                ladder_i.append(i)
+                ladder_j.append(j)
+                break
+            if kind == 'antiparallel' and ladder_j[0] - 1 == j:
+                ladder_i.append(i)
+                ladder_j.insert(0, j)
+                break
+        else:  # no break
+            ladders.append((kind, [i], [j]))
+
+    # Merge the ladders separated by a bulge.
+    ladders.sort(key=lambda ladder: ladder[1][0])
+    idx = 0
+    while idx < len(ladders):
+        jdx = idx + 1
+        while jdx < len(ladders):
+            kind, i_first, j_first = ladders[idx]
+            other_kind, i_second, j_second = ladders[jdx]
+            ibi, iei = i_first[0], i_first[-1]
+            jbi, jei = j_first[0], j_first[-1]
+            ibj, iej = i_second[0], i_second[-1]
+            jbj, jej = j_second[0], j_second[-1]
+            if (kind != other_kind
+                    or not backbone.no_break(min(ibi, ibj), max(iei, iej))
+                    or not backbone.no_break(min(jbi, jbj), max(jei, jej))
+                    or not _unsigned_less(ibj, iei, 6)
+                    or (iei >= ibj and ibi <= iej)):
+                jdx += 1
+                continue
+            if kind == 'parallel':
+                bulge = ((_unsigned_less(jbj, jei, 6) and _unsigned_less(ibj, iei, 3))
+                         or _unsigned_less(jbj, jei, 3))
+            else:
+                bulge = ((_unsigned_less(jbi, jej, 6) and _unsigned_less(ibj, iei, 3))
+                         or _unsigned_less(jbi, jej, 3))
+            if bulge:
+                i_first.extend(i_second)
+                if kind == 'parallel':
+                    j_first.extend(j_second)
+                else:
+                    j_first[:0] = j_second
+                del ladders[jdx]
+            else:
+                jdx += 1
+        idx += 1
+    return ladders
+
+
+def _kappa_angles(positions_ca):
+    """
+    Compute the angle in degrees between CA(i-2)->CA(i) and CA(i)->CA(i+2).
+    """
+    kappa = np.full(len(positions_ca), np.nan)
+    if len(positions_ca) < 5:
+        return kappa
+    before = positions_ca[2:-2] - positions_ca[:-4]
+    after = positions_ca[4:] - positions_ca[2:-2]
+    cosine = np.sum(before * after, axis=1) / (
+        np.linalg.norm(before, axis=1) * np.linalg.norm(after, axis=1)
+    )
+    kappa[2:-2] = np.degrees(np.arccos(np.clip(cosine, -1, 1)))
+    return kappa
+
+
+def assign_secondary_structure(positions_n, positions_ca, positions_c,
+                               positions_o, breaks=None, prolines=None):
+    """
+    Assign the secondary structure of a protein backbone.
+
+    Parameters
+    ----------
+    positions_n: numpy.ndarray
+        Positions of the backbone nitrogens in nm, one row per residue.
+    positions_ca: numpy.ndarray
+        Positions of the alpha carbons in nm.
+    positions_c: numpy.ndarray
+        Positions of the backbone carbons in nm.
+    positions_o: numpy.ndarray
+        Positions of the backbone oxygens in nm.
+    breaks: numpy.ndarray or None
+        Booleans telling if a residue starts a new chain segment. Chain
+        breaks are always detected from the length of the peptide bonds.
+    prolines: numpy.ndarray or None
+        Booleans telling which residues are prolines, and can therefore not
+        donate a hydrogen bond.
+
+    Returns
+    -------
+    list[str]
+        One secondary structure code per residue; see
+        :func:`vermouth.dssp.dssp.read_dssp2` for the meaning of the codes.
+    """
+    # DSSP works in Ångström.
+    positions_n = np.asarray(positions_n, dtype=float).reshape(-1, 3) * 10
+    positions_ca = np.asarray(positions_ca, dtype=float).reshape(-1, 3) * 10
+    positions_c = np.asarray(positions_c, dtype=float).reshape(-1, 3) * 10
+    positions_o = np.asarray(positions_o, dtype=float).reshape(-1, 3) * 10
+    n_residues = len(positions_ca)
+    if not n_residues:
+        return []
+    if breaks is None:
+        breaks = np.zeros(n_residues, dtype=bool)
+    if prolines is None:
+        prolines = np.zeros(n_residues, dtype=bool)
+    breaks = np.array(breaks, dtype=bool)
+    prolines = np.asarray(prolines, dtype=bool)
+    peptide_lengths = np.linalg.norm(positions_c[:-1] - positions_n[1:], axis=1)
+    breaks[1:] |= peptide_lengths > _MAX_PEPTIDE_BOND_LENGTH
+
+    bonds = _hbonds(positions_n, positions_ca, positions_c, positions_o,
+                    breaks, prolines)
+    backbone = _Backbone(bonds, breaks)
+    indices = np.arange(n_residues)
+    secstructs = np.full(n_residues, 'C')
+
+    # Beta bridges and ladders.
+    for _, ladder_i, ladder_j in _bridges(backbone):
+        code = 'E' if len(ladder_i) > 1 else 'B'
+        for side in (ladder_i, ladder_j):
+            segment = slice(side[0], side[-1] + 1)
+            secstructs[segment] = np.where(secstructs[segment] == 'E', 'E', code)
+
+    # n-turns, that are the starts of helices.
+    turns = {}
+    for stride in (3, 4, 5):
+        turns[stride] = np.zeros(n_residues, dtype=bool)
+        starts = indices[:-stride]
+        turns[stride][starts] = (backbone.no_break(starts, starts + stride)
+                                 & backbone.test_bond(starts + stride, starts))
+
+    def helix_starts(stride):
+        # Residues that start two consecutive n-turns start an helix.
+        consecutive = np.zeros(n_residues, dtype=bool)
+        consecutive[1:] = turns[stride][1:] & turns[stride][:-1]
+        return np.flatnonzero(consecutive)
+
+    for start in helix_starts(4):
+        secstructs[start:start + 4] = 'H'
+    for stride, code, allowed in ((3, 'G', 'CG'), (5, 'I', 'CI')):
+        for start in helix_starts(stride):
+            segment = secstructs[start:start + stride]
+            if all(secstruct in allowed for secstruct in segment):
+                secstructs[start:start + stride] = code
+
+    in_turn = np.zeros(n_residues, dtype=bool)
+    for stride in (3, 4, 5):
+        for shift in range(1, stride):
+            in_turn[shift:] |= turns[stride][:-shift]
+    kappa = _kappa_angles(positions_ca)
+    bent = np.zeros(n_residues, dtype=bool)
+    bent[2:-2] = ((kappa[2:-2] > _MIN_BEND_ANGLE)
+                  & backbone.no_break(indices[:-4], indices[4:]))
+    loop = secstructs == 'C'
+    loop[0] = loop[-1] = False
+    secstructs[loop & in_turn] = 'T'
+    secstructs[loop & ~in_turn & bent] = 'S'
+    return secstructs.tolist()
+
+
+def backbone_positions(molecule):
+    """
+    Gather the positions of the backbone atoms of each residue in a molecule.
+
+    Parameters
+    ----------
+    molecule: vermouth.molecule.Molecule
+
+    Returns
+    -------
+    positions: numpy.ndarray
+        Array of shape (n_residues, 4, 3) with the positions of the N, CA, C,
+        and O atoms of each residue, in that order. Missing atoms have NaN
+        positions.
+    chains: list
+        The chain of each residue.
+    resnames: list[str]
+        The residue name of each residue.
+    """
+    residues = list(molecule.iter_residues())
+    positions = np.full((len(residues), len(BACKBONE_ATOMS), 3), np.nan)
+    chains = []
+    resnames = []
+    atom_indices = {name: idx for idx, name in enumerate(BACKBONE_ATOMS)}
+    for residue_idx, residue in enumerate(residues):
+        first = molecule.nodes[residue[0]]
+        chains.append(first.get('chain'))
+        resnames.append(first.get('resname'))
+        for key in residue:
+            atom = molecule.nodes[key]
+            atom_idx = atom_indices.get(atom.get('atomname'))
+            if atom_idx is not None and atom.get('position') is not None:
+                positions[residue_idx, atom_idx] = atom['position']
+    return positions, chains, resnames
+
+
+def dssp_molecule(molecule):
+    """
+    Assign the secondary structure of each residue of a molecule.
+
+    Residues that miss a backbone atom are assigned as coil, and break the
+    chain.
+
+    Parameters
+    ----------
+    molecule: vermouth.molecule.Molecule
+
+    Returns
+    -------
+    list[str]
+        One secondary structure code per residue, in the order of
+        :meth:`vermouth.molecule.Molecule.iter_residues`.
+    """
+    positions, chains, resnames = backbone_positions(molecule)
+    complete = ~np.any(np.isnan(positions), axis=(1, 2))
+    indices = np.flatnonzero(complete)
+    # A residue starts a new segment if it is on a different chain than the
+    # previous complete residue, or if incomplete residues stand between
+    # them.
+    breaks = np.ones(len(indices), dtype=bool)
+    breaks[1:] = (np.diff(indices) != 1) | np.array(
+        [chains[left] != chains[right]
+         for left, right in zip(indices[:-1], indices[1:])], dtype=bool
+    )
+    prolines = np.array([resnames[idx] == 'PRO' for idx in indices], dtype=bool)
+    assigned = assign_secondary_structure(
+        *(positions[indices, atom_idx] for atom_idx in range(len(BACKBONE_ATOMS))),
+        breaks=breaks, prolines=prolines,
+    )
+    secstructs = ['C'] * len(positions)
+    for idx, secstruct in zip(indices, assigned):
+        secstructs[idx] = secstruct
+    return secstructs
+
+
+def format_dssp(molecule, secstructs):
+    """
+    Format a secondary structure assignation as a minimal DSSP file.
+
+    The output only contains the header line and the secondary structure
+    column, it can be read back by :func:`vermouth.dssp.dssp.read_dssp2`.
+
+    Parameters
+    ----------
+    molecule: vermouth.molecule.Molecule
+    secstructs: list[str]
+        One secondary structure code per residue.
+
+    Returns
+    -------
+    str
+    """
+    lines = [
+        '==== Secondary Structure Definition by the built-in DSSP of vermouth ====',
+        '  #  RESIDUE AA STRUCTURE',
+    ]
+    residues = molecule.iter_residues()
+    for number, (residue, secstruct) in enumerate(zip(residues, secstructs), start=1):
+        first = molecule.nodes[residue[0]]
+        lines.append('{:5d}{:5d} {:1.1} {:1}  {}'.format(
+            number, first.get('resid', number), str(first.get('chain') or ' '),
+            _ONE_LETTER.get(first.get('resname'), 'X'),
+            ' ' if secstruct == 'C' else secstruct,
+        ))
+    return '\n'.join(lines) + '\n'
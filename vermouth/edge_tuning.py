@@ -158,12 +158,13 @@ def add_edges_at_distance(molecule, threshold,
         molecule.nodes[key][attribute] for key in keys_b
     ])
 
-    distance_matrix = geometry.distance_matrix(coordinates_a, coordinates_b)
-    index_a, index_b = np.where(distance_matrix < threshold)
+    index_a, index_b, distances = geometry.pairs_within(
+        coordinates_a, coordinates_b, threshold
+    )
     edges = (
         (node1, node2, {'distance': distance})
         for node1, node2, distance
-        in zip(keys_a[index_a], keys_b[index_b], distance_matrix[index_a, index_b])
+        in zip(keys_a[index_a], keys_b[index_b], distances)
     )
 
     molecule.add_edges_from(edges)
@@ -224,9 +225,10 @@ def add_inter_molecule_edges(molecules, edges):
         for key in base_molecule:
             correspondance[(base_index, key)] = (new_index, key)
 
-        for other_index in component[1:]:
-            other_molecule = molecules[other_index]
-            mol_correspondance = base_molecule.merge_molecule(other_molecule)
+        mol_correspondances = base_molecule.concatenate(
+            molecules[other_index] for other_index in component[1:]
+        )
+        for other_index, mol_correspondance in zip(component[1:], mol_correspondances):
             for before, after in mol_correspondance.items():
                 correspondance[(other_index, before)] = (new_index, after)
 
@@ -21,6 +21,7 @@ from glob import glob
 import os
 from .gmx.rtp import read_rtp
 from .ffinput import read_ff
+from .molecule import LinkPredicate, Choice
 from . import DATA_PATH
 
 FORCE_FIELD_PARSERS = {'.rtp': read_rtp, '.ff': read_ff}
@@ -65,6 +66,7 @@ class ForceField(object):
         self.renamed_residues = {}
         self.variables = {}
         self.name = None
+        self._link_requirements = {}
         if directory is not None:
             self.read_from(directory)
             self.name = os.path.basename(str(directory))
@@ -124,6 +126,98 @@ class ForceField(object):
         """
         return feature in self.features
 
+    @property
+    def link_requirements(self):
+        """
+        List the facts each link requires from a molecule to apply.
+
+        The requirements are computed once per link, see
+        :func:`link_requirements`.
+
+        Returns
+        -------
+        list[frozenset[tuple]]
+            The requirements of each link, in the same order as
+            :attr:`links`.
+        """
+        cache = {}
+        requirements = []
+        for link in self.links:
+            try:
+                cached_link, link_facts = self._link_requirements[id(link)]
+            except KeyError:
+                cached_link = None
+            if cached_link is not link:
+                link_facts = link_requirements(link)
+            cache[id(link)] = (link, link_facts)
+            requirements.append(link_facts)
+        self._link_requirements = cache
+        return requirements
+
+
+def _required_values(value):
+    """
+    Get the values an attribute can take to match a value from a link.
+
+    Returns
+    -------
+    frozenset or None
+        ``None`` if the possible values cannot be enumerated.
+    """
+    if isinstance(value, Choice):
+        if not isinstance(value.value, (list, tuple, set, frozenset)):
+            return None
+        values = value.value
+    elif isinstance(value, LinkPredicate):
+        return None
+    else:
+        values = [value]
+    try:
+        return frozenset(values)
+    except TypeError:
+        return None
+
+
+def link_requirements(link):
+    """
+    List the facts a molecule must contain for a link to apply.
+
+    A fact is a tuple ``(kind, attribute, values)``. If `kind` is ``'node'``,
+    at least one node of the molecule must have its `attribute` set to one of
+    the `values`; a node without the attribute counts as having it set to
+    ``None``. If `kind` is ``'meta'``, the molecule meta attribute must be set
+    to one of the `values`.
+
+    These facts are necessary conditions for the link to apply, not sufficient
+    ones. Criteria that cannot be expressed as facts, such as link predicates
+    other than :class:`~vermouth.molecule.Choice`, or alternative patterns,
+    are not accounted for.
+
+    Parameters
+    ----------
+    link: vermouth.molecule.Link
+
+    Returns
+    -------
+    frozenset[tuple]
+    """
+    facts = set()
+    templates = [attributes for attributes in link.nodes.values()]
+    if len(link.patterns) == 1:
+        templates.extend(attributes for _, attributes in link.patterns[0])
+    for attributes in templates:
+        for attr, value in attributes.items():
+            if attr in ('order', 'replace'):
+                continue
+            values = _required_values(value)
+            if values is not None:
+                facts.add(('node', attr, values))
+    for key, value in link.molecule_meta.items():
+        values = _required_values(value)
+        if values is not None:
+            facts.add(('meta', key, values))
+    return frozenset(facts)
+
 
 def find_force_fields(directory, force_fields=None):
     """
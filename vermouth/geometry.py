@@ -19,14 +19,74 @@ Geometric operations.
 
 import numpy as np
 
+#: Default upper bound on the number of distances computed at once by
+#: :func:`iter_distance_matrix` and :func:`pairs_within`.
+DEFAULT_MAX_PAIRS = 2 ** 20
 
-def distance_matrix(coordinates_a, coordinates_b):
+
+def _box_matrix(box):
+    """
+    Read a periodic box as a (3, 3) matrix which rows are the box vectors.
+
+    A box given as 3 values is a rectangular box. A box given as a (3, 3)
+    matrix must be lower triangular, as GROMACS requires.
+    """
+    box = np.asarray(box, dtype=float)
+    if box.shape == (3, ):
+        box = np.diag(box)
+    if box.shape != (3, 3):
+        raise ValueError('A box must be given as 3 lengths or as a 3x3 matrix, '
+                         'not as an array of shape {}.'.format(box.shape))
+    if np.any(np.triu(box, k=1)):
+        raise ValueError('A triclinic box must be a lower triangular matrix.')
+    return box
+
+
+def minimum_image(vectors, box):
+    """
+    Apply the minimum image convention on vectors.
+
+    Each vector is shifted by a combination of box vectors so that it is as
+    short as possible. For triclinic boxes, the shifts are applied one box
+    vector at a time, from the last to the first, as GROMACS does; the result
+    is exact for boxes that are not too skewed. Dimensions where the box
+    length is 0 are not periodic.
+
+    Parameters
+    ----------
+    vectors: numpy.ndarray
+        Vectors as an array of shape (..., 3).
+    box: numpy.ndarray
+        The periodic box, either as the 3 lengths of a rectangular box, or as
+        a lower triangular (3, 3) matrix which rows are the box vectors.
+
+    Returns
+    -------
+    numpy.ndarray
+        The shifted vectors, with the same shape as `vectors`.
+
+    Raises
+    ------
+    ValueError
+        The box is not a valid box.
+    """
+    box = _box_matrix(box)
+    vectors = np.array(vectors, dtype=float)
+    for dim in reversed(range(3)):
+        if not box[dim, dim]:
+            continue
+        shifts = np.round(vectors[..., dim] / box[dim, dim])
+        vectors -= shifts[..., np.newaxis] * box[dim]
+    return vectors
+
+
+def distance_matrix(coordinates_a, coordinates_b, box=None):
     """
     Compute a distance matrix between two set of points.
 
     Notes
     -----
-    This function does **not** account for periodic boundary conditions.
+    Periodic boundary conditions are only accounted for if `box` is given.
 
     Parameters
     ----------
@@ -36,6 +96,8 @@ def distance_matrix(coordinates_a, coordinates_b):
     coordinates_b: numpy.ndarray
         Coordinates of the points in the selections. Each row must correspond
         to a point and each column to a dimension.
+    box: numpy.ndarray or None
+        The periodic box, see :func:`minimum_image`.
 
     Returns
     -------
@@ -43,11 +105,97 @@ def distance_matrix(coordinates_a, coordinates_b):
         Rows correspond to the points from `coordinates_a`, columns correspond
         from `coordinates_b`.
     """
-    return np.sqrt(
-        np.sum(
-            (coordinates_a[:, np.newaxis, :] - coordinates_b[np.newaxis, :, :]) ** 2,
-            axis=-1)
-    )
+    vectors = coordinates_a[:, np.newaxis, :] - coordinates_b[np.newaxis, :, :]
+    if box is not None:
+        vectors = minimum_image(vectors, box)
+    return np.sqrt(np.sum(vectors ** 2, axis=-1))
+
+
+def iter_distance_matrix(coordinates_a, coordinates_b, box=None,
+                         max_pairs=DEFAULT_MAX_PAIRS):
+    """
+    Compute a distance matrix between two set of points by blocks of rows.
+
+    At most `max_pairs` distances, but at least one row, are computed at
+    once, which bounds the memory needed for large selections.
+
+    Parameters
+    ----------
+    coordinates_a: numpy.ndarray
+        Coordinates of the points in the first selection, as an array of
+        shape (n, d).
+    coordinates_b: numpy.ndarray
+        Coordinates of the points in the second selection, as an array of
+        shape (m, d).
+    box: numpy.ndarray or None
+        The periodic box, see :func:`minimum_image`.
+    max_pairs: int
+        The maximum number of distances in a block.
+
+    Yields
+    ------
+    start: int
+        The index in `coordinates_a` of the first row of the block.
+    block: numpy.ndarray
+        The distances between the points of `coordinates_a` from `start`, and
+        the points of `coordinates_b`.
+
+    See Also
+    --------
+    distance_matrix
+        Compute the whole distance matrix at once.
+    """
+    rows = max(1, max_pairs // max(1, len(coordinates_b)))
+    for start in range(0, len(coordinates_a), rows):
+        block = distance_matrix(coordinates_a[start:start + rows], coordinates_b, box)
+        yield start, block
+
+
+def pairs_within(coordinates_a, coordinates_b, threshold, box=None,
+                 max_pairs=DEFAULT_MAX_PAIRS):
+    """
+    Find the pairs of points closer than a threshold.
+
+    The distances are computed by blocks with :func:`iter_distance_matrix`,
+    so the full distance matrix is never stored. The pairs are sorted by
+    index in `coordinates_a`, then by index in `coordinates_b`, as with
+    :func:`numpy.where` on the full distance matrix.
+
+    Parameters
+    ----------
+    coordinates_a: numpy.ndarray
+        Coordinates of the points in the first selection, as an array of
+        shape (n, d).
+    coordinates_b: numpy.ndarray
+        Coordinates of the points in the second selection, as an array of
+        shape (m, d).
+    threshold: float
+        Pairs are selected if their distance is strictly lower than this.
+    box: numpy.ndarray or None
+        The periodic box, see :func:`minimum_image`.
+    max_pairs: int
+        The maximum number of distances computed at once.
+
+    Returns
+    -------
+    index_a: numpy.ndarray
+        The index of the first point of each pair in `coordinates_a`.
+    index_b: numpy.ndarray
+        The index of the second point of each pair in `coordinates_b`.
+    distances: numpy.ndarray
+        The distance within each pair.
+    """
+    all_index_a = [np.zeros((0, ), dtype=int)]
+    all_index_b = [np.zeros((0, ), dtype=int)]
+    all_distances = [np.zeros((0, ))]
+    for start, block in iter_distance_matrix(coordinates_a, coordinates_b,
+                                             box, max_pairs):
+        index_a, index_b = np.where(block < threshold)
+        all_index_a.append(index_a + start)
+        all_index_b.append(index_b)
+        all_distances.append(block[index_a, index_b])
+    return (np.concatenate(all_index_a), np.concatenate(all_index_b),
+            np.concatenate(all_distances))
 
 
 def angle(vector_ba, vector_bc):
@@ -122,3 +270,178 @@ def dihedral_phase(coordinates):
     if dihedral_angle < -np.pi:
         dihedral_angle += 2 * np.pi
     return dihedral_angle
+
+
+def _row_dots(vectors_a, vectors_b):
+    """
+    Calculate the dot product of each row of two arrays of shape (n, d).
+    """
+    return np.einsum('ij,ij->i', vectors_a, vectors_b)
+
+
+def _row_norms(vectors):
+    return np.sqrt(_row_dots(vectors, vectors))
+
+
+def _difference(coordinates_to, coordinates_from, box):
+    vectors = coordinates_to - coordinates_from
+    if box is not None:
+        vectors = minimum_image(vectors, box)
+    return vectors
+
+
+def distances(coordinates_a, coordinates_b, box=None):
+    """
+    Calculate the distances between two series of points, row by row.
+
+    Parameters
+    ----------
+    coordinates_a: numpy.ndarray
+        The first point of each pair, as an array of shape (n, d).
+    coordinates_b: numpy.ndarray
+        The second point of each pair, as an array of shape (n, d).
+    box: numpy.ndarray or None
+        The periodic box, see :func:`minimum_image`.
+
+    Returns
+    -------
+    numpy.ndarray
+        The distance within each pair, as an array of shape (n, ).
+    """
+    vectors = _difference(coordinates_b, coordinates_a, box)
+    return np.sqrt(np.sum(vectors ** 2, axis=-1))
+
+
+def pair_distances(coordinates, box=None):
+    """
+    Calculate the distances within many pairs of points at once.
+
+    Parameters
+    ----------
+    coordinates: numpy.ndarray
+        The coordinates of the pairs, as an array of shape (n, 2, d).
+    box: numpy.ndarray or None
+        The periodic box, see :func:`minimum_image`.
+
+    Returns
+    -------
+    numpy.ndarray
+        The distance within each pair, as an array of shape (n, ).
+    """
+    return distances(coordinates[:, 0, :], coordinates[:, 1, :], box)
+
+
+def angles(vectors_ba, vectors_bc):
+    """
+    Calculate the angles in radians between many pairs of vectors at once.
+
+    Parameters
+    ----------
+    vectors_ba: numpy.ndarray
+        The first vector of each pair, as an array of shape (n, d).
+    vectors_bc: numpy.ndarray
+        The second vector of each pair, as an array of shape (n, d).
+
+    Returns
+    -------
+    numpy.ndarray
+        The angles, as an array of shape (n, ).
+
+    See Also
+    --------
+    angle
+        Calculate a single angle.
+    """
+    nominator = _row_dots(vectors_ba, vectors_bc)
+    denominator = _row_norms(vectors_ba) * _row_norms(vectors_bc)
+    cosine = np.clip(nominator / denominator, -1, 1)
+    return np.arccos(cosine)
+
+
+def triplet_angles(coordinates, box=None):
+    """
+    Calculate the angles in radians formed by many triplets of points at once.
+
+    For each triplet A, B, C, the angle is the one between BA and BC.
+
+    Parameters
+    ----------
+    coordinates: numpy.ndarray
+        The coordinates of the triplets, as an array of shape (n, 3, d).
+    box: numpy.ndarray or None
+        The periodic box, see :func:`minimum_image`.
+
+    Returns
+    -------
+    numpy.ndarray
+        The angles, as an array of shape (n, ).
+
+    See Also
+    --------
+    angles
+        Calculate the angles between pairs of vectors.
+    """
+    vectors_ba = _difference(coordinates[:, 0, :], coordinates[:, 1, :], box)
+    vectors_bc = _difference(coordinates[:, 2, :], coordinates[:, 1, :], box)
+    return angles(vectors_ba, vectors_bc)
+
+
+def dihedrals(coordinates, box=None):
+    """
+    Calculate many dihedral angles in radians at once.
+
+    Parameters
+    ----------
+    coordinates: numpy.ndarray
+        The coordinates of the 4 points defining each dihedral angle, as an
+        array of shape (n, 4, 3).
+    box: numpy.ndarray or None
+        The periodic box, see :func:`minimum_image`.
+
+    Returns
+    -------
+    numpy.ndarray
+        The angles between -pi and +pi, as an array of shape (n, ).
+
+    See Also
+    --------
+    dihedral
+        Calculate a single dihedral angle.
+    """
+    vectors_ab = _difference(coordinates[:, 1, :], coordinates[:, 0, :], box)
+    vectors_bc = _difference(coordinates[:, 2, :], coordinates[:, 1, :], box)
+    vectors_cd = _difference(coordinates[:, 3, :], coordinates[:, 2, :], box)
+    normals_abc = np.cross(vectors_ab, vectors_bc)
+    normals_bcd = np.cross(vectors_bc, vectors_cd)
+    psin = _row_dots(normals_abc, vectors_cd) * _row_norms(vectors_bc)
+    pcos = _row_dots(normals_abc, normals_bcd)
+    return np.arctan2(psin, pcos)
+
+
+def dihedral_phases(coordinates, box=None):
+    """
+    Calculate many dihedral angles in radians, with a -pi phase correction,
+    at once.
+
+    Parameters
+    ----------
+    coordinates: numpy.ndarray
+        The coordinates of the 4 points defining each dihedral angle, as an
+        array of shape (n, 4, 3).
+    box: numpy.ndarray or None
+        The periodic box, see :func:`minimum_image`.
+
+    Returns
+    -------
+    numpy.ndarray
+        The angles between -pi and +pi, as an array of shape (n, ).
+
+    See Also
+    --------
+    dihedral_phase
+        Calculate a single dihedral angle with a phase correction.
+    """
+    dihedral_angles = dihedrals(coordinates, box) - np.pi
+    dihedral_angles[dihedral_angles > np.pi] -= 2 * np.pi
+    dihedral_angles[dihedral_angles < -np.pi] += 2 * np.pi
+    return dihedral_angles
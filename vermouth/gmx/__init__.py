@@ -18,5 +18,6 @@ Provides functionality to read and write Gromacs specific files.
 
 
 from .gro import read_gro, write_gro
-from .itp import write_molecule_itp
+from .itp import write_molecule_itp, write_molecule_itps
+from .itp_read import read_itp, read_topology
 from .rtp import read_rtp
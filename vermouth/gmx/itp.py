@@ -16,10 +16,24 @@
 Handle the ITP file format from Gromacs.
 """
 
-import copy
+from concurrent.futures import ProcessPoolExecutor
 import itertools
+import multiprocessing
+from operator import itemgetter
 
-__all__ = ['write_molecule_itp', ]
+from ..log_helpers import StyleAdapter, get_logger
+
+__all__ = ['write_molecule_itp', 'write_molecule_itps']
+
+LOGGER = StyleAdapter(get_logger(__name__))
+
+#: Attributes written in the [ atoms ] section after the atom index.
+_ATOM_COLUMNS = ('atype', 'resid', 'resname', 'atomname',
+                 'charge_group', 'charge', 'mass')
+#: Alignment of the columns in :data:`_ATOM_COLUMNS`.
+_ATOM_ALIGNMENTS = ('<', '>', '<', '<', '>', '>', '>')
+#: Number of lines formatted before they are written to the file.
+_CHUNK_SIZE = 10000
 
 
 def _attr_has_not_none_attr(obj, attr):
@@ -55,6 +69,73 @@ def _interaction_sorting_key(interaction):
     return (conditional, group)
 
 
+def _group_interactions(interactions):
+    """
+    Group interactions by conditional and group, see
+    :func:`_interaction_sorting_key`.
+
+    The groups are sorted by key, and the interactions keep their relative
+    order within each group.
+
+    Returns
+    -------
+    list[tuple[tuple, list[vermouth.molecule.Interaction]]]
+    """
+    keys = [_interaction_sorting_key(interaction) for interaction in interactions]
+    first_key = keys[0]
+    # Most sections are made of a single group; they do not need sorting.
+    if all(key == first_key for key in keys):
+        return [(first_key, interactions)]
+    groups = {}
+    for key, interaction in zip(keys, interactions):
+        groups.setdefault(key, []).append(interaction)
+    return sorted(groups.items(), key=itemgetter(0))
+
+
+def _format_interactions(interactions, correspondence, virtual_sites=False):
+    """
+    Format the lines of an interaction section.
+
+    Parameters
+    ----------
+    interactions: list[vermouth.molecule.Interaction]
+    correspondence: dict
+        The aligned index to write for each atom key.
+    virtual_sites: bool
+        Whether the interactions are from the [ virtual_sitesn ] section, in
+        which the parameters come after the first atom.
+
+    Yields
+    ------
+    str
+        The lines, with their new line character.
+    """
+    get_index = correspondence.__getitem__
+    for atoms, parameters, meta in interactions:
+        atoms = list(map(get_index, atoms))
+        parameters = ' '.join(map(str, parameters))
+        if virtual_sites:
+            atoms.insert(1, parameters)
+        else:
+            atoms.append(parameters)
+        if 'comment' in meta:
+            atoms.append(';')
+            atoms.append(meta['comment'])
+        yield ' '.join(atoms) + '\n'
+
+
+def _write_lines(outfile, lines, chunk_size=_CHUNK_SIZE):
+    """
+    Write lines to a file in large chunks.
+    """
+    lines = iter(lines)
+    while True:
+        chunk = ''.join(itertools.islice(lines, chunk_size))
+        if not chunk:
+            break
+        outfile.write(chunk)
+
+
 def write_molecule_itp(molecule, outfile, header=(), moltype=None,
                        post_section_lines=None, pre_section_lines=None):
     """
@@ -111,20 +192,26 @@ def write_molecule_itp(molecule, outfile, header=(), moltype=None,
     # Make sure the molecule contains the information required to write the
     # [atoms] section. The charge and mass can be ommited, if so gromacs take
     # them from the [atomtypes] section of the ITP file.
+    atoms = list(molecule.atoms)
     for attribute in ('atype', 'resid', 'resname', 'atomname',
                       'charge_group'):
-        if not all([attribute in atom for _, atom in molecule.atoms]):
+        if not all(attribute in atom for _, atom in atoms):
             raise ValueError('Not all atom have a {}.'.format(attribute))
 
+    # Gather the columns of the [atoms] section once. The charge and the mass
+    # can be blank and read from the [atomtypes] section of the ITP file.
+    columns = [
+        [atom.get(attribute, '') for _, atom in atoms]
+        for attribute in _ATOM_COLUMNS
+    ]
+
     # Get the maximum length of each atom field so we can align the fields.
     # Atom indexes are written as a consecutive series starting from 1.
     # The maximum index of a 0-based series is `len(x) - 1`; because the
     # series starts at 1, the maximum value is `len(x).
-    max_length = {'idx': len(str(len(molecule)))}
-    for attribute in ('atype', 'resid', 'resname', 'atomname',
-                      'charge_group', 'charge', 'mass'):
-        max_length[attribute] = max(len(str(atom.get(attribute, '')))
-                                    for _, atom in molecule.atoms)
+    idx_length = len(str(len(molecule)))
+    column_lengths = [max(map(len, map(str, column)), default=0)
+                      for column in columns]
 
     # Write the header.
     # We want to follow the header with an empty line, only if there is a
@@ -152,32 +239,27 @@ def write_molecule_itp(molecule, outfile, header=(), moltype=None,
     # there is no guarantee that the molecule fulfill that constrain.
     # Therefore we renumber the atoms. The `correspondence` dict allows to
     # keep track of the correspondence between the original and the new
-    # numbering so we can apply the renumbering to the interactions.
+    # numbering so we can apply the renumbering to the interactions. It maps
+    # the original keys directly to the aligned new index.
     # The resid and charge_group should also be consecutive, though this is
     # left as the user responsibility. Make sure residues and charge groups are
     # correctly numbered.
-    correspondence = {}
+    correspondence = {
+        original_idx: '{:>{}}'.format(idx, idx_length)
+        for idx, (original_idx, _) in enumerate(atoms, start=1)
+    }
     outfile.write('[ atoms ]\n')
     seen_sections.add('atoms')
     for line in pre_section_lines.get('atoms', []):
         outfile.write(line + '\n')
-    for idx, (original_idx, atom) in enumerate(molecule.atoms, start=1):
-        correspondence[original_idx] = idx
-        new_atom = copy.copy(atom)
-        # The charge and the mass can be blank and read from the [atomtypes]
-        # section of the ITP file.
-        new_atom['charge'] = new_atom.get('charge', '')
-        new_atom['mass'] = new_atom.get('mass', '')
-
-        outfile.write('{idx:>{max_length[idx]}} '
-                      '{atype:<{max_length[atype]}} '
-                      '{resid:>{max_length[resid]}} '
-                      '{resname:<{max_length[resname]}} '
-                      '{atomname:<{max_length[atomname]}} '
-                      '{charge_group:>{max_length[charge_group]}} '
-                      '{charge:>{max_length[charge]}} '
-                      '{mass:>{max_length[mass]}}\n'
-                      .format(idx=idx, max_length=max_length, **new_atom))
+    atom_template = ' '.join(
+        '{{:{}{}}}'.format(alignment, length)
+        for alignment, length in zip(_ATOM_ALIGNMENTS, column_lengths)
+    ) + '\n'
+    atom_lines = map(atom_template.format, *columns)
+    _write_lines(outfile,
+                 (index + ' ' + line
+                  for index, line in zip(correspondence.values(), atom_lines)))
     for line in post_section_lines.get('atoms', []):
         outfile.write(line + '\n')
     outfile.write('\n')
@@ -197,34 +279,16 @@ def write_molecule_itp(molecule, outfile, header=(), moltype=None,
         seen_sections.add(name)
         for line in pre_section_lines.get(name, []):
             outfile.write(line + '\n')
-        interactions_group_sorted = sorted(
-            interactions,
-            key=_interaction_sorting_key
-        )
-        interaction_grouped = itertools.groupby(
-            interactions_group_sorted,
-            key=_interaction_sorting_key
-        )
-        for (conditional, group), interactions_in_group in interaction_grouped:
+        for (conditional, group), interactions_in_group in _group_interactions(interactions):
             if conditional:
                 conditional_key = conditional_keys[conditional[1]]
                 outfile.write('{} {}\n'.format(conditional_key, conditional[0]))
             if group:
                 outfile.write('; {}\n'.format(group))
-            for interaction in interactions_in_group:
-                atoms = ['{atom_idx:>{max_length[idx]}}'
-                         .format(atom_idx=correspondence[x],
-                                 max_length=max_length)
-                         for x in interaction.atoms]
-                parameters = ' '.join(str(x) for x in interaction.parameters)
-                comment = ''
-                if 'comment' in interaction.meta:
-                    comment = ' ; ' + interaction.meta['comment']
-                if name == 'virtual_sitesn':
-                    to_join = [atoms[0], parameters] + atoms[1:]
-                else:
-                    to_join = atoms + [parameters]
-                outfile.write(' '.join(to_join) + comment + '\n')
+            _write_lines(outfile, _format_interactions(
+                interactions_in_group, correspondence,
+                virtual_sites=(name == 'virtual_sitesn'),
+            ))
             if conditional:
                 outfile.write('#endif\n')
             for line in post_section_lines.get(name, []):
@@ -242,3 +306,114 @@ def write_molecule_itp(molecule, outfile, header=(), moltype=None,
         for line in post_section_lines.get(name, []):
             outfile.write(line + '\n')
         outfile.write('\n')
+
+
+def _itp_content(molecule):
+    """
+    Build a copy of a molecule with only what :func:`write_molecule_itp` reads.
+
+    The copy is much cheaper to send to an other process than the molecule,
+    as the atoms do not carry their atomistic graph nor their coordinates,
+    and the molecule does not refer to its force field.
+    """
+    content = molecule.__class__(nrexcl=molecule.nrexcl)
+    for key in ('moltype', 'post_section_lines', 'pre_section_lines'):
+        if key in molecule.meta:
+            content.meta[key] = molecule.meta[key]
+    content.add_nodes_from(
+        (key, {attribute: atom[attribute] for attribute in _ATOM_COLUMNS
+               if attribute in atom})
+        for key, atom in molecule.atoms
+    )
+    content.interactions = dict(molecule.interactions)
+    return content
+
+
+def _write_itp_file(task):
+    """
+    Write a molecule in an ITP file, and return the error if any.
+    """
+    molecule, path, header = task
+    try:
+        with open(str(path), 'w') as outfile:
+            write_molecule_itp(molecule, outfile, header=header)
+    except (OSError, ValueError) as error:
+        return error
+    return None
+
+
+class _ItpWorker:
+    """
+    The molecules to write in the worker processes of
+    :func:`write_molecule_itps`.
+
+    The molecules are given to each worker process once, when it starts, so
+    the tasks only need to refer to them by index. They are only set within
+    the worker processes, which belong to a single call.
+    """
+    molecules = None
+
+    @classmethod
+    def start(cls, molecules):
+        cls.molecules = molecules
+
+    @classmethod
+    def write(cls, task):
+        """
+        Write the molecule with the given index in an ITP file.
+        """
+        molecule_idx, path, header = task
+        return _write_itp_file((cls.molecules[molecule_idx], path, header))
+
+
+def write_molecule_itps(molecules, paths, header=(), processes=None):
+    """
+    Write molecules in ITP files, possibly in parallel.
+
+    Every file is attempted even if some fail. Each failure is logged with
+    the path of its file, then the first error is raised.
+
+    Parameters
+    ----------
+    molecules: collections.abc.Iterable[Molecule]
+        The molecules to write. See :func:`write_molecule_itp` for the
+        information they must contain.
+    paths: collections.abc.Iterable[str or pathlib.Path]
+        The path of the ITP file for each molecule.
+    header: collections.abc.Iterable[str]
+        Comment lines to write at the beginning of each file. See
+        :func:`write_molecule_itp`.
+    processes: int or None
+        The number of worker processes. The files are written from this
+        process if ``None`` or 1.
+
+    Raises
+    ------
+    OSError
+        A file could not be written.
+    ValueError
+        A molecule is missing required information.
+    """
+    molecules = list(molecules)
+    paths = list(paths)
+    header = list(header)
+    if processes is None or processes <= 1 or len(paths) <= 1:
+        errors = [_write_itp_file((molecule, path, header))
+                  for molecule, path in zip(molecules, paths)]
+    else:
+        # Forked workers inherit the molecules without copying them. Otherwise
+        # each worker receives a copy of them, so only send what is written.
+        if multiprocessing.get_start_method() != 'fork':
+            molecules = [_itp_content(molecule) for molecule in molecules]
+        with ProcessPoolExecutor(max_workers=processes,
+                                 initializer=_ItpWorker.start,
+                                 initargs=(molecules, )) as executor:
+            errors = list(executor.map(
+                _ItpWorker.write,
+                [(idx, path, header) for idx, path in enumerate(paths)],
+            ))
+    failures = [(path, error) for path, error in zip(paths, errors) if error is not None]
+    for path, error in failures:
+        LOGGER.error('Could not write "{}": {}', path, error, type='general')
+    if failures:
+        raise failures[0][1]
@@ -0,0 +1,468 @@
+# Copyright 2018 University of Groningen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Read molecule types from Gromacs ITP and TOP files.
+
+The files are read line by line through a preprocessor that follows the
+``#include`` directives, and evaluates the ``#ifdef``, ``#ifndef``,
+``#else``, ``#endif``, ``#define``, and ``#undef`` directives. Macros are
+not substituted in the interaction parameters; the parameters are kept as
+they are written so they can be written back.
+
+Conditional blocks that start within an interaction section of a molecule
+type are kept, rather than evaluated, as the "ifdef" or "ifndef" meta
+attribute of the interactions they contain; this is how
+:func:`~vermouth.gmx.itp.write_molecule_itp` writes them. Conditional blocks
+nested within such a block are evaluated.
+"""
+
+import os
+from pathlib import Path
+
+from ..molecule import Molecule, Interaction
+from ..log_helpers import StyleAdapter, get_logger
+
+__all__ = ['read_itp', 'read_topology']
+
+LOGGER = StyleAdapter(get_logger(__name__))
+
+#: Number of atoms in the interactions of each section of a molecule type.
+#: ``None`` means that the number of atoms is not fixed; see
+#: :func:`_split_interaction`.
+INTERACTION_ATOMS = {
+    'bonds': 2,
+    'pairs': 2,
+    'pairs_nb': 2,
+    'constraints': 2,
+    'settles': 1,
+    'angles': 3,
+    'dihedrals': 4,
+    'impropers': 4,
+    'cmap': 5,
+    'exclusions': None,
+    'virtual_sites2': 3,
+    'virtual_sites3': 4,
+    'virtual_sites4': 5,
+    'virtual_sitesn': None,
+    'position_restraints': 1,
+    'distance_restraints': 2,
+    'dihedral_restraints': 4,
+    'orientation_restraints': 2,
+    'angle_restraints': 4,
+    'angle_restraints_z': 2,
+}
+#: Sections of force field parameters. They are ignored.
+PARAMETER_SECTIONS = (
+    'defaults', 'atomtypes', 'bondtypes', 'pairtypes', 'angletypes',
+    'dihedraltypes', 'constrainttypes', 'nonbond_params', 'cmaptypes',
+    'implicit_genborn_params',
+)
+#: Interaction sections that make edges between their atoms.
+EDGE_SECTIONS = ('bonds', 'constraints')
+#: Function types of the improper dihedral angles. These angles are written in
+#: the [ dihedrals ] section, but are stored as "impropers".
+IMPROPER_FUNCTIONS = ('2', '4')
+#: Sections in which a conditional block cannot be kept.
+_UNCONDITIONAL_SECTIONS = ('moleculetype', 'atoms', 'system', 'molecules')
+
+
+def _join_continuations(lines):
+    """
+    Join the lines that end with a backslash with the next line.
+    """
+    pending = ''
+    for line in lines:
+        stripped = line.rstrip('\n')
+        if stripped.endswith('\\'):
+            pending += stripped[:-1] + ' '
+            continue
+        yield pending + stripped
+        pending = ''
+    if pending:
+        yield pending
+
+
+class _Preprocessor:
+    """
+    Stream the lines of a file through the Gromacs preprocessor directives.
+
+    Parameters
+    ----------
+    defines: collections.abc.Iterable[str] or dict[str, str]
+        The macros defined before the file is read.
+    include_dirs: collections.abc.Iterable[str or pathlib.Path]
+        Where to look for the included files that are not found relative to
+        the including file.
+    keep_conditionals: bool
+        Whether to keep the conditional blocks that start within an
+        interaction section rather than evaluate them.
+    """
+    def __init__(self, defines=(), include_dirs=(), keep_conditionals=True):
+        if isinstance(defines, dict):
+            self.defines = dict(defines)
+        else:
+            self.defines = {name: '' for name in defines}
+        self.include_dirs = [Path(path) for path in include_dirs]
+        self.keep_conditionals = keep_conditionals
+        self.section = None
+        # Each frame is a list [kind, name, value]. The kind is 'eval' for an
+        # evaluated block, and the value tells if the block is active; the
+        # kind is 'kept' for a block kept as a meta attribute, and the value
+        # tells if the block is an "ifdef"; the kind is 'skip' for a block
+        # within an inactive block.
+        self.frames = []
+
+    @property
+    def active(self):
+        """
+        Whether the current line is read.
+        """
+        return all(frame[0] == 'kept' or frame[2] for frame in self.frames)
+
+    @property
+    def conditional(self):
+        """
+        The conditional kept for the current line as a ``(name, is_ifdef)``
+        tuple, or ``None``.
+        """
+        for kind, name, value in self.frames:
+            if kind == 'kept':
+                return (name, value)
+        return None
+
+    def _find_include(self, name, directory):
+        for candidate_dir in [directory] + self.include_dirs:
+            candidate = Path(candidate_dir) / name
+            if candidate.is_file():
+                return candidate
+        raise IOError('Could not find the included file "{}".'.format(name))
+
+    def run(self, lines, directory='.'):
+        """
+        Iterate over the lines to read.
+
+        Parameters
+        ----------
+        lines: collections.abc.Iterable[str]
+        directory: str or pathlib.Path
+            The directory of the file, relative to which the included files
+            are looked for first.
+
+        Yields
+        ------
+        tuple[str, tuple or None]
+            Each line to read, and the conditional kept for it (see
+            :attr:`conditional`).
+
+        Raises
+        ------
+        IOError
+            A directive is malformed, is not supported, or an included file
+            cannot be found.
+        """
+        yield from self._run(lines, directory)
+        if self.frames:
+            raise IOError('Missing #endif at the end of the file.')
+
+    def _run(self, lines, directory):
+        for line in _join_continuations(lines):
+            stripped = line.strip()
+            if stripped.startswith('#'):
+                yield from self._directive(stripped[1:], directory)
+            elif self.active:
+                if stripped.startswith('['):
+                    self._section_header(stripped)
+                yield line, self.conditional
+
+    def _section_header(self, stripped):
+        name = stripped.split(';')[0].strip()[1:-1].strip()
+        if self.conditional is not None and name in _UNCONDITIONAL_SECTIONS:
+            raise IOError('The section [ {} ] cannot be within a conditional '
+                          'block of an interaction section.'.format(name))
+        self.section = name
+
+    def _directive(self, directive, directory):
+        fields = directive.split(';')[0].split(None, 1)
+        if not fields:
+            raise IOError('Empty preprocessor directive.')
+        command = fields[0]
+        argument = fields[1].strip() if len(fields) > 1 else ''
+        if command in ('ifdef', 'ifndef'):
+            if not argument:
+                raise IOError('Missing macro name after #{}.'.format(command))
+            name = argument.split()[0]
+            is_ifdef = command == 'ifdef'
+            if not self.active:
+                self.frames.append(['skip', name, False])
+            elif (self.keep_conditionals and self.conditional is None
+                  and self.section in INTERACTION_ATOMS):
+                self.frames.append(['kept', name, is_ifdef])
+            else:
+                self.frames.append(['eval', name, (name in self.defines) == is_ifdef])
+        elif command == 'else':
+            if not self.frames:
+                raise IOError('#else without #ifdef or #ifndef.')
+            frame = self.frames[-1]
+            if frame[0] != 'skip':
+                frame[2] = not frame[2]
+        elif command == 'endif':
+            if not self.frames:
+                raise IOError('#endif without #ifdef or #ifndef.')
+            self.frames.pop()
+        elif not self.active:
+            return
+        elif command in ('define', 'undef'):
+            if self.conditional is not None:
+                raise IOError('A macro cannot be defined or undefined within a '
+                              'conditional block that is kept.')
+            if not argument:
+                raise IOError('Missing macro name after #{}.'.format(command))
+            name, _, value = argument.partition(' ')
+            if command == 'define':
+                self.defines[name] = value.strip()
+            else:
+                self.defines.pop(name, None)
+        elif command == 'include':
+            name = argument.strip('"<>')
+            path = self._find_include(name, directory)
+            LOGGER.debug('Including "{}".', path, type='general')
+            with open(str(path)) as infile:
+                yield from self._run(infile, path.parent)
+        else:
+            raise IOError('Unsupported preprocessor directive "#{}".'
+                          .format(command))
+
+
+def _number(token):
+    """
+    Convert a token to an integer or a float if possible.
+    """
+    for converter in (int, float):
+        try:
+            return converter(token)
+        except ValueError:
+            pass
+    return token
+
+
+def _atom_key(molecule, token):
+    try:
+        key = int(token) - 1
+    except ValueError:
+        raise IOError('Invalid atom index "{}".'.format(token))
+    if key not in molecule:
+        raise IOError('Atom {} is not defined in the [ atoms ] section of '
+                      '"{}".'.format(token, molecule.meta['moltype']))
+    return key
+
+
+def _split_interaction(section, fields):
+    """
+    Split the fields of an interaction line into atoms and parameters.
+
+    In the [ virtual_sitesn ] section, the function type is between the
+    virtual site and the constructing atoms. In the [ exclusions ] section,
+    all the fields are atoms.
+    """
+    if section == 'virtual_sitesn':
+        return fields[:1] + fields[2:], fields[1:2]
+    natoms = INTERACTION_ATOMS[section]
+    if natoms is None:
+        return fields, []
+    if len(fields) < natoms:
+        raise IOError('Not enough atoms in the [ {} ] interaction "{}".'
+                      .format(section, ' '.join(fields)))
+    return fields[:natoms], fields[natoms:]
+
+
+def _parse_atom(molecule, fields):
+    if len(fields) < 6:
+        raise IOError('Not enough fields in the atom line "{}".'
+                      .format(' '.join(fields)))
+    attributes = {
+        'atype': fields[1],
+        'resid': int(fields[2]),
+        'resname': fields[3],
+        'atomname': fields[4],
+        'charge_group': int(fields[5]),
+    }
+    if len(fields) > 6:
+        attributes['charge'] = _number(fields[6])
+    if len(fields) > 7:
+        attributes['mass'] = _number(fields[7])
+    molecule.add_node(int(fields[0]) - 1, **attributes)
+
+
+def _parse_interaction(molecule, section, fields, meta):
+    atoms, parameters = _split_interaction(section, fields)
+    atoms = [_atom_key(molecule, token) for token in atoms]
+    if (section == 'dihedrals' and parameters
+            and parameters[0] in IMPROPER_FUNCTIONS):
+        section = 'impropers'
+    molecule.interactions.setdefault(section, []).append(
+        Interaction(atoms=atoms, parameters=parameters, meta=meta)
+    )
+    if section in EDGE_SECTIONS:
+        molecule.add_edge(atoms[0], atoms[1])
+
+
+def _read(lines, directory, force_field, defines, include_dirs,
+          keep_conditionals):
+    """
+    Read the molecule types, and the system composition, from the lines of a
+    file.
+
+    Returns
+    -------
+    moltypes: dict[str, vermouth.molecule.Molecule]
+    molecules: list[tuple[str, int]]
+    """
+    preprocessor = _Preprocessor(defines, include_dirs, keep_conditionals)
+    moltypes = {}
+    molecules = []
+    molecule = None
+    section = None
+    group = None
+    for line, conditional in preprocessor.run(lines, directory):
+        content, has_comment, comment = line.partition(';')
+        content = content.strip()
+        comment = comment.strip()
+        if not content:
+            # In interaction sections, a comment on its own line names the
+            # group of the interactions that follow, up to the next empty
+            # line.
+            if not has_comment:
+                group = None
+            elif molecule is not None and section in INTERACTION_ATOMS:
+                group = comment
+            continue
+        if content.startswith('['):
+            section = content[1:-1].strip()
+            group = None
+            if section not in INTERACTION_ATOMS and section not in (
+                    'moleculetype', 'atoms', 'system', 'molecules'):
+                if section not in PARAMETER_SECTIONS:
+                    raise IOError('Unknown section [ {} ].'.format(section))
+                LOGGER.debug('Ignoring the [ {} ] section.', section,
+                             type='general')
+            continue
+
+        fields = content.split()
+        if section == 'moleculetype':
+            if len(fields) != 2:
+                raise IOError('Invalid [ moleculetype ] line "{}".'.format(content))
+            name = fields[0]
+            molecule = Molecule(force_field=force_field, nrexcl=int(fields[1]))
+            molecule.meta['moltype'] = name
+            if name in moltypes:
+                LOGGER.warning('The molecule type "{}" is defined more than '
+                               'once. The last definition is kept.', name,
+                               type='general')
+            moltypes[name] = molecule
+        elif section == 'molecules':
+            if len(fields) != 2:
+                raise IOError('Invalid [ molecules ] line "{}".'.format(content))
+            molecules.append((fields[0], int(fields[1])))
+        elif section in ('atoms', ) or section in INTERACTION_ATOMS:
+            if molecule is None:
+                raise IOError('The section [ {} ] must come after a '
+                              '[ moleculetype ] section.'.format(section))
+            if section == 'atoms':
+                _parse_atom(molecule, fields)
+                continue
+            meta = {}
+            if group is not None:
+                meta['group'] = group
+            if comment:
+                meta['comment'] = comment
+            if conditional is not None:
+                meta['ifdef' if conditional[1] else 'ifndef'] = conditional[0]
+            _parse_interaction(molecule, section, fields, meta)
+    return moltypes, molecules
+
+
+def read_itp(lines, force_field=None, defines=(), include_dirs=(),
+             keep_conditionals=True):
+    """
+    Read the molecule types from the lines of an ITP file.
+
+    Parameters
+    ----------
+    lines: collections.abc.Iterable[str]
+        The lines of the file, e.g. a file handle. The lines are read one at
+        a time.
+    force_field: vermouth.forcefield.ForceField, optional
+        The force field to assign to the molecules.
+    defines: collections.abc.Iterable[str] or dict[str, str]
+        The macros defined before the file is read, as with the ``-D``
+        option of ``grompp``.
+    include_dirs: collections.abc.Iterable[str or pathlib.Path]
+        The directories where the included files are looked for, after the
+        current working directory.
+    keep_conditionals: bool
+        Keep the conditional blocks within interaction sections as meta
+        attributes of the interactions rather than evaluate them.
+
+    Returns
+    -------
+    dict[str, vermouth.molecule.Molecule]
+        The molecules keyed by their molecule type, in the order of the file.
+        The atom keys are the atom indices in the file minus one; the name of
+        the molecule type is in the "moltype" meta attribute.
+
+    Raises
+    ------
+    IOError
+        Something in the file could not be parsed.
+    """
+    moltypes, _ = _read(lines, os.getcwd(), force_field, defines,
+                        include_dirs, keep_conditionals)
+    return moltypes
+
+
+def read_topology(path, force_field=None, defines=(), include_dirs=(),
+                  keep_conditionals=True):
+    """
+    Read a Gromacs TOP file.
+
+    The included files are looked for relative to the including file first,
+    then in `include_dirs`.
+
+    Parameters
+    ----------
+    path: str or pathlib.Path
+    force_field: vermouth.forcefield.ForceField, optional
+    defines: collections.abc.Iterable[str] or dict[str, str]
+    include_dirs: collections.abc.Iterable[str or pathlib.Path]
+    keep_conditionals: bool
+        See :func:`read_itp`.
+
+    Returns
+    -------
+    moltypes: dict[str, vermouth.molecule.Molecule]
+        The molecule types, see :func:`read_itp`.
+    molecules: list[tuple[str, int]]
+        The content of the [ molecules ] section, as (molecule type, number of
+        molecules) tuples.
+
+    Raises
+    ------
+    IOError
+        Something in the file could not be parsed.
+    """
+    path = Path(path)
+    with open(str(path)) as infile:
+        return _read(infile, path.parent, force_field, defines,
+                     include_dirs, keep_conditionals)
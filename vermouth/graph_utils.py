@@ -20,6 +20,27 @@ import networkx as nx
 from .ismags import ISMAGS
 from .utils import maxes, first_alpha
 
+try:
+    _subgraph_view = nx.graphviews.subgraph_view
+except AttributeError:  # networkx < 2.2
+    _subgraph_view = nx.graphviews.SubGraph
+
+
+class _ShowNodes:
+    """
+    Node filter for subgraph views that keeps the nodes in order.
+
+    Unlike :class:`networkx.classes.filters.show_nodes`, which stores the
+    nodes in a set, the nodes are stored in a dict. Views built on this filter
+    list their nodes in the order they are given, or in the order of the
+    parent graph when the view spans most of it.
+    """
+    def __init__(self, nodes):
+        self.nodes = dict.fromkeys(nodes)
+
+    def __call__(self, node):
+        return node in self.nodes
+
 
 def add_element_attr(molecule):
     for node_idx in molecule:
@@ -105,7 +126,8 @@ def blockmodel(G, partitions, **attrs):
         A new graph where every node is a subgraph as specified by partitions.
         Node attributes:
 
-            :graph: Subgraph of constructing nodes.
+            :graph: Read-only subgraph view of constructing nodes. The nodes
+                of a partition should be listed in the order of ``G``.
             :nnodes: Number of nodes in ``graph``.
             :nedges: Number of edges in ``graph``.
             :density: Density of ``graph``.
@@ -115,7 +137,7 @@ def blockmodel(G, partitions, **attrs):
     attrs = {key: list(val) for key, val in attrs.items()}
     CG_mol = nx.Graph()
     for bead_idx, idxs in enumerate(partitions):
-        bd = G.subgraph(idxs)
+        bd = _subgraph_view(G, filter_node=_ShowNodes(idxs))
         CG_mol.add_node(bead_idx)
         CG_mol.node[bead_idx]['graph'] = bd
         # TODO: CoM instead of CoG
@@ -200,7 +222,8 @@ def make_residue_graph(mol):
         A graph with one node per residue. Node attributes:
 
             :chain: The chain identifier.
-            :graph: The atomistic subgraph.
+            :graph: A read-only view of the atomistic subgraph, with the
+                nodes in the order of ``mol``.
             :density: The density of ``graph``.
             :nedges: The number of edges in ``graph``.
             :nnodes: The number of nodes in ``graph``.
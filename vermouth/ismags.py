@@ -100,9 +100,202 @@ References
 
 from collections import defaultdict, Counter
 from functools import reduce, wraps
+import hashlib
 import itertools
 
-from .utils import are_all_equal
+from .utils import are_all_equal, LRUCache
+
+
+#: Version of the format written by :meth:`SymmetryCache.save`.
+SYMMETRY_CACHE_FORMAT = 2
+
+
+def symmetry_key(graph, node_partitions, edge_colors):
+    """
+    Build a key describing the input of a symmetry analysis.
+
+    Unlike :func:`hash`, the key is the same from one process to the next as
+    long as the node keys have a stable representation, such as integers.
+    This makes it suitable to store symmetries on disk.
+
+    Parameters
+    ----------
+    graph: networkx.Graph
+    node_partitions: list[set]
+    edge_colors: dict
+
+    Returns
+    -------
+    str
+        The hexadecimal digest describing the analysis.
+    """
+    description = repr((
+        tuple(graph.nodes),
+        tuple(graph.edges),
+        tuple(map(tuple, node_partitions)),
+        tuple(edge_colors.items()),
+    ))
+    return hashlib.sha256(description.encode('utf-8')).hexdigest()
+
+
+class SymmetryCache(LRUCache):
+    """
+    A bounded cache for the graph symmetries found by :class:`ISMAGS`.
+
+    See :class:`vermouth.utils.LRUCache` for how the cache behaves. Only
+    caches keyed with :func:`symmetry_key` are meaningful once written to
+    disk and read back by an other process.
+
+    Parameters
+    ----------
+    maxsize: int or None
+        The maximum number of symmetries to keep. The cache is not bounded
+        if ``None``.
+    """
+    file_format = SYMMETRY_CACHE_FORMAT
+    description = 'symmetry cache'
+
+
+#: The symmetry cache shared by all the users of :class:`ISMAGS` within the
+#: process that do not provide their own.
+SYMMETRY_CACHE = SymmetryCache()
+
+
+def _popcount(mask):
+    return bin(mask).count('1')
+
+
+def _iter_bits(mask):
+    """
+    Yield the indices of the bits set in `mask`, from the lowest.
+    """
+    while mask:
+        bit = mask & -mask
+        yield bit.bit_length() - 1
+        mask ^= bit
+
+
+def _ordered_nodes(graph):
+    """
+    The nodes of a graph, in the order :class:`ISMAGS` numbers them.
+
+    The nodes are sorted by key, so that ISMAGS prefers the nodes with the
+    lowest keys. Networkx allows node keys that cannot be compared with each
+    other, such as a mix of integers and strings; these nodes are numbered
+    in the order of the graph instead.
+
+    Parameters
+    ----------
+    graph: networkx.Graph
+
+    Returns
+    -------
+    list
+    """
+    nodes = list(graph.nodes)
+    try:
+        return sorted(nodes)
+    except TypeError:
+        return nodes
+
+
+class _CompiledGraphs:
+    """
+    The graph and subgraph of an :class:`ISMAGS` instance, with their nodes
+    replaced by integers and sets of nodes by bitsets.
+
+    The nodes of each graph are numbered in the order given by
+    :func:`_ordered_nodes`, so comparing node numbers is the same as
+    comparing node keys when they can be compared. A set of
+    nodes is an integer with the bit ``1 << number`` set for each node in the
+    set.
+
+    Attributes
+    ----------
+    g_nodes: list
+        The keys of the nodes in :attr:`ISMAGS.graph`, by number.
+    sg_nodes: list
+        The keys of the nodes in :attr:`ISMAGS.subgraph`, by number.
+    sg_index: dict
+        The number of each subgraph node key.
+    all_nodes: int
+        The bitset of all the nodes in the graph.
+    not_neighbours: list[int]
+        For each graph node, the bitset of the graph nodes it is not bonded
+        to.
+    colored_neighbours: list[dict[int, int]]
+        For each graph node, the bitsets of the graph nodes it is bonded to,
+        per edge color.
+    sg_edges: list[dict[int, int or None]]
+        For each subgraph node, the subgraph nodes it is bonded to, and the
+        color of the corresponding edges in the graph. The color is ``None``
+        if no graph edge is compatible.
+    """
+    def __init__(self, ismags):
+        graph = ismags.graph
+        subgraph = ismags.subgraph
+        self.g_nodes = _ordered_nodes(graph)
+        self.sg_nodes = _ordered_nodes(subgraph)
+        g_index = {node: idx for idx, node in enumerate(self.g_nodes)}
+        self.sg_index = {node: idx for idx, node in enumerate(self.sg_nodes)}
+        self.all_nodes = (1 << len(self.g_nodes)) - 1
+
+        neighbours = [0] * len(self.g_nodes)
+        self.colored_neighbours = [defaultdict(int) for _ in self.g_nodes]
+        for ge_color, edges in enumerate(ismags._ge_partitions):
+            for node1, node2 in edges:
+                idx1 = g_index[node1]
+                idx2 = g_index[node2]
+                neighbours[idx1] |= 1 << idx2
+                neighbours[idx2] |= 1 << idx1
+                self.colored_neighbours[idx1][ge_color] |= 1 << idx2
+                self.colored_neighbours[idx2][ge_color] |= 1 << idx1
+        self.not_neighbours = [self.all_nodes & ~mask for mask in neighbours]
+
+        self.sg_edges = [{} for _ in self.sg_nodes]
+        for (node1, node2), sge_color in ismags._sge_colors.items():
+            idx1 = self.sg_index[node1]
+            idx2 = self.sg_index[node2]
+            ge_color = ismags._edge_compatibility.get(sge_color)
+            self.sg_edges[idx1][idx2] = ge_color
+            self.sg_edges[idx2][idx1] = ge_color
+
+    def candidates(self, candidates):
+        """
+        Turn candidates, as made by :meth:`ISMAGS._find_nodecolor_candidates`,
+        into a list of bitsets indexed by subgraph node number.
+        """
+        g_index = {node: idx for idx, node in enumerate(self.g_nodes)}
+        masks = []
+        for sgn in self.sg_nodes:
+            mask = self.all_nodes
+            for options in candidates[sgn]:
+                option_mask = 0
+                for gn in options:
+                    option_mask |= 1 << g_index[gn]
+                mask &= option_mask
+            masks.append(mask)
+        return masks
+
+    def constraints(self, constraints):
+        """
+        Number the subgraph nodes in symmetry constraints.
+        """
+        return [(self.sg_index[low], self.sg_index[high])
+                for low, high in constraints]
+
+    def options(self, sgn, gn, sgn2):
+        """
+        The graph nodes `sgn2` can map to once `sgn` is mapped to `gn`.
+        """
+        try:
+            ge_color = self.sg_edges[sgn][sgn2]
+        except KeyError:
+            # Not bonded in the subgraph; the match is an induced subgraph.
+            return self.not_neighbours[gn]
+        if ge_color is None:
+            return 0
+        return self.colored_neighbours[gn].get(ge_color, 0)
 
 
 class ISMAGS:
@@ -160,8 +353,10 @@ class ISMAGS:
             :func:`~networkx.algorithms.isomorphism.categorical_edge_match` and
             friends.
             If `None`, all edges are considered equal.
-        cache: collections.abc.Mapping
-            A cache used for caching graph symmetries.
+        cache: collections.abc.MutableMapping
+            A cache used for caching graph symmetries, keyed by
+            :func:`symmetry_key`. See also :class:`SymmetryCache` and
+            :data:`SYMMETRY_CACHE`.
         """
         # TODO: graph and subgraph setter methods that invalidate the caches.
         # TODO: allow for precomputed partitions and colors
@@ -190,6 +385,8 @@ class ISMAGS:
         self._node_compat_ = None
         self._edge_compat_ = None
 
+        self._compiled_ = None
+
         if node_match is None:
             self.node_equality = self._node_match_maker(lambda n1, n2: True)
             self._sgn_partitions_ = [set(self.subgraph.nodes)]
@@ -287,6 +484,12 @@ class ISMAGS:
                 self._edge_compat_[sge_part_color] = ge_part_color
         return self._edge_compat_
 
+    @property
+    def _compiled(self):
+        if self._compiled_ is None:
+            self._compiled_ = _CompiledGraphs(self)
+        return self._compiled_
+
     @staticmethod
     def _node_match_maker(cmp):
         @wraps(cmp)
@@ -342,12 +545,11 @@ class ISMAGS:
             if extra_candidates:
                 candidates[sgn] = candidates[sgn] | {frozenset(extra_candidates)}
 
-        if any(candidates.values()):
-            start_sgn = min(candidates, key=lambda n: min(candidates[n], key=len))
-            candidates[start_sgn] = (intersect(candidates[start_sgn]),)
-            yield from self._map_nodes(start_sgn, candidates, constraints)
-        else:
-            return
+        compiled = self._compiled
+        candidates = compiled.candidates(candidates)
+        constraints = compiled.constraints(constraints)
+        nodes = frozenset(range(len(compiled.sg_nodes)))
+        yield from self._map_nodes(candidates, constraints, nodes)
 
     @staticmethod
     def _find_neighbor_color_count(graph, node, node_color, edge_color):
@@ -430,12 +632,10 @@ class ISMAGS:
         else:
             constraints = []
 
-        candidates = self._find_nodecolor_candidates()
-
-        if any(candidates.values()):
-            yield from self._largest_common_subgraph(candidates, constraints)
-        else:
-            return
+        compiled = self._compiled
+        candidates = compiled.candidates(self._find_nodecolor_candidates())
+        constraints = compiled.constraints(constraints)
+        yield from self._largest_common_subgraph(candidates, constraints)
 
     def analyze_symmetry(self, graph, node_partitions, edge_colors):
         """
@@ -453,10 +653,11 @@ class ISMAGS:
             can be interchanged without changing nodes less than `key`.
         """
         if self._symmetry_cache is not None:
-            key = hash((tuple(graph.nodes), tuple(graph.edges),
-                        tuple(map(tuple, node_partitions)), tuple(edge_colors.items())))
-            if key in self._symmetry_cache:
+            key = symmetry_key(graph, node_partitions, edge_colors)
+            try:
                 return self._symmetry_cache[key]
+            except KeyError:
+                pass
         node_partitions = list(self._refine_node_partitions(graph,
                                                             node_partitions,
                                                             edge_colors))
@@ -630,104 +831,87 @@ class ISMAGS:
         for n_p in output:
             yield from cls._refine_node_partitions(graph, n_p, edge_colors, branch)
 
-    def _edges_of_same_color(self, sgn1, sgn2):
-        """
-        Returns all edges in :attr:`graph` that have the same colour as the
-        edge between sgn1 and sgn2 in :attr:`subgraph`.
-        """
-        if (sgn1, sgn2) in self._sge_colors:
-            # FIXME directed graphs
-            sge_color = self._sge_colors[sgn1, sgn2]
-        else:
-            sge_color = self._sge_colors[sgn2, sgn1]
-        if sge_color in self._edge_compatibility:
-            ge_color = self._edge_compatibility[sge_color]
-            g_edges = self._ge_partitions[ge_color]
-        else:
-            g_edges = []
-        return g_edges
-
-    def _map_nodes(self, sgn, candidates, constraints, mapping=None, to_be_mapped=None):
+    def _map_nodes(self, candidates, constraints, nodes):
         """
         Find all subgraph isomorphisms honoring constraints.
-        """
-        if mapping is None:
-            mapping = {}
-        else:
-            mapping = mapping.copy()
-        if to_be_mapped is None:
-            to_be_mapped = set(self.subgraph.nodes)
-
-        # Note, we modify candidates here. Doesn't seem to affect results, but
-        # remember this.
-        #candidates = candidates.copy()
-        sgn_candidates = intersect(candidates[sgn])
-        candidates[sgn] = frozenset([sgn_candidates])
-        for gn in sgn_candidates:
-            # We're going to try to map sgn to gn.
-
-            # First, let's see if that would violate a constraint.
-            # It's probably better to integrate the constraints infinding the
-            # candidates below, *and* somehow propagating them. That *should*
-            # reduce the search space. Of course it won't matter for asymmetric
-            # subgraphs.
-            violation = False
-            for constraint in constraints:
-                low, high = constraint
-                # gn violates upper bound
-                too_high = low == sgn and high in mapping and gn > mapping[high]
-                # gn violates lower bound
-                too_low = high == sgn and low in mapping and gn < mapping[low]
-                if too_high or too_low:
-                    violation = True
-                    break
-            if violation or (gn in mapping.values()) or (sgn not in to_be_mapped):
-                # This either violates a constraint, or gn is already mapped to
-                # something
-                # Don't measure coverage for this line.
-                # See https://github.com/nedbat/coveragepy/issues/198
-                continue  # pragma: no cover
-
-            # REDUCTION and COMBINATION
-            mapping[sgn] = gn
-            # BASECASE
-            if to_be_mapped == set(mapping.keys()):
-                yield {v: k for k, v in mapping.items()}
-                continue
 
-            new_candidates = candidates.copy()
-            sgn_neighbours = set(self.subgraph[sgn])
-            not_gn_neighbours = set(self.graph.nodes) - set(self.graph[gn])
-            for sgn2 in self.subgraph:
-                if sgn2 not in sgn_neighbours:
-                    gn2_options = not_gn_neighbours
-                else:
-                    # Get all edges to gn of the right color:
-                    g_edges = self._edges_of_same_color(sgn, sgn2)
-                    # FIXME directed graphs
-                    # And all nodes involved in those which are connected to gn
-                    gn2_options = {n for e in g_edges for n in e if gn in e}
-                # Node color compatibility should be taken care of by the
-                # initial candidate lists made by find_subgraphs
-
-                # Add gn2_options to the right collection. Since new_candidates
-                # is a dict of frozensets of frozensets of node indices it's
-                # a bit clunky. We can't do .add, and + also doesn't work. We
-                # could do |, but I deem union to be clearer.
-                new_candidates[sgn2] = new_candidates[sgn2].union([frozenset(gn2_options)])
+        Parameters
+        ----------
+        candidates: list[int]
+            For each subgraph node number, the bitset of the graph nodes it
+            can map to.
+        constraints: list[tuple[int, int]]
+            Symmetry constraints, as subgraph node numbers. The first node of
+            a pair must map to a lower graph node than the second.
+        nodes: frozenset[int]
+            The subgraph nodes to map.
+
+        Yields
+        ------
+        dict
+            The found isomorphism mappings of {graph_node: subgraph_node},
+            with the original node keys.
+        """
+        compiled = self._compiled
+        g_nodes = compiled.g_nodes
+        sg_nodes = compiled.sg_nodes
+        ordered_nodes = sorted(nodes)
+        upper_bounds = defaultdict(list)
+        lower_bounds = defaultdict(list)
+        for low, high in constraints:
+            upper_bounds[low].append(high)
+            lower_bounds[high].append(low)
+        # {subgraph node: graph node}, in the order the nodes are mapped.
+        mapping = {}
+
+        def next_node(candidates, used):
             # The next node is the one that is unmapped and has fewest
-            # candidates
-            # Pylint disables because it's a one-shot function.
-            next_sgn = min(to_be_mapped - set(mapping.keys()),
-                           key=lambda n: min(new_candidates[n], key=len))  # pylint: disable=cell-var-from-loop
-            yield from self._map_nodes(next_sgn,
-                                       new_candidates,
-                                       constraints,
-                                       mapping=mapping,
-                                       to_be_mapped=to_be_mapped)
-            # Unmap sgn-gn. Strictly not necessary since it'd get overwritten
-            # when making a new mapping for sgn.
-            #del mapping[sgn]
+            # candidates left. Returns None if a node has no candidate.
+            best = None
+            best_count = None
+            for sgn in ordered_nodes:
+                if sgn in mapping:
+                    continue
+                count = _popcount(candidates[sgn] & ~used)
+                if best_count is None or count < best_count:
+                    best = sgn
+                    best_count = count
+                    if not count:
+                        return None
+            return best
+
+        def extend(sgn, candidates, used):
+            sgn_candidates = candidates[sgn] & ~used
+            # It's probably better to integrate the constraints in the
+            # candidates of all nodes, and somehow propagate them. That
+            # *should* reduce the search space. Of course it won't matter for
+            # asymmetric subgraphs.
+            for high in upper_bounds.get(sgn, ()):
+                if high in mapping:
+                    sgn_candidates &= (1 << mapping[high]) - 1
+            for low in lower_bounds.get(sgn, ()):
+                if low in mapping:
+                    sgn_candidates &= ~((1 << mapping[low]) - 1)
+            for gn in _iter_bits(sgn_candidates):
+                # REDUCTION and COMBINATION
+                mapping[sgn] = gn
+                # BASECASE
+                if len(mapping) == len(ordered_nodes):
+                    yield {g_nodes[gn2]: sg_nodes[sgn2] for sgn2, gn2 in mapping.items()}
+                    continue
+                new_candidates = list(candidates)
+                for sgn2 in ordered_nodes:
+                    if sgn2 not in mapping:
+                        new_candidates[sgn2] &= compiled.options(sgn, gn, sgn2)
+                new_used = used | (1 << gn)
+                next_sgn = next_node(new_candidates, new_used)
+                if next_sgn is not None:
+                    yield from extend(next_sgn, new_candidates, new_used)
+            mapping.pop(sgn, None)
+
+        start_sgn = next_node(candidates, 0)
+        if start_sgn is not None:
+            yield from extend(start_sgn, candidates, 0)
 
     def _largest_common_subgraph(self, candidates, constraints,
                                  to_be_mapped=None):
@@ -735,7 +919,7 @@ class ISMAGS:
         Find all largest common subgraphs honoring constraints.
         """
         if to_be_mapped is None:
-            to_be_mapped = {frozenset(self.subgraph.nodes)}
+            to_be_mapped = {frozenset(range(len(self._compiled.sg_nodes)))}
 
         # The LCS problem is basically a repeated subgraph isomorphism problem
         # with smaller and smaller subgraphs. We store the nodes that are
@@ -756,9 +940,7 @@ class ISMAGS:
             # theory.
             for nodes in sorted(to_be_mapped, key=sorted):
                 # Find the isomorphism between subgraph[to_be_mapped] <= graph
-                next_sgn = min(nodes, key=lambda n: min(candidates[n], key=len))
-                isomorphs = self._map_nodes(next_sgn, candidates, constraints,
-                                            to_be_mapped=nodes)
+                isomorphs = self._map_nodes(candidates, constraints, nodes)
 
                 # This is effectively `yield from isomorphs`, except that we look
                 # whether an item was yielded.
@@ -890,11 +1072,16 @@ class ISMAGS:
 
     def _process_ordered_pair_partitions(self, graph, top_partitions,
                                          bottom_partitions, edge_colors,
-                                         orbits=None, cosets=None):
+                                         orbits=None, cosets=None, ranks=None):
         """
         Processes ordered pair partitions as per the reference paper. Finds and
         returns all permutations and cosets that leave the graph unchanged.
+
+        The nodes are compared through their rank in :func:`_ordered_nodes`,
+        given as `ranks`.
         """
+        if ranks is None:
+            ranks = {node: idx for idx, node in enumerate(_ordered_nodes(graph))}
         if orbits is None:
             orbits = [{node} for node in graph.nodes]
         else:
@@ -923,10 +1110,10 @@ class ISMAGS:
         unmapped_nodes = {(node, idx)
                           for idx, t_partition in enumerate(top_partitions)
                           for node in t_partition if len(t_partition) > 1}
-        node, pair_idx = min(unmapped_nodes)
+        node, pair_idx = min(unmapped_nodes, key=lambda item: (ranks[item[0]], item[1]))
         b_partition = bottom_partitions[pair_idx]
 
-        for node2 in sorted(b_partition):
+        for node2 in sorted(b_partition, key=ranks.__getitem__):
             if len(b_partition) == 1:
                 # Can never result in symmetry
                 continue
@@ -946,14 +1133,15 @@ class ISMAGS:
                                                           new_bottom_partitions,
                                                           edge_colors,
                                                           orbits,
-                                                          cosets)
+                                                          cosets,
+                                                          ranks)
                 # COMBINATION
                 permutations += new_perms
                 cosets.update(new_cosets)
 
         mapped = {k for top, bottom in zip(top_partitions, bottom_partitions)
                   for k in top if len(top) == 1 and top == bottom}
-        ks = {k for k in graph.nodes if k < node}
+        ks = {k for k in graph.nodes if ranks[k] < ranks[node]}
         # Have all nodes with ID < node been mapped?
         find_coset = ks <= mapped and node not in cosets
         if find_coset:
@@ -225,6 +225,54 @@ class LinkParameterEffector:
             result = '{value:{format}}'.format(value=result, format=self.format)
         return result
 
+    def batch(self, molecule, matches):
+        """
+        Calculate the parameter value for many matches at once.
+
+        Parameters
+        ----------
+        molecule: Molecule
+            The molecule from which to calculate the parameter values.
+        matches: list[dict]
+            The correspondences between the nodes from the link (keys), and
+            the nodes from the molecule (values).
+
+        Returns
+        -------
+        list
+            The calculated parameter value for each match, formatted if
+            required.
+        """
+        keys = [[match[key] for key in self.keys] for match in matches]
+        if not keys:
+            return []
+        results = self._apply_batch(molecule, keys)
+        if self.format is not None:
+            results = ['{value:{format}}'.format(value=result, format=self.format)
+                       for result in results]
+        return list(results)
+
+    def _apply_batch(self, molecule, keys):
+        """
+        Calculate the parameter values for many lists of keys.
+
+        By default, :meth:`_apply` is called for each list of keys. Subclasses
+        can compute all the values at once.
+
+        Parameters
+        ----------
+        molecule: Molecule
+            The molecule from which to compute the parameter values.
+        keys: list[list]
+            A list of keys to use from the molecule for each value.
+
+        Returns
+        -------
+        collections.abc.Iterable[float]
+            The value for each list of keys.
+        """
+        return [self._apply(molecule, node_keys) for node_keys in keys]
+
     def _apply(self, molecule, keys):
         """
         Calculate the parameter value from the molecule.
@@ -249,12 +297,38 @@ class LinkParameterEffector:
         raise NotImplementedError(msg)
 
 
+def _gather_positions(molecule, keys):
+    """
+    Gather the positions of the nodes of a molecule in an array.
+
+    Parameters
+    ----------
+    molecule: Molecule
+    keys: list[list]
+        The node keys to gather, as many lists of the same length.
+
+    Returns
+    -------
+    numpy.ndarray
+        The positions as an array of shape (len(keys), len(keys[0]), 3).
+    """
+    # This will raise a KeyError if an atom is missing, or if an atom does not
+    # have position.
+    nodes = molecule.nodes
+    return np.array([[nodes[key]['position'] for key in node_keys]
+                     for node_keys in keys])
+
+
 class ParamDistance(LinkParameterEffector):
     """
     Calculate the distance between a pair of nodes.
     """
     n_keys_asked = 2
 
+    @staticmethod
+    def _apply_batch(molecule, keys):
+        return geometry.pair_distances(_gather_positions(molecule, keys))
+
     def _apply(self, molecule, keys):
         # This will raise a ValueError if an atom is missing, or if an
         # atom does not have position.
@@ -271,6 +345,13 @@ class ParamAngle(LinkParameterEffector):
     """
     n_keys_asked = 3
 
+    @staticmethod
+    def _apply_batch(molecule, keys):
+        positions = _gather_positions(molecule, keys)
+        vectors_ba = positions[:, 0, :] - positions[:, 1, :]
+        vectors_bc = positions[:, 2, :] - positions[:, 1, :]
+        return np.degrees(geometry.angles(vectors_ba, vectors_bc))
+
     @staticmethod
     def _apply(molecule, keys):
         # This will raise a ValueError if an atom is missing, or if an
@@ -288,6 +369,10 @@ class ParamDihedral(LinkParameterEffector):
     """
     n_keys_asked = 4
 
+    @staticmethod
+    def _apply_batch(molecule, keys):
+        return np.degrees(geometry.dihedrals(_gather_positions(molecule, keys)))
+
     @staticmethod
     def _apply(molecule, keys):
         # This will raise a ValueError if an atom is missing, or if an
@@ -304,6 +389,10 @@ class ParamDihedralPhase(LinkParameterEffector):
     """
     n_keys_asked = 4
 
+    @staticmethod
+    def _apply_batch(molecule, keys):
+        return np.degrees(geometry.dihedral_phases(_gather_positions(molecule, keys)))
+
     @staticmethod
     def _apply(molecule, keys):
         # This will raise a ValueError if an atom is missing, or if an
@@ -331,6 +420,10 @@ class Molecule(nx.Graph):
     determines in what order atoms will be written in the output. Same goes for
     the interactions within an interaction type. The order of edges is not
     guaranteed anywhere in the code, and they are not writen in the output.
+
+    Adding or removing nodes or edges increments
+    :attr:`structure_version`. It is used to cache values that depend on the
+    structure of the molecule, such as :attr:`residue_graph`.
     """
     # As the particles are stored as nodes, we want the nodes to stay
     # ordered.
@@ -340,9 +433,22 @@ class Molecule(nx.Graph):
         self.meta = kwargs.pop('meta', {})
         self._force_field = kwargs.pop('force_field', None)
         self.nrexcl = kwargs.pop('nrexcl', None)
+        # The graph can be populated by the parent's __init__, so the version
+        # must exist before.
+        self._structure_version = 0
+        self._residue_graph_cache = None
+        # The offset of the last node, see :meth:`concatenate`.
+        self._last_node_cache = None
         super().__init__(*args, **kwargs)
         self.interactions = defaultdict(list)
 
+    def __getstate__(self):
+        # The cached residue graph holds views on the molecule; it is cheaper
+        # to build it again than to store it.
+        state = self.__dict__.copy()
+        state['_residue_graph_cache'] = None
+        return state
+
     def __eq__(self, other):
         return (
             self.nrexcl == other.nrexcl
@@ -384,11 +490,27 @@ class Molecule(nx.Graph):
         """
         Creates a copy of the molecule.
 
+        The node and edge attribute dicts, and the lists of interactions, are
+        copied; the attribute values and the interactions themselves are
+        shared with the original molecule.
+
         Returns
         -------
         Molecule
         """
-        return self.subgraph(self.nodes)
+        new = self.__class__()
+        new.name = self.name
+        new.meta = copy.copy(self.meta)
+        new._force_field = self._force_field
+        new.nrexcl = self.nrexcl
+        # Unlike :meth:`subgraph`, all the nodes are kept, so the edges and the
+        # interactions do not need to be filtered.
+        new.add_nodes_from(self.nodes.items())
+        new.add_edges_from(self.edges(data=True))
+        for interaction_type, interactions in self.interactions.items():
+            if interactions:
+                new.interactions[interaction_type] = list(interactions)
+        return new
 
     def subgraph(self, nodes):
         """
@@ -405,17 +527,20 @@ class Molecule(nx.Graph):
         subgraph._force_field = self._force_field
         subgraph.nrexcl = self.nrexcl
 
-        node_copies = [(node, copy.copy(self.nodes[node])) for node in nodes]
-        subgraph.add_nodes_from(node_copies)
+        # add_nodes_from and add_edges_from copy the attribute dicts.
+        subgraph.add_nodes_from((node, self.nodes[node]) for node in nodes)
 
         nodes = set(nodes)
 
-        #edges_to_add = [
-        #    (node, node2)
-        #    for node in nodes
-        #    for node2 in set(self[node]) & nodes
-        #]
-        subgraph.add_edges_from(self.edges_between(nodes, nodes, data=True))
+        # Each edge is added once, from the first of its nodes to be visited.
+        visited = set()
+        for node in nodes:
+            subgraph.add_edges_from(
+                (node, neighbour, attributes)
+                for neighbour, attributes in self.adj[node].items()
+                if neighbour in nodes and neighbour not in visited
+            )
+            visited.add(node)
 
         for interaction_type, interactions in self.interactions.items():
             for interaction in interactions:
@@ -611,45 +736,118 @@ class Molecule(nx.Graph):
         dict
             A dict mapping the node indices of the added `molecule` to their
             new indices in this molecule.
+
+        See Also
+        --------
+        concatenate
         """
-        if self.force_field != molecule.force_field:
-            raise ValueError(
-                'Cannot merge molecules with different force fields.'
-            )
-        if self.nrexcl is None and not self:
-            self.nrexcl = molecule.nrexcl
-        if self.nrexcl != molecule.nrexcl:
-            raise ValueError(
-                'Cannot merge molecules with different nrexcl. '
-                'This molecule has nrexcl={}, while the other has nrexcl={}.'
-                .format(self.nrexcl, molecule.nrexcl)
-            )
+        return self.concatenate([molecule])[0]
+
+    def concatenate(self, molecules):
+        """
+        Add the atoms and the interactions of several molecules at the end of
+        this one.
+
+        This is equivalent to calling :meth:`merge_molecule` for each
+        molecule in turn, but the offsets are computed once, and the nodes,
+        edges, and interactions are added in bulk. The molecules are all
+        checked before any is added.
+
+        Parameters
+        ----------
+        molecules: collections.abc.Iterable[Molecule]
+            The molecules to merge at the end, in order.
+
+        Returns
+        -------
+        list[dict]
+            For each molecule, a dict mapping its node indices to their new
+            indices in this molecule.
+
+        Raises
+        ------
+        ValueError
+            If a molecule has a different force field or a different nrexcl.
+        """
+        molecules = list(molecules)
+        nrexcl = self.nrexcl
+        is_empty = not self
+        for molecule in molecules:
+            if self.force_field != molecule.force_field:
+                raise ValueError(
+                    'Cannot merge molecules with different force fields.'
+                )
+            if nrexcl is None and is_empty:
+                nrexcl = molecule.nrexcl
+            if nrexcl != molecule.nrexcl:
+                raise ValueError(
+                    'Cannot merge molecules with different nrexcl. '
+                    'This molecule has nrexcl={}, while the other has nrexcl={}.'
+                    .format(nrexcl, molecule.nrexcl)
+                )
+            is_empty = is_empty and not molecule
+        self.nrexcl = nrexcl
+
         if self.nodes():
-            # We assume that the last id is always the largest.
-            last_node_idx = max(self)
+            # We assume that the last id is always the largest. The largest
+            # key is remembered, so merging molecules one at a time at the
+            # end of a growing molecule does not go over all its nodes
+            # every time.
+            cached = self._last_node_cache
+            if cached is not None and cached[0] == self._structure_version:
+                last_node_idx = cached[1]
+            else:
+                last_node_idx = max(self)
+            last_node = self.nodes[last_node_idx]
             offset = last_node_idx
-            residue_offset = self.nodes[last_node_idx]['resid']
-            offset_charge_group = self.nodes[last_node_idx].get('charge_group', 1)
+            residue_offset = last_node['resid']
+            offset_charge_group = last_node.get('charge_group', 1)
         else:
             offset = 0
             residue_offset = 0
             offset_charge_group = 0
-        correspondence = {}
-        for idx, node in enumerate(molecule.nodes(), start=offset + 1):
-            correspondence[node] = idx
-            new_atom = copy.copy(molecule.nodes[node])
-            new_atom['resid'] = (new_atom.get('resid', 1) + residue_offset)
-            new_atom['charge_group'] = (new_atom.get('charge_group', 1)
-                                        + offset_charge_group)
-            self.add_node(idx, **new_atom)
-        for name, interactions in molecule.interactions.items():
-            for interaction in interactions:
-                atoms = tuple(correspondence[atom] for atom in interaction.atoms)
-                self.add_interaction(name, atoms, interaction.parameters, interaction.meta)
-        for node1, node2 in molecule.edges:
-            if correspondence[node1] != correspondence[node2]:
-                self.add_edge(correspondence[node1], correspondence[node2])
-        return correspondence
+
+        correspondences = []
+        new_nodes = []
+        new_edges = []
+        new_interactions = []
+        for molecule in molecules:
+            correspondence = {}
+            for idx, (node, attributes) in enumerate(molecule.nodes.items(), start=offset + 1):
+                correspondence[node] = idx
+                new_atom = dict(attributes)
+                new_atom['resid'] = attributes.get('resid', 1) + residue_offset
+                new_atom['charge_group'] = (attributes.get('charge_group', 1)
+                                            + offset_charge_group)
+                new_nodes.append((idx, new_atom))
+            for name, interactions in molecule.interactions.items():
+                new_interactions.append((name, [
+                    Interaction(
+                        atoms=tuple(correspondence[atom] for atom in interaction.atoms),
+                        parameters=interaction.parameters,
+                        meta=interaction.meta,
+                    )
+                    for interaction in interactions
+                ]))
+            new_edges.extend(
+                (correspondence[node1], correspondence[node2])
+                for node1, node2 in molecule.edges
+                if correspondence[node1] != correspondence[node2]
+            )
+            correspondences.append(correspondence)
+            if new_nodes and new_nodes[-1][0] > offset:
+                offset, last_node = new_nodes[-1]
+                residue_offset = last_node['resid']
+                offset_charge_group = last_node['charge_group']
+
+        self.add_nodes_from(new_nodes)
+        for name, interactions in new_interactions:
+            if interactions:
+                self.interactions[name].extend(interactions)
+        self.add_edges_from(new_edges)
+        if self:
+            self._last_node_cache = (self._structure_version, offset)
+        return correspondences
 
     def share_moltype_with(self, other):
         """
@@ -666,6 +864,15 @@ class Molecule(nx.Graph):
         """
         # TODO: Test the node attributes, the molecule attributes, and
         # the interactions.
+        if len(self) != len(other) or self.number_of_edges() != other.number_of_edges():
+            return False
+        # Copies of a same molecule, such as the lipids of a membrane, usually
+        # have their nodes in the same order. Checking that case is linear,
+        # while the general isomorphism test is not.
+        correspondence = dict(zip(self.nodes, other.nodes))
+        if all(other.has_edge(correspondence[left], correspondence[right])
+               for left, right in self.edges):
+            return True
         return nx.is_isomorphic(self, other)
 
     # TODO: Allow comparison of interactions betweem isomorphic molecules.
@@ -789,6 +996,39 @@ class Molecule(nx.Graph):
             for edge in edges_self
         )
 
+    @property
+    def structure_version(self):
+        """
+        A counter incremented every time nodes or edges are added or removed.
+
+        Changes to the node or edge attributes are not accounted for.
+        """
+        return self._structure_version
+
+    @property
+    def residue_graph(self):
+        """
+        The residue graph of the molecule, as built by
+        :func:`~vermouth.graph_utils.make_residue_graph`.
+
+        The graph is cached, and only built again when the nodes or edges of
+        the molecule change, or when the chain, resid, or resname of a node
+        changes. It is shared between the callers and must not be modified.
+        The "graph" node attributes are views on the molecule.
+        """
+        keys = [
+            (node.get('chain'), node.get('resid'), node.get('resname'))
+            for node in self._node.values()
+        ]
+        cache = self._residue_graph_cache
+        if (cache is None or cache[0] != self._structure_version
+                or cache[1] != keys):
+            residue_graph = graph_utils.make_residue_graph(self)
+            self._residue_graph_cache = (self._structure_version, keys, residue_graph)
+        else:
+            residue_graph = cache[2]
+        return residue_graph
+
     def iter_residues(self):
         """
         Returns a generator over the nodes of this molecules residues.
@@ -797,7 +1037,7 @@ class Molecule(nx.Graph):
         -------
         collections.abc.Generator
         """
-        residue_graph = graph_utils.make_residue_graph(self)
+        residue_graph = self.residue_graph
         return (tuple(residue_graph.nodes[res]['graph'].nodes) for res in residue_graph.nodes)
 
     def edges_between(self, n_bunch1, n_bunch2, data=False):
@@ -844,6 +1084,34 @@ class Molecule(nx.Graph):
             if not self.interactions[interaction_type]:
                 self.interactions.pop(interaction_type)
 
+    def add_node(self, node_for_adding, **attr):
+        self._structure_version += 1
+        super().add_node(node_for_adding, **attr)
+
+    def add_nodes_from(self, nodes_for_adding, **attr):
+        self._structure_version += 1
+        super().add_nodes_from(nodes_for_adding, **attr)
+
+    def add_edge(self, u_of_edge, v_of_edge, **attr):
+        self._structure_version += 1
+        super().add_edge(u_of_edge, v_of_edge, **attr)
+
+    def add_edges_from(self, ebunch_to_add, **attr):
+        self._structure_version += 1
+        super().add_edges_from(ebunch_to_add, **attr)
+
+    def remove_edge(self, u, v):
+        self._structure_version += 1
+        super().remove_edge(u, v)
+
+    def remove_edges_from(self, ebunch):
+        self._structure_version += 1
+        super().remove_edges_from(ebunch)
+
+    def clear(self):
+        self._structure_version += 1
+        super().clear()
+
     def remove_node(self, node):
         """
         Overriding the remove_node method of networkx
@@ -851,19 +1119,26 @@ class Molecule(nx.Graph):
         separately which is not a part of the graph and hence does not
         get deleted.
         """
+        self._structure_version += 1
         super().remove_node(node)
         self._remove_interactions_with_node(node)
 
-    def remove_nodes_from(self, nodes):
+    def remove_nodes_from(self, nodes, interactions=True):
         """
         Overriding the remove_nodes_from method of networkx
         as we have to delete the interaction from the
         interactions list separately which is not a part of
         the graph and hence does not get deleted.
+
+        Set `interactions` to ``False`` to leave the interactions untouched,
+        when the caller takes care of them.
         """
+        self._structure_version += 1
+        nodes = list(nodes)
         super().remove_nodes_from(nodes)
-        for node in nodes:
-            self._remove_interactions_with_node(node)
+        if interactions:
+            for node in nodes:
+                self._remove_interactions_with_node(node)
 
 
 class Block(Molecule):
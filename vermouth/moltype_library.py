@@ -0,0 +1,395 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 University of Groningen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Store the coarse grained molecules built from atomistic molecules, so that
+they do not have to be built again.
+
+The mapping, the blocks, and the links only depend on the topology of the
+atomistic molecule. Once a molecule has been coarse grained, the
+:class:`MoltypeLibrary` stores the result under a key computed from the
+atomistic molecule. When a molecule with the same key is met again, the
+coarse grained molecule is rebuilt from the library, and only its
+coordinates remain to be computed from the atomistic molecule.
+
+Each entry of the library is made of an ITP file with the topology of the
+coarse grained molecule, and of a pickle file that tells which atomistic
+atoms each bead is built from, and what the beads carry besides what is
+written in the ITP file.
+"""
+
+import collections.abc
+import hashlib
+import os
+import pickle
+from pathlib import Path
+
+import networkx as nx
+import numpy as np
+
+from .checkpoint import _Pickler, _Unpickler
+from .gmx.itp import write_molecule_itp
+from .gmx.itp_read import read_itp
+from .log_helpers import StyleAdapter, get_logger
+from .processors.deduplicate import PER_COPY_ATTRIBUTES, PER_COPY_EDGE_ATTRIBUTES
+
+LOGGER = StyleAdapter(get_logger(__name__))
+
+#: Version of the format of the library entries. Entries written with an other
+#: version are ignored.
+MOLTYPE_LIBRARY_FORMAT = 1
+#: Node attributes written in the ITP file. The values from the ITP file take
+#: precedence over the stored ones, so the ITP file can be edited.
+_ITP_ATTRIBUTES = ('atype', 'resid', 'resname', 'atomname',
+                   'charge_group', 'charge', 'mass')
+#: Per copy node attributes that are rebuilt from the atomistic molecule
+#: rather than taken from its first source atom.
+_REBUILT_ATTRIBUTES = ('graph', 'mapping_weights', 'position', 'chain')
+
+
+class _UnstableValue(Exception):
+    """
+    Raised when a value has no representation that is stable between runs.
+    """
+
+
+def _describe(value):
+    """
+    Build a representation of a value that does not change between runs.
+
+    Raises
+    ------
+    _UnstableValue
+        The value does not have such a representation.
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return repr(value)
+    if isinstance(value, np.ndarray):
+        return 'array{}'.format(repr(value.tolist()))
+    if isinstance(value, nx.Graph):
+        # Graphs stored as attributes, such as the modifications, are
+        # described by their name.
+        name = getattr(value, 'name', None)
+        if name is None:
+            raise _UnstableValue
+        return 'graph({!r})'.format(name)
+    if isinstance(value, collections.abc.Mapping):
+        return '{{{}}}'.format(','.join(sorted(
+            '{}:{}'.format(_describe(key), _describe(val))
+            for key, val in value.items()
+        )))
+    if isinstance(value, (list, tuple)):
+        return '[{}]'.format(','.join(map(_describe, value)))
+    if isinstance(value, (set, frozenset)):
+        return 'set({})'.format(','.join(sorted(map(_describe, value))))
+    raise _UnstableValue
+
+
+def _source_atoms(node):
+    """
+    The keys of the atomistic atoms a bead is built from.
+
+    After :class:`~vermouth.processors.apply_blocks.ApplyBlocks`, the "graph"
+    of a bead describes the coarse grained residue, and the atoms are one
+    level deeper.
+    """
+    graph = node.get('graph')
+    if graph is None:
+        return []
+    keys = []
+    for key, subnode in graph.nodes.items():
+        if 'graph' in subnode:
+            keys.extend(_source_atoms(subnode))
+        else:
+            keys.append(key)
+    return keys
+
+
+def _chain_order(molecule):
+    """
+    The chains of a molecule in order of first appearance.
+    """
+    chains = {}
+    for node in molecule.nodes.values():
+        chains.setdefault(node.get('chain'), len(chains))
+    return list(chains)
+
+
+def moltype_key(molecule, context=None):
+    """
+    Compute the library key of an atomistic molecule.
+
+    The key describes the same aspects of the molecule as
+    :func:`~vermouth.processors.deduplicate.molecule_fingerprint`, in a way
+    that is stable between runs.
+
+    Parameters
+    ----------
+    molecule: vermouth.molecule.Molecule
+    context: dict or None
+        The options that affect how the molecule is coarse grained, such as
+        the target force field. The values are hashed through
+        :func:`_describe`.
+
+    Returns
+    -------
+    str or None
+        The hexadecimal digest, or ``None`` if some attribute of the molecule
+        cannot be described in a stable way.
+    """
+    hasher = hashlib.sha256()
+
+    def feed(*values):
+        for value in values:
+            hasher.update(_describe(value).encode('utf-8'))
+            hasher.update(b';')
+
+    index = {key: idx for idx, key in enumerate(molecule.nodes)}
+    chains = {chain: idx for idx, chain in enumerate(_chain_order(molecule))}
+    try:
+        feed(MOLTYPE_LIBRARY_FORMAT, context or {},
+             getattr(molecule.force_field, 'name', None),
+             molecule.nrexcl, molecule.meta)
+        for attributes in molecule.nodes.values():
+            feed({name: value for name, value in attributes.items()
+                  if name not in PER_COPY_ATTRIBUTES},
+                 sorted(name for name in attributes if name in PER_COPY_ATTRIBUTES),
+                 chains[attributes.get('chain')])
+        feed(sorted(
+            (min(index[left], index[right]), max(index[left], index[right]),
+             _describe({name: value for name, value in data.items()
+                        if name not in PER_COPY_EDGE_ATTRIBUTES}))
+            for left, right, data in molecule.edges(data=True)
+        ))
+        for interaction_type in sorted(molecule.interactions):
+            feed(interaction_type, [
+                ([index[atom] for atom in interaction.atoms],
+                 interaction.parameters, interaction.meta)
+                for interaction in molecule.interactions[interaction_type]
+            ])
+    except _UnstableValue:
+        return None
+    return hasher.hexdigest()
+
+
+class MoltypeLibrary:
+    """
+    Store coarse grained molecules on disk, keyed by their atomistic molecule.
+
+    Parameters
+    ----------
+    directory: str or pathlib.Path
+        The directory of the library. It is created if needed.
+    force_fields: dict[str, vermouth.forcefield.ForceField]
+        The force fields known to the program, used to restore the force
+        fields referred to in the library.
+    context: dict or None
+        The options that affect how the molecules are coarse grained, see
+        :func:`moltype_key`.
+
+    Attributes
+    ----------
+    directory: pathlib.Path
+    force_fields: dict[str, vermouth.forcefield.ForceField]
+    context: dict
+    hits: int
+        The number of molecules rebuilt from the library.
+    misses: int
+        The number of molecules not found in the library.
+    """
+    def __init__(self, directory, force_fields, context=None):
+        self.directory = Path(directory)
+        self.force_fields = force_fields
+        self.context = context or {}
+        self.hits = 0
+        self.misses = 0
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def key(self, molecule):
+        """
+        The key of an atomistic molecule, see :func:`moltype_key`.
+        """
+        return moltype_key(molecule, self.context)
+
+    def paths(self, key):
+        """
+        The paths to the ITP file and to the pickle file of an entry.
+        """
+        return (self.directory / (key + '.itp'),
+                self.directory / (key + '.pickle'))
+
+    def save(self, key, atomistic, molecule):
+        """
+        Store a coarse grained molecule.
+
+        Parameters
+        ----------
+        key: str
+            The key of the atomistic molecule.
+        atomistic: vermouth.molecule.Molecule
+            The atomistic molecule the coarse grained molecule is built from.
+        molecule: vermouth.molecule.Molecule
+            The coarse grained molecule.
+
+        Returns
+        -------
+        bool
+            Whether the molecule could be stored.
+        """
+        index = {atom_key: idx for idx, atom_key in enumerate(atomistic.nodes)}
+        bead_index = {bead_key: idx for idx, bead_key in enumerate(molecule.nodes)}
+        beads = []
+        for node in molecule.nodes.values():
+            try:
+                sources = [index[atom_key] for atom_key in _source_atoms(node)]
+            except KeyError:
+                LOGGER.debug('A bead is built from atoms out of its molecule; '
+                             'the molecule is not stored in the library.',
+                             type='general')
+                return False
+            weights = node.get('mapping_weights')
+            if weights is not None:
+                weights = {index[atom_key]: weight
+                           for atom_key, weight in weights.items()
+                           if atom_key in index}
+            attributes = {name: value for name, value in node.items()
+                          if name not in PER_COPY_ATTRIBUTES}
+            per_copy = [name for name in PER_COPY_ATTRIBUTES
+                        if name in node and name not in _REBUILT_ATTRIBUTES]
+            beads.append((sources, weights, attributes, node.get('chain'), per_copy))
+        entry = {
+            'format': MOLTYPE_LIBRARY_FORMAT,
+            'force_field': getattr(molecule.force_field, 'name', None),
+            'meta': dict(molecule.meta),
+            'chains': _chain_order(atomistic),
+            'beads': beads,
+            'edges': [
+                (bead_index[left], bead_index[right],
+                 {name: value for name, value in data.items()
+                  if name not in PER_COPY_EDGE_ATTRIBUTES})
+                for left, right, data in molecule.edges(data=True)
+            ],
+        }
+
+        itp_path, entry_path = self.paths(key)
+        itp_tmp = itp_path.with_suffix('.tmp_itp')
+        entry_tmp = entry_path.with_suffix('.tmp')
+        try:
+            with open(str(itp_tmp), 'w') as outfile:
+                write_molecule_itp(molecule, outfile, moltype='molecule',
+                                   header=['Molecule type library entry.'])
+            with open(str(entry_tmp), 'wb') as outfile:
+                _Pickler(outfile, protocol=pickle.HIGHEST_PROTOCOL).dump(entry)
+        except (ValueError, TypeError, pickle.PicklingError, AttributeError) as error:
+            LOGGER.debug('Could not store a molecule in the library: {}',
+                         error, type='general')
+            for path in (itp_tmp, entry_tmp):
+                if path.exists():
+                    path.unlink()
+            return False
+        # The pickle file is moved last, as its presence marks a complete
+        # entry.
+        os.replace(str(itp_tmp), str(itp_path))
+        os.replace(str(entry_tmp), str(entry_path))
+        return True
+
+    def _read_entry(self, key):
+        itp_path, entry_path = self.paths(key)
+        if not entry_path.exists() or not itp_path.exists():
+            return None, None
+        try:
+            with open(str(entry_path), 'rb') as infile:
+                entry = _Unpickler(infile, self.force_fields).load()
+            with open(str(itp_path)) as infile:
+                moltypes = read_itp(infile)
+        except Exception as error:  # pylint: disable=broad-except
+            LOGGER.warning('Could not read the library entry "{}": {}',
+                           key, error, type='general')
+            return None, None
+        if entry.get('format') != MOLTYPE_LIBRARY_FORMAT:
+            return None, None
+        if len(moltypes) != 1:
+            LOGGER.warning('The library entry "{}" must define exactly one '
+                           'molecule type.', key, type='general')
+            return None, None
+        itp_molecule = next(iter(moltypes.values()))
+        if len(itp_molecule) != len(entry['beads']):
+            LOGGER.warning('The library entry "{}" does not have as many '
+                           'atoms in its ITP file as beads.', key,
+                           type='general')
+            return None, None
+        return entry, itp_molecule
+
+    def load(self, key, atomistic):
+        """
+        Rebuild the coarse grained molecule for an atomistic molecule.
+
+        The beads refer to the atoms of `atomistic` through their "graph" and
+        "mapping_weights" attributes, and their chain is renamed after the
+        chains of `atomistic`. The beads do not have a position.
+
+        Parameters
+        ----------
+        key: str
+            The key of the atomistic molecule.
+        atomistic: vermouth.molecule.Molecule
+
+        Returns
+        -------
+        vermouth.molecule.Molecule or None
+            The coarse grained molecule, or ``None`` if the library has no
+            usable entry for the key.
+        """
+        entry, itp_molecule = self._read_entry(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        atom_keys = list(atomistic.nodes)
+        chains = dict(zip(entry['chains'], _chain_order(atomistic)))
+        molecule = itp_molecule.__class__(
+            force_field=self.force_fields.get(entry['force_field']),
+            meta=dict(entry['meta']),
+            nrexcl=itp_molecule.nrexcl,
+        )
+        bead_keys = list(itp_molecule.nodes)
+        for bead_key, bead in zip(bead_keys, entry['beads']):
+            sources, weights, attributes, chain, per_copy = bead
+            attributes = dict(attributes)
+            # Values from the ITP file are used when they were edited.
+            for name in _ITP_ATTRIBUTES:
+                value = itp_molecule.nodes[bead_key].get(name)
+                if value is not None and str(value) != str(attributes.get(name)):
+                    attributes[name] = value
+            if chain is not None or 'chain' in attributes:
+                attributes['chain'] = chains.get(chain, chain)
+            if sources:
+                source_keys = [atom_keys[idx] for idx in sources]
+                attributes['graph'] = atomistic.subgraph(source_keys)
+                first_source = atomistic.nodes[source_keys[0]]
+                for name in per_copy:
+                    if name in first_source:
+                        attributes[name] = first_source[name]
+            if weights is not None:
+                attributes['mapping_weights'] = {
+                    atom_keys[idx]: weight for idx, weight in weights.items()
+                }
+            molecule.add_node(bead_key, **attributes)
+        molecule.add_edges_from(
+            (bead_keys[left], bead_keys[right], data)
+            for left, right, data in entry['edges']
+        )
+        for interaction_type, interactions in itp_molecule.interactions.items():
+            molecule.interactions[interaction_type] = interactions
+        self.hits += 1
+        return molecule
@@ -42,5 +42,7 @@ from .add_molecule_edges import AddMoleculeEdgesAtDistance, MergeNucleicStrands
 from .name_moltype import NameMolType
 from .quote import Quoter
 from .go_vs_includes import GoVirtIncludes
+from .go_contact_map import GoContactMap
 from .sort_molecule_atoms import SortMoleculeAtoms
 from .merge_all_molecules import MergeAllMolecules
+from .deduplicate import DeduplicateMolecules
@@ -21,7 +21,6 @@ from collections import ChainMap
 from itertools import product
 
 from .processor import Processor
-from ..graph_utils import make_residue_graph
 from ..molecule import Molecule
 
 
@@ -47,7 +46,7 @@ def apply_blocks(molecule, blocks):
         force_field=molecule.force_field,
         meta=molecule.meta.copy()
     )
-    residue_graph = make_residue_graph(molecule)
+    residue_graph = molecule.residue_graph
 
     # nrexcl may not be defined, but if it is we probably want to keep it
     try:
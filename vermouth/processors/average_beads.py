@@ -75,19 +75,45 @@ def do_average_bead(molecule, ignore_missing_graphs=False, weight=None):
         raise ValueError('{} particles are missing the graph attribute'
                          .format(len(missing)))
 
+    # Gather the positions and weights of the underlying atoms for all the
+    # particles at once, so the averages are computed in bulk rather than
+    # particle by particle.
+    targets = []
+    positions = []
+    weights = []
+    counts = []
     for node in molecule.nodes.values():
         if 'graph' in node:
-            positions = np.stack([
-                subnode['position']
-                for subnode in node['graph'].nodes().values()
-                if subnode.get('position') is not None
-            ])
-            weights = np.array([
-                node.get('mapping_weights', {}).get(subnode_key, 1) * subnode.get(weight, 1)
-                for subnode_key, subnode in node['graph'].nodes.items()
-                if subnode.get('position') is not None
-            ])
-            node['position'] = np.average(positions, axis=0, weights=weights)
+            mapping_weights = node.get('mapping_weights', {})
+            count = 0
+            for subnode_key, subnode in node['graph'].nodes.items():
+                position = subnode.get('position')
+                if position is not None:
+                    positions.append(position)
+                    weights.append(mapping_weights.get(subnode_key, 1) * subnode.get(weight, 1))
+                    count += 1
+            if not count:
+                raise ValueError('No underlying atom has a position for the '
+                                 'particle {}{}:{}.'.format(node.get('resname'),
+                                                            node.get('resid'),
+                                                            node.get('atomname')))
+            targets.append(node)
+            counts.append(count)
+    if not targets:
+        return molecule
+
+    positions = np.stack(positions)
+    weights = np.array(weights, dtype=float)
+    weighted = positions * weights[:, np.newaxis]
+    # Each particle is reduced on its own slice with the same summation as
+    # `np.average`, so the result does not depend on the bulk computation.
+    stops = np.cumsum(counts)
+    for node, stop, count in zip(targets, stops, counts):
+        start = stop - count
+        weight_sum = weights[start:stop].sum()
+        if weight_sum == 0:
+            raise ZeroDivisionError("Weights sum to zero, can't be normalized")
+        node['position'] = weighted[start:stop].sum(axis=0) / weight_sum
 
     return molecule
 
@@ -20,7 +20,7 @@ protonations, and canonicalizes their attributes based on modifications known
 in the forcefield.
 """
 
-from collections import defaultdict
+from collections import defaultdict, Counter
 import itertools
 
 import networkx as nx
@@ -193,6 +193,149 @@ def _cover_graph(graph, to_cover, fragments):
     raise KeyError('Could not identify PTM')
 
 
+def _composition(graph):
+    """
+    Describe a graph as seen by :func:`ptm_node_matcher`.
+
+    Returns
+    -------
+    tuple[int, collections.Counter, collections.Counter]
+        The number of PTM atoms, the count of their elements, and the count
+        of the atom names of the other atoms.
+    """
+    elements = Counter()
+    atomnames = Counter()
+    for node in graph.nodes.values():
+        if node.get('PTM_atom', False):
+            elements[node.get('element')] += 1
+        else:
+            atomnames[node.get('atomname')] += 1
+    return sum(elements.values()), elements, atomnames
+
+
+def _contains(counter, other):
+    """
+    Tell if `counter` has at least as many of everything as `other`.
+    """
+    return all(counter[key] >= count for key, count in other.items())
+
+
+class ModificationLibrary:
+    """
+    The modifications of a force field, indexed to find quickly the ones that
+    may apply to a residue.
+
+    A modification can only be a subgraph of a residue if the residue has at
+    least as many PTM atoms of each element, and at least as many of each
+    anchor atom name, as the modification has. The modifications are grouped
+    by the elements of their PTM atoms so the groups that cannot apply are
+    discarded at once. The library also remembers the coverings found by
+    :func:`fix_ptm`, so residues that are modified in the same way are only
+    solved once.
+
+    Parameters
+    ----------
+    modifications: collections.abc.Iterable[networkx.Graph]
+        The known modifications, as described in :func:`identify_ptms`.
+
+    Attributes
+    ----------
+    modifications: list[networkx.Graph]
+    coverings: dict
+        The coverings already solved, keyed by :func:`covering_fingerprint`.
+        The matches are stored as lists of ``(position, modification key)``
+        where the position refers to the list of residue nodes the
+        fingerprint was built from.
+    """
+    def __init__(self, modifications):
+        self.modifications = list(modifications)
+        self._compositions = [_composition(modification)
+                              for modification in self.modifications]
+        self._by_elements = defaultdict(list)
+        for idx, (_, elements, _) in enumerate(self._compositions):
+            self._by_elements[frozenset(elements)].append(idx)
+        self.coverings = {}
+
+    def describes(self, modifications):
+        """
+        Tell if the library is up to date with a list of modifications.
+        """
+        modifications = list(modifications)
+        return (len(modifications) == len(self.modifications)
+                and all(mine is theirs for mine, theirs
+                        in zip(self.modifications, modifications)))
+
+    def candidates(self, residue):
+        """
+        List the modifications that pass the composition test for a residue.
+
+        Parameters
+        ----------
+        residue: networkx.Graph
+
+        Returns
+        -------
+        list[networkx.Graph]
+            The candidate modifications, in the library order.
+        """
+        n_ptm_atoms, elements, atomnames = _composition(residue)
+        selected = []
+        for element_set, indices in self._by_elements.items():
+            if not elements.keys() >= element_set:
+                continue
+            for idx in indices:
+                n_mod_atoms, mod_elements, mod_atomnames = self._compositions[idx]
+                if (n_mod_atoms <= n_ptm_atoms
+                        and _contains(elements, mod_elements)
+                        and _contains(atomnames, mod_atomnames)):
+                    selected.append(idx)
+        return [self.modifications[idx] for idx in sorted(selected)]
+
+
+def covering_fingerprint(residue, nodes, to_cover):
+    """
+    Build a hashable description of a covering problem.
+
+    Two problems with the same fingerprint have the same solutions, once the
+    nodes of one residue are substituted for the nodes at the same position
+    in the other.
+
+    Parameters
+    ----------
+    residue: networkx.Graph
+    nodes: list
+        The nodes of `residue`, in the order the fingerprint refers to them.
+    to_cover: collections.abc.Iterable
+        The nodes that must be covered.
+
+    Returns
+    -------
+    tuple or None
+        ``None`` if the node attributes cannot be hashed.
+    """
+    position = {node: idx for idx, node in enumerate(nodes)}
+    description = []
+    for node in nodes:
+        attributes = residue.nodes[node]
+        ptm_atom = attributes.get('PTM_atom', False)
+        if ptm_atom:
+            description.append((ptm_atom, attributes.get('element')))
+        else:
+            description.append((ptm_atom, attributes.get('atomname')))
+    edges = sorted(tuple(sorted((position[left], position[right])))
+                   for left, right in residue.edges)
+    fingerprint = (
+        tuple(description),
+        tuple(edges),
+        tuple(sorted(position[node] for node in to_cover)),
+    )
+    try:
+        hash(fingerprint)
+    except TypeError:
+        return None
+    return fingerprint
+
+
 def allowed_ptms(residue, res_ptms, known_ptms):
     """
     Finds all PTMs in ``known_ptms`` which might be relevant for ``residue``.
@@ -205,21 +348,25 @@ def allowed_ptms(residue, res_ptms, known_ptms):
         As returned by ``find_PTM_atoms``.
         Currently not used.
 
-    known_ptms : collections.abc.Iterable[networkx.Graph]
+    known_ptms : collections.abc.Iterable[networkx.Graph] or ModificationLibrary
+        The known modifications. If they come as a
+        :class:`ModificationLibrary`, only the ones with a compatible
+        composition are tested.
 
     Yields
     ------
     tuple[networkx.Graph, networkx.isomorphism.GraphMatcher]
         All graphs in known_ptms which are subgraphs of residue.
     """
-    # TODO: filter by element count first
+    if isinstance(known_ptms, ModificationLibrary):
+        known_ptms = known_ptms.candidates(residue)
     for ptm in known_ptms:
         ptm_graph_matcher = nx.isomorphism.GraphMatcher(residue, ptm, node_match=ptm_node_matcher)
         if ptm_graph_matcher.subgraph_is_isomorphic():
             yield ptm, ptm_graph_matcher
 
 
-def fix_ptm(molecule):
+def fix_ptm(molecule, library=None):
     '''
     Canonizes all PTM atoms in molecule, and labels the relevant residues with
     which PTMs were recognized. Modifies ``molecule`` such that atomnames of
@@ -232,6 +379,9 @@ def fix_ptm(molecule):
         Must not have missing atoms, and atomnames must be correct. Atoms which
         could not be recognized must be labeled with the attribute
         PTM_atom=True.
+    library : ModificationLibrary
+        The modifications to use. If not given, a library is built from the
+        modifications of the force field of ``molecule``.
     '''
     ptm_atoms = find_ptm_atoms(molecule)
 
@@ -247,7 +397,8 @@ def fix_ptm(molecule):
         resid_to_idxs[residx].append(n_idx)
     resid_to_idxs = dict(resid_to_idxs)
 
-    known_ptms = molecule.force_field.modifications
+    if library is None:
+        library = ModificationLibrary(molecule.force_field.modifications)
 
     for resids, res_ptms in itertools.groupby(ptm_atoms, key_func):
         # How to solve this graph covering problem
@@ -265,18 +416,40 @@ def fix_ptm(molecule):
         # option in identify_ptms
 
         res_ptms = list(res_ptms)
-        n_idxs = set()
-        for resid in resids:
-            n_idxs.update(resid_to_idxs[resid])
+        # The nodes are listed in the molecule order, so that identical
+        # residues have the same fingerprint.
+        ordered_idxs = list(dict.fromkeys(
+            idx for resid in resids for idx in resid_to_idxs[resid]
+        ))
+        n_idxs = set(ordered_idxs)
         # TODO: Maybe use graph_utils.make_residue_graph? Or rewrite that
         #       function?
         residue = molecule.subgraph(n_idxs)
-        options = allowed_ptms(residue, res_ptms, known_ptms)
-        options = sorted(options,
-                         key=lambda opt: len([n for n in opt[0] if opt[0].nodes[n].get('PTM_atom', False)]),
-                         reverse=True)
+        to_cover = set()
+        for res_ptm in res_ptms:
+            to_cover.update(res_ptm[0])
+            to_cover.update(res_ptm[1])
+        fingerprint = covering_fingerprint(residue, ordered_idxs, to_cover)
         try:
-            identified = identify_ptms(residue, res_ptms, options)
+            if fingerprint in library.coverings:
+                identified = [
+                    (ptm, {ordered_idxs[position]: ptm_idx
+                           for position, ptm_idx in match})
+                    for ptm, match in library.coverings[fingerprint]
+                ]
+            else:
+                options = allowed_ptms(residue, res_ptms, library)
+                options = sorted(options,
+                                 key=lambda opt: len([n for n in opt[0] if opt[0].nodes[n].get('PTM_atom', False)]),
+                                 reverse=True)
+                identified = identify_ptms(residue, res_ptms, options)
+                if fingerprint is not None:
+                    position = {idx: pos for pos, idx in enumerate(ordered_idxs)}
+                    library.coverings[fingerprint] = [
+                        (ptm, [(position[mol_idx], ptm_idx)
+                               for mol_idx, ptm_idx in match.items()])
+                        for ptm, match in identified
+                    ]
         except KeyError:
             LOGGER.exception('Could not identify the modifications for'
                              ' residues {}, involving atoms {}',
@@ -326,6 +499,23 @@ def fix_ptm(molecule):
 
 
 class CanonicalizeModifications(Processor):
+    def __init__(self):
+        super().__init__()
+        # Libraries are cached by force field. A reference to the force field
+        # is kept with its library so the id cannot be reused.
+        self._libraries = {}
+
+    def _library(self, force_field):
+        modifications = force_field.modifications
+        try:
+            _, library = self._libraries[id(force_field)]
+        except KeyError:
+            library = None
+        if library is None or not library.describes(modifications):
+            library = ModificationLibrary(modifications)
+            self._libraries[id(force_field)] = (force_field, library)
+        return library
+
     def run_molecule(self, molecule):
-        fix_ptm(molecule)
+        fix_ptm(molecule, self._library(molecule.force_field))
         return molecule
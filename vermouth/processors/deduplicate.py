@@ -0,0 +1,406 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 University of Groningen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Provides a processor that runs an other processor only once for each group of
+identical molecules.
+
+Homo-oligomers, capsids, or membranes contain many copies of the same
+molecule. These copies differ by their coordinates and their chain, but the
+topology work done by processors such as
+:class:`~vermouth.processors.repair_graph.RepairGraph` or
+:class:`~vermouth.processors.do_mapping.DoMapping` is the same for all of
+them. :class:`DeduplicateMolecules` runs the wrapped processor on one
+representative per group of identical molecules, and replicates the result
+onto the other molecules of the group.
+"""
+
+import collections.abc
+import copy
+import itertools
+import logging
+from operator import itemgetter
+
+import networkx as nx
+import numpy as np
+
+from .processor import Processor
+from ..log_helpers import StyleAdapter, get_logger
+
+LOGGER = StyleAdapter(get_logger(__name__))
+
+#: Node attributes that can differ between copies of a same molecule. They are
+#: ignored when comparing molecules, and are taken from each copy when
+#: replicating the result of a processor.
+PER_COPY_ATTRIBUTES = (
+    'position', 'atomid', 'chain', 'occupancy', 'temp_factor',
+    'graph', 'mapping_weights',
+)
+#: Edge attributes that can differ between copies of a same molecule.
+PER_COPY_EDGE_ATTRIBUTES = ('distance', )
+
+
+def _freeze(value):
+    """
+    Build a hashable representation of a value.
+
+    Objects that are neither hashable nor containers are represented by their
+    identity, so two different instances never compare equal.
+    """
+    if isinstance(value, np.ndarray):
+        return ('array', value.shape, tuple(value.ravel().tolist()))
+    if isinstance(value, nx.Graph):
+        return ('id', id(value))
+    if isinstance(value, collections.abc.Mapping):
+        return ('mapping', tuple(sorted(
+            ((str(key), _freeze(val)) for key, val in value.items()),
+            key=itemgetter(0),
+        )))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(val) for val in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(_freeze(val) for val in value)
+    try:
+        hash(value)
+    except TypeError:
+        return ('id', id(value))
+    return value
+
+
+def molecule_fingerprint(molecule):
+    """
+    Build a hashable description of a molecule that ignores what differs
+    between copies.
+
+    Two molecules with the same fingerprint have the same node attributes in
+    the same order, the same edges, the same interactions, and the same meta
+    attributes; except for the attributes listed in
+    :data:`PER_COPY_ATTRIBUTES` and :data:`PER_COPY_EDGE_ATTRIBUTES`. Chains
+    are accounted for by their pattern, so that the chains of a molecule can
+    be renamed into the chains of an other molecule with the same
+    fingerprint. Node keys are accounted for by their position in the
+    molecule.
+
+    Parameters
+    ----------
+    molecule: vermouth.molecule.Molecule
+
+    Returns
+    -------
+    tuple
+    """
+    index = {key: idx for idx, key in enumerate(molecule.nodes)}
+    chains = {}
+    nodes = []
+    for attributes in molecule.nodes.values():
+        identity = tuple(sorted(
+            (name, _freeze(value))
+            for name, value in attributes.items()
+            if name not in PER_COPY_ATTRIBUTES
+        ))
+        present = tuple(sorted(
+            name for name in attributes if name in PER_COPY_ATTRIBUTES
+        ))
+        chain = chains.setdefault(attributes.get('chain'), len(chains))
+        nodes.append((identity, present, chain))
+    edges = frozenset(
+        (min(index[left], index[right]), max(index[left], index[right]),
+         _freeze({name: value for name, value in data.items()
+                  if name not in PER_COPY_EDGE_ATTRIBUTES}))
+        for left, right, data in molecule.edges(data=True)
+    )
+    interactions = tuple(sorted(
+        (
+            (interaction_type, tuple(
+                (tuple(index[atom] for atom in interaction.atoms),
+                 _freeze(interaction.parameters),
+                 _freeze(interaction.meta))
+                for interaction in interaction_list
+            ))
+            for interaction_type, interaction_list in molecule.interactions.items()
+        ),
+        key=itemgetter(0),
+    ))
+    force_field = molecule.force_field
+    force_field_name = getattr(force_field, 'name', None)
+    return (
+        tuple(nodes), edges, interactions,
+        _freeze(molecule.meta), molecule.nrexcl, force_field_name,
+    )
+
+
+def group_identical_molecules(molecules):
+    """
+    Group molecules that have the same fingerprint.
+
+    Parameters
+    ----------
+    molecules: list[vermouth.molecule.Molecule]
+
+    Returns
+    -------
+    list[list[int]]
+        The indices of the molecules in each group. The groups are sorted by
+        their first index, and the indices are sorted within each group.
+
+    See Also
+    --------
+    molecule_fingerprint
+    """
+    groups = {}
+    for idx, molecule in enumerate(molecules):
+        groups.setdefault(molecule_fingerprint(molecule), []).append(idx)
+    return sorted(groups.values(), key=itemgetter(0))
+
+
+class _Correspondence:
+    """
+    How the nodes of a template molecule correspond to the nodes of a copy.
+
+    This must be built before the template is processed, as processors may
+    modify their input molecule in place.
+    """
+    def __init__(self, template, copy_):
+        self.nodes = dict(zip(template.nodes, copy_.nodes))
+        self.chains = {}
+        for template_key, copy_key in self.nodes.items():
+            template_node = template.nodes[template_key]
+            if 'chain' in template_node:
+                self.chains[template_node['chain']] = copy_.nodes[copy_key]['chain']
+        try:
+            self.offset = max(copy_) - max(template)
+        except (TypeError, ValueError):
+            self.offset = 0
+
+
+def _replicate_molecule(result, template, copy_, correspondence, keep_keys):
+    """
+    Build, for a copy of the template, the equivalent of `result`.
+
+    Parameters
+    ----------
+    result: vermouth.molecule.Molecule
+        The output of the processor for the template.
+    template: vermouth.molecule.Molecule
+        The input of the processor for the template. If `keep_keys` is
+        ``False``, it must not have been modified by the processor.
+    copy_: vermouth.molecule.Molecule
+        The molecule for which to build the result.
+    correspondence: _Correspondence
+    keep_keys: bool
+        If ``True``, nodes of `result` that have a key from the template
+        correspond to the node of the copy matching that key. Else, the nodes
+        of `result` only refer to the template through their "graph"
+        attribute.
+
+    Returns
+    -------
+    vermouth.molecule.Molecule
+    """
+    node_map = correspondence.nodes
+    if keep_keys:
+        def new_key(key):
+            try:
+                return node_map[key]
+            except KeyError:
+                return key + correspondence.offset
+    else:
+        def new_key(key):
+            return key
+
+    if result.meta is template.meta:
+        meta = copy_.meta
+    else:
+        meta = copy.copy(result.meta)
+    replica = result.__class__(
+        force_field=result.force_field,
+        meta=meta,
+        nrexcl=result.nrexcl,
+    )
+    replica.graph.update(result.graph)
+
+    for key, attributes in result.nodes.items():
+        attributes = dict(attributes)
+        if 'chain' in attributes:
+            attributes['chain'] = correspondence.chains.get(
+                attributes['chain'], attributes['chain']
+            )
+        if keep_keys and key in node_map:
+            copy_node = copy_.nodes[node_map[key]]
+            for name in PER_COPY_ATTRIBUTES:
+                if name in copy_node:
+                    attributes[name] = copy_node[name]
+                elif name == 'graph' and name in attributes:
+                    attributes['graph'] = copy_.subgraph(
+                        [node_map[source] for source in attributes['graph']]
+                    )
+        elif 'graph' in attributes:
+            sources = list(attributes['graph'])
+            attributes['graph'] = copy_.subgraph(
+                [node_map[source] for source in sources]
+            )
+            template_source = template.nodes.get(sources[0], {}) if sources else {}
+            copy_source = copy_.nodes[node_map[sources[0]]] if sources else {}
+            replaced = set()
+            for name in PER_COPY_ATTRIBUTES:
+                if (name != 'graph' and name in attributes
+                        and attributes[name] is template_source.get(name)):
+                    attributes[name] = copy_source[name]
+                    replaced.add(name)
+            weights = attributes.get('mapping_weights')
+            if ('mapping_weights' not in replaced and weights is not None
+                    and all(source in node_map for source in weights)):
+                attributes['mapping_weights'] = {
+                    node_map[source]: weight for source, weight in weights.items()
+                }
+        replica.add_node(new_key(key), **attributes)
+
+    for left, right, data in result.edges(data=True):
+        new_left = new_key(left)
+        new_right = new_key(right)
+        data = dict(data)
+        if keep_keys and copy_.has_edge(new_left, new_right):
+            copy_data = copy_.edges[new_left, new_right]
+            for name in PER_COPY_EDGE_ATTRIBUTES:
+                if name in copy_data:
+                    data[name] = copy_data[name]
+        replica.add_edge(new_left, new_right, **data)
+
+    for interaction_type, interactions in result.interactions.items():
+        replica.interactions[interaction_type] = [
+            interaction._replace(
+                atoms=type(interaction.atoms)(new_key(atom) for atom in interaction.atoms),
+                parameters=copy.copy(interaction.parameters),
+                meta=copy.copy(interaction.meta),
+            )
+            for interaction in interactions
+        ]
+    return replica
+
+
+class _LogRecorder(logging.Handler):
+    """
+    Keeps the messages logged by vermouth while it is attached.
+
+    :class:`DeduplicateMolecules` uses it to log, for each copy of a
+    template, the messages that the copy would have caused.
+    """
+    def __init__(self):
+        super().__init__()
+        self.records = []
+        self._logger = logging.getLogger('vermouth')
+
+    def emit(self, record):
+        self.records.append(record)
+
+    def __enter__(self):
+        self._logger.addHandler(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        self._logger.removeHandler(self)
+
+    def replay(self):
+        """
+        Log the recorded messages again, to the loggers that first logged
+        them.
+        """
+        for record in self.records:
+            logger = logging.getLogger(record.name)
+            if not logger.disabled:
+                logger.handle(record)
+
+
+class DeduplicateMolecules(Processor):
+    """
+    Run a processor once per group of identical molecules.
+
+    The molecules of the system are grouped by
+    :func:`molecule_fingerprint`. The wrapped processor is run on the first
+    molecule of each group, and its result is replicated onto the other
+    molecules of the group. Node attributes that differ between copies (see
+    :data:`PER_COPY_ATTRIBUTES`), and the chains, are taken from each copy.
+
+    This is only valid for processors that treat each molecule independently,
+    and do not use the coordinates. Coordinate dependent steps, such as the
+    averaging of the bead positions or the placement of charge dummies, must
+    run on every molecule after the replication.
+
+    The messages logged while processing the first molecule of a group are
+    logged again for each other molecule of the group, once all the groups
+    are processed, so that the warning counts are the same as without
+    deduplication.
+
+    Parameters
+    ----------
+    processor: vermouth.processors.processor.Processor
+        The processor to run.
+    keep_keys: bool
+        Set to ``True`` for processors that keep the node keys of the molecule
+        they process, such as
+        :class:`~vermouth.processors.repair_graph.RepairGraph`,
+        :class:`~vermouth.processors.canonicalize_modifications.CanonicalizeModifications`,
+        or :class:`~vermouth.processors.do_links.DoLinks`. Set to ``False``
+        for processors that build new molecules whose nodes refer to the
+        input molecule through their "graph" attribute, such as
+        :class:`~vermouth.processors.do_mapping.DoMapping` or
+        :class:`~vermouth.processors.apply_blocks.ApplyBlocks`; these
+        processors must not modify their input molecule.
+    """
+    def __init__(self, processor, keep_keys=True):
+        self.processor = processor
+        self.keep_keys = keep_keys
+        super().__init__()
+
+    def run_system(self, system):
+        molecules = system.molecules
+        if not molecules:
+            self.processor.run_system(system)
+            return
+        groups = group_identical_molecules(molecules)
+        LOGGER.debug('Running {} on {} unique molecules out of {}.',
+                     self.processor.__class__.__name__, len(groups),
+                     len(molecules), type='general')
+
+        force_field = system.force_field
+        outputs = [None] * len(molecules)
+        recorders = [None] * len(molecules)
+        for group in groups:
+            template = molecules[group[0]]
+            copies = [
+                (idx, molecules[idx], _Correspondence(template, molecules[idx]))
+                for idx in group[1:]
+            ]
+            subsystem = system.__class__()
+            subsystem.molecules = [template]
+            subsystem.force_field = system.force_field
+            with _LogRecorder() as recorder:
+                self.processor.run_system(subsystem)
+            force_field = subsystem.force_field
+            outputs[group[0]] = subsystem.molecules
+            for idx, copy_, correspondence in copies:
+                recorders[idx] = recorder
+                outputs[idx] = [
+                    _replicate_molecule(result, template, copy_,
+                                        correspondence, self.keep_keys)
+                    for result in subsystem.molecules
+                ]
+        for recorder in recorders:
+            if recorder is not None:
+                recorder.replay()
+        system.molecules = list(itertools.chain.from_iterable(outputs))
+        system.force_field = force_field
+
+    def run_molecule(self, molecule):
+        return self.processor.run_molecule(molecule)
@@ -14,14 +14,23 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from itertools import combinations
+from collections import defaultdict, Counter
+from itertools import chain, combinations
 import numbers
 
 import networkx as nx
 from numpy import sign
 
-from ..molecule import attributes_match
+from ..molecule import (
+    attributes_match, interaction_match, Interaction, LinkPredicate, Choice,
+)
 from .processor import Processor
+from ..log_helpers import StyleAdapter, get_logger
+
+LOGGER = StyleAdapter(get_logger(__name__))
+
+#: Node attributes used to index the molecules when looking for links.
+INDEXED_ATTRIBUTES = ('atomname', 'resname')
 
 
 def _atoms_match(node1, node2):
@@ -209,52 +218,663 @@ def match_order(order1, resid1, order2, resid2):
     return True
 
 
-def match_link(molecule, link):
+class _MoleculeIndex:
+    """
+    Index of the nodes of a molecule by the attributes links usually
+    constrain, and summary of the node attribute values in the molecule.
+
+    The index must be kept up to date when the molecule is modified, see
+    :meth:`update` and :meth:`remove`.
+
+    Parameters
+    ----------
+    molecule: vermouth.molecule.Molecule
+    tracked: collections.abc.Iterable[str]
+        Node attributes to summarize, on top of the indexed ones. See
+        :meth:`has_fact`.
+    """
+    def __init__(self, molecule, tracked=()):
+        self.molecule = molecule
+        self.position = {key: idx for idx, key in enumerate(molecule.nodes)}
+        self.by_attribute = {attr: defaultdict(set) for attr in INDEXED_ATTRIBUTES}
+        self.tracked = set(tracked) | set(INDEXED_ATTRIBUTES)
+        self.counts = Counter()
+        self._values = {}
+        for key in molecule.nodes:
+            self._add(key)
+
+    def _add(self, key):
+        node = self.molecule.nodes[key]
+        values = {}
+        for attr in list(self.tracked):
+            value = node.get(attr)
+            try:
+                self.counts[(attr, value)] += 1
+            except TypeError:
+                # The value is not hashable, so this attribute cannot be
+                # summarized nor indexed for this molecule.
+                self.tracked.discard(attr)
+                self.by_attribute.pop(attr, None)
+                continue
+            if attr in self.by_attribute:
+                self.by_attribute[attr][value].add(key)
+            values[attr] = value
+        self._values[key] = values
+
+    def remove(self, key):
+        """
+        Remove a node from the index.
+        """
+        for attr, value in self._values.pop(key).items():
+            if attr in self.tracked:
+                self.counts[(attr, value)] -= 1
+            if attr in self.by_attribute:
+                self.by_attribute[attr][value].discard(key)
+
+    def update(self, key):
+        """
+        Re-index a node which attributes changed.
+        """
+        self.remove(key)
+        self._add(key)
+
+    def has_fact(self, attr, values):
+        """
+        Tell if a node may have an attribute set to one of the given values.
+
+        Parameters
+        ----------
+        attr: str
+        values: collections.abc.Iterable
+
+        Returns
+        -------
+        bool
+            ``False`` if no node has the attribute set to any of the values.
+            ``True`` if some node has, or if the attribute is not summarized.
+        """
+        if attr not in self.tracked:
+            return True
+        return any(self.counts[(attr, value)] > 0 for value in values)
+
+    def candidates(self, template):
+        """
+        Select the nodes that can match a template node from a link.
+
+        Parameters
+        ----------
+        template: dict
+            The attributes of the link node.
+
+        Returns
+        -------
+        set or None
+            A super set of the keys of the nodes that can match. ``None`` if
+            the template does not constrain any of the indexed attributes.
+        """
+        best = None
+        for attr, index in self.by_attribute.items():
+            if attr not in template:
+                continue
+            value = template[attr]
+            if isinstance(value, Choice) and isinstance(value.value, (list, tuple, set)):
+                values = value.value
+            elif isinstance(value, LinkPredicate):
+                continue
+            else:
+                values = [value]
+            try:
+                keys = set().union(*(index.get(val, ()) for val in values))
+            except TypeError:
+                continue
+            if best is None or len(keys) < len(best):
+                best = keys
+        return best
+
+
+def _batch_effectors(link):
+    """
+    Find the parameters of a link that can be computed for all its matches at
+    once.
+
+    These are the parameters with a ``batch`` method, such as the
+    :class:`~vermouth.molecule.LinkParameterEffector`. They are only computed
+    at once if the link does not change the positions of the nodes.
+
+    Parameters
+    ----------
+    link: vermouth.molecule.Link
+
+    Returns
+    -------
+    list
+        The parameters, without duplicates.
+    """
+    if any('position' in node_attrs.get('replace', {})
+           for node_attrs in link.nodes.values()):
+        return []
+    effectors = {}
+    all_interactions = chain(link.removed_interactions.values(),
+                             link.interactions.values())
+    for interaction in chain.from_iterable(all_interactions):
+        for param in interaction.parameters:
+            if callable(getattr(param, 'batch', None)):
+                effectors[id(param)] = param
+    return list(effectors.values())
+
+
+def _evaluate_effectors(molecule, effectors, matches):
+    """
+    Compute the parameters from :func:`_batch_effectors` for all the matches.
+
+    Returns
+    -------
+    list[dict] or None
+        For each match, the value of each parameter keyed by the id of the
+        parameter; ``None`` if there is no parameter to compute.
+    """
+    if not effectors or not matches:
+        return None
+    values = [effector.batch(molecule, matches) for effector in effectors]
+    ids = [id(effector) for effector in effectors]
+    return [dict(zip(ids, match_values)) for match_values in zip(*values)]
+
+
+class _CompiledLink:
+    """
+    A link prepared to be matched on molecules.
+
+    The matches are grown from an anchor node along the bonds of the link.
+    The link nodes are visited in the same order as
+    :class:`networkx.algorithms.isomorphism.GraphMatcher` does, and the
+    candidates for each node are tried in the same order, so the matches are
+    produced in the same order as with the generic graph matcher. Only
+    connected links can be compiled this way; see :attr:`connected`.
+
+    Parameters
+    ----------
+    link: vermouth.molecule.Link
+    """
+    def __init__(self, link):
+        self.link = link
+        self.eager = not _rewrites_own_matches(link)
+        self.effectors = _batch_effectors(link)
+        link_nodes = list(link.nodes)
+        self.connected = bool(link_nodes) and nx.is_connected(link)
+        if not self.connected:
+            return
+
+        # The graph matcher always extends the match with the lowest link
+        # node, in the link order, that is bonded to the nodes already matched.
+        link_order = {key: idx for idx, key in enumerate(link_nodes)}
+        sequence = [link_nodes[0]]
+        visited = {link_nodes[0]}
+        while len(sequence) < len(link_nodes):
+            frontier = {neighbour for key in sequence for neighbour in link[key]
+                        if neighbour not in visited}
+            next_node = min(frontier, key=link_order.__getitem__)
+            sequence.append(next_node)
+            visited.add(next_node)
+        self.sequence = sequence
+        self.templates = [link.nodes[key] for key in sequence]
+        index = {key: idx for idx, key in enumerate(sequence)}
+        self.neighbours = [
+            [index[other] for other in link[key] if index[other] < idx]
+            for idx, key in enumerate(sequence)
+        ]
+        self.non_neighbours = [
+            [jdx for jdx in range(idx) if sequence[jdx] not in link[key]]
+            for idx, key in enumerate(sequence)
+        ]
+        self.self_loops = [link.has_edge(key, key) for key in sequence]
+        self.distances = nx.single_source_shortest_path_length(link, sequence[0])
+
+        # The order constraints can be checked while growing the matches,
+        # but only if they are all valid; otherwise the error must be raised
+        # where match_link would raise it.
+        self.check_orders = True
+        for template in self.templates:
+            if 'order' in template:
+                try:
+                    hash(template['order'])
+                    _interpret_order(template['order'])
+                except (TypeError, ValueError):
+                    self.check_orders = False
+        self.renames = any(
+            attr in template.get('replace', {})
+            for template in self.templates
+            for attr in INDEXED_ATTRIBUTES
+        )
+
+    def _anchors(self, molecule, index):
+        """
+        List the molecule nodes that can match the first link node, in the
+        molecule order.
+
+        The candidates are selected through the index from the most selective
+        link node, and then restricted to the molecule nodes that are close
+        enough to be part of the same match. The node attributes are not
+        tested here, as they may change while the matches are applied.
+        """
+        if self.renames:
+            # The link may rename nodes so they match it, the index cannot
+            # be trusted while the matches of this link are applied.
+            return list(molecule.nodes)
+        best = None
+        best_key = None
+        for key in self.sequence:
+            candidates = index.candidates(self.link.nodes[key])
+            if candidates is not None and (best is None or len(candidates) < len(best)):
+                best = candidates
+                best_key = key
+        if best is None:
+            return list(molecule.nodes)
+        anchors = set(best)
+        frontier = set(best)
+        for _ in range(self.distances[best_key]):
+            frontier = {neighbour for key in frontier for neighbour in molecule.adj[key]
+                        if neighbour not in anchors}
+            anchors.update(frontier)
+        return sorted(anchors, key=index.position.__getitem__)
+
+    def _feasible(self, molecule, assigned_orders, idx, mol_key):
+        """
+        Check the attributes and the order constraints of a candidate node.
+        """
+        template = self.templates[idx]
+        if not _atoms_match(molecule.nodes[mol_key], template):
+            return False
+        if not self.check_orders or 'order' not in template:
+            return True
+        resid = molecule.nodes[mol_key].get('resid')
+        if resid is None:
+            return True
+        order = template['order']
+        for other_order, other_resid in assigned_orders:
+            if other_resid is None:
+                continue
+            if other_order == order:
+                if other_resid != resid:
+                    return False
+            elif not match_order(other_order, other_resid, order, resid):
+                return False
+        return True
+
+    def raw_matches(self, molecule, index):
+        """
+        Find the matches of the link graph on the molecule.
+
+        Parameters
+        ----------
+        molecule: vermouth.molecule.Molecule
+        index: _MoleculeIndex
+
+        Yields
+        ------
+        dict
+            The matches from molecule node keys to link node keys, as
+            :meth:`networkx.algorithms.isomorphism.GraphMatcher.subgraph_isomorphisms_iter`
+            would produce them, except for matches that do not respect the
+            order constraints of the link.
+        """
+        adjacency = molecule.adj
+        sequence = self.sequence
+        n_nodes = len(sequence)
+        # These mirror the state of the generic graph matcher: `core` is the
+        # current match, and `inout` the nodes in or around the match, in the
+        # order the graph matcher tries them.
+        core = {}
+        images = []
+        inout = {}
+        assigned_orders = []
+
+        def add(mol_key, depth):
+            core[mol_key] = sequence[depth - 1]
+            images.append(mol_key)
+            if mol_key not in inout:
+                inout[mol_key] = depth
+            new_nodes = set([])
+            for node in core:
+                new_nodes.update([neighbour for neighbour in adjacency[node]
+                                  if neighbour not in core])
+            for node in new_nodes:
+                if node not in inout:
+                    inout[node] = depth
+            template = self.templates[depth - 1]
+            if 'order' in template:
+                resid = molecule.nodes[mol_key].get('resid')
+                assigned_orders.append((template['order'], resid))
+
+        def restore(mol_key, depth):
+            del core[mol_key]
+            images.pop()
+            for node in list(inout):
+                if inout[node] == depth:
+                    del inout[node]
+            if 'order' in self.templates[depth - 1]:
+                assigned_orders.pop()
+
+        def extend(idx):
+            if idx == n_nodes:
+                yield dict(core)
+                return
+            neighbours = self.neighbours[idx]
+            first = images[neighbours[0]]
+            # Only the structure is tested here; the attributes are tested
+            # when the candidate is tried, like the generic graph matcher
+            # does.
+            possible = set()
+            for candidate in adjacency[first]:
+                if candidate in core:
+                    continue
+                if any(candidate not in adjacency[images[jdx]] for jdx in neighbours[1:]):
+                    continue
+                if any(candidate in adjacency[images[jdx]] for jdx in self.non_neighbours[idx]):
+                    continue
+                if (candidate in adjacency[candidate]) != self.self_loops[idx]:
+                    continue
+                possible.add(candidate)
+            for candidate in [node for node in inout if node in possible]:
+                if not self._feasible(molecule, assigned_orders, idx, candidate):
+                    continue
+                add(candidate, idx + 1)
+                yield from extend(idx + 1)
+                restore(candidate, idx + 1)
+
+        for anchor in self._anchors(molecule, index):
+            if (molecule.has_edge(anchor, anchor) != self.self_loops[0]
+                    or not self._feasible(molecule, assigned_orders, 0, anchor)):
+                continue
+            add(anchor, 1)
+            yield from extend(1)
+            restore(anchor, 1)
+
+
+def _valid_match(molecule, link, raw_match):
+    """
+    Check the constraints of a link that are not part of the graph.
+
+    Parameters
+    ----------
+    molecule: vermouth.molecule.Molecule
+    link: vermouth.molecule.Link
+    raw_match: dict
+        A match from molecule node keys to link node keys.
+
+    Returns
+    -------
+    bool
+    """
+    # raw_match: mol -> link
+    # rev_raw_match: link -> mol
+    rev_raw_match = {value: key for key, value in raw_match.items()}
+    if not _is_valid_non_edges(molecule, link, rev_raw_match):
+        return False
+    any_pattern_match = _any_pattern_match(molecule, link.patterns, rev_raw_match)
+    if link.patterns and (not any_pattern_match):
+        return False
+    order_match = {}
+    for mol_idx, link_idx in raw_match.items():
+        mol_node = molecule.nodes[mol_idx]
+        link_node = link.nodes[link_idx]
+        if 'order' in link_node:
+            order = link_node['order']
+            resid = mol_node['resid']
+            if order not in order_match:
+                order_match[order] = resid
+            # Assert all orders correspond to the same resid
+            elif order in order_match and order_match[order] != resid:
+                return False
+    for ((order1, resid1), (order2, resid2)) in combinations(order_match.items(), 2):
+        # Assert the differences between resids correspond to what
+        # the orders require.
+        if not match_order(order1, resid1, order2, resid2):
+            return False
+    return True
+
+
+def match_link(molecule, link, molecule_index=None, compiled_link=None):
+    """
+    Find the places where a link applies on a molecule.
+
+    Parameters
+    ----------
+    molecule: vermouth.molecule.Molecule
+    link: vermouth.molecule.Link
+    molecule_index: _MoleculeIndex or None
+        An up to date index of the molecule. It is built if not provided.
+    compiled_link: _CompiledLink or None
+        The link, compiled. It is compiled if not provided.
+
+    Yields
+    ------
+    dict
+        The matches from link node keys to molecule node keys.
+    """
     if not attributes_match(molecule.meta, link.molecule_meta):
         return
 
-    GM = nx.isomorphism.GraphMatcher(molecule, link, node_match=_atoms_match)
+    if compiled_link is None:
+        compiled_link = _CompiledLink(link)
+    if compiled_link.connected:
+        if molecule_index is None:
+            molecule_index = _MoleculeIndex(molecule)
+        raw_matches = compiled_link.raw_matches(molecule, molecule_index)
+    else:
+        GM = nx.isomorphism.GraphMatcher(molecule, link, node_match=_atoms_match)
+        raw_matches = GM.subgraph_isomorphisms_iter()
 
-    raw_matches = GM.subgraph_isomorphisms_iter()
     for raw_match in raw_matches:
-        # raw_match: mol -> link
-        # rev_raw_match: link -> mol
-        rev_raw_match = {value: key for key, value in raw_match.items()}
-        if not _is_valid_non_edges(molecule, link, rev_raw_match):
-            continue
-        any_pattern_match = _any_pattern_match(molecule, link.patterns, rev_raw_match)
-        if link.patterns and (not any_pattern_match):
-            continue
-        order_match = {}
-        for mol_idx, link_idx in raw_match.items():
-            mol_node = molecule.nodes[mol_idx]
-            link_node = link.nodes[link_idx]
-            if 'order' in link_node:
-                order = link_node['order']
-                resid = mol_node['resid']
-                if order not in order_match:
-                    order_match[order] = resid
-                # Assert all orders correspond to the same resid
-                elif order in order_match and order_match[order] != resid:
-                    break
-        else:  # No break
-            for ((order1, resid1), (order2, resid2)) in combinations(order_match.items(), 2):
-                # Assert the differences between resids correspond to what
-                # the orders require.
-                if not match_order(order1, resid1, order2, resid2):
-                    break
-            else:  # No break
-                # raw_match is molecule -> link. The other way around is more
-                # useful
-                yield {v: k for k, v in raw_match.items()}
-
-
-def _build_link_interaction_from(molecule, interaction, match):
+        if _valid_match(molecule, link, raw_match):
+            # raw_match is molecule -> link. The other way around is more
+            # useful
+            yield {v: k for k, v in raw_match.items()}
+
+
+def _rewrites_own_matches(link):
+    """
+    Tell if applying a link can change which places the link matches.
+
+    This is the case when the link replaces node attributes that are read
+    when matching it: the attributes of its nodes, of its non-edges, and of
+    its patterns, as well as the residue ids when the link uses orders or
+    non-edges.
+
+    Parameters
+    ----------
+    link: vermouth.molecule.Link
+
+    Returns
+    -------
+    bool
+    """
+    replaced = set()
+    read = set()
+    for node_attrs in link.nodes.values():
+        replace = node_attrs.get('replace', {})
+        if replace.get('atomname', False) is not None:
+            replaced.update(replace)
+        read.update(node_attrs)
+        if 'order' in node_attrs:
+            read.add('resid')
+    read.difference_update(('order', 'replace'))
+    for _, to_node_attrs in link.non_edges:
+        read.update(to_node_attrs)
+        read.add('resid')
+    for pattern in link.patterns:
+        for _, template_attr in pattern:
+            read.update(template_attr)
+    return bool(replaced & read)
+
+
+class _InteractionIndex:
+    """
+    Keyed access to the interactions of a molecule while links are applied.
+
+    Interactions are found from their type, atoms, and version rather than by
+    scanning the interaction lists. Removed interactions are only marked as
+    such; the interaction lists of the molecule are rebuilt once, in their
+    original order, by :meth:`commit`.
+
+    Parameters
+    ----------
+    molecule: vermouth.molecule.Molecule
+    """
+    def __init__(self, molecule):
+        self.molecule = molecule
+        # Interactions per type; removed interactions are set to None.
+        self.interactions = {}
+        # (type, atoms, version) -> positions; used to replace interactions.
+        self._by_version = defaultdict(list)
+        # (type, atoms) -> positions; used to remove interactions.
+        self._by_atoms = defaultdict(list)
+        # atom -> (type, position); used to remove nodes.
+        self._by_atom = defaultdict(list)
+        self._removed_nodes = False
+
+    def _get(self, type_):
+        try:
+            return self.interactions[type_]
+        except KeyError:
+            pass
+        # Like the methods of Molecule, accessing an interaction type creates
+        # it in the molecule if it does not exist yet.
+        interactions = list(self.molecule.interactions[type_])
+        self.interactions[type_] = interactions
+        for position, interaction in enumerate(interactions):
+            self._index(type_, position, interaction)
+        return interactions
+
+    def _index(self, type_, position, interaction):
+        atoms = tuple(interaction.atoms)
+        self._by_atoms[(type_, atoms)].append(position)
+        # Molecule.add_or_replace_interaction compares the atoms with a
+        # tuple, interactions with atoms of an other type are never replaced.
+        if isinstance(interaction.atoms, tuple):
+            version = interaction.meta.get('version', 0)
+            self._by_version[(type_, atoms, version)].append(position)
+        for atom in atoms:
+            self._by_atom[atom].append((type_, position))
+
+    def add_or_replace(self, type_, atoms, parameters, meta=None):
+        """
+        Same as :meth:`vermouth.molecule.Molecule.add_or_replace_interaction`.
+        """
+        if meta is None:
+            meta = {}
+        interactions = self._get(type_)
+        atoms = tuple(atoms)
+        new_interaction = Interaction(atoms=atoms, parameters=parameters, meta=meta)
+        for position in self._by_version.get((type_, atoms, meta.get('version', 0)), ()):
+            if interactions[position] is not None:
+                interactions[position] = new_interaction
+                return
+        for atom in atoms:
+            if atom not in self.molecule:
+                raise KeyError('Unknown atom {}'.format(atom))
+        interactions.append(new_interaction)
+        self._index(type_, len(interactions) - 1, new_interaction)
+
+    def remove_matching(self, type_, template_interaction):
+        """
+        Same as :meth:`vermouth.molecule.Molecule.remove_matching_interaction`.
+        """
+        interactions = self._get(type_)
+        for position in self._by_atoms.get((type_, tuple(template_interaction.atoms)), ()):
+            interaction = interactions[position]
+            if (interaction is not None
+                    and interaction_match(self.molecule, interaction, template_interaction)):
+                interactions[position] = None
+                return
+        raise ValueError('Cannot find a matching interaction.')
+
+    def remove_nodes(self, nodes):
+        """
+        Remove the interactions that involve any of the given nodes.
+        """
+        for type_ in list(self.molecule.interactions):
+            self._get(type_)
+        for node in nodes:
+            for type_, position in self._by_atom.pop(node, ()):
+                self.interactions[type_][position] = None
+        self._removed_nodes = True
+
+    def commit(self):
+        """
+        Write the interactions back in the molecule.
+
+        As with :meth:`vermouth.molecule.Molecule.remove_nodes_from`, the
+        interaction types left empty are removed if nodes were removed.
+        """
+        for type_, interactions in self.interactions.items():
+            self.molecule.interactions[type_] = [
+                interaction for interaction in interactions if interaction is not None
+            ]
+        if self._removed_nodes:
+            for type_ in list(self.molecule.interactions):
+                if not self.molecule.interactions[type_]:
+                    del self.molecule.interactions[type_]
+
+
+def _apply_link_match(molecule, link, match, molecule_index, interactions,
+                      evaluated=None):
+    """
+    Apply a link on one of its matches.
+
+    Parameters
+    ----------
+    molecule: vermouth.molecule.Molecule
+    link: vermouth.molecule.Link
+    match: dict
+        The match from link node keys to molecule node keys.
+    molecule_index: _MoleculeIndex
+    interactions: _InteractionIndex
+    evaluated: dict or None
+        The values of the parameters already computed for this match, keyed
+        by the id of the parameter.
+
+    Returns
+    -------
+    list
+        The molecule nodes the link removes. They are not removed yet.
+    """
+    nodes_to_remove = []
+    for node, node_attrs in link.nodes.items():
+        if 'replace' in node_attrs:
+            if node_attrs['replace'].get('atomname', False) is None:
+                nodes_to_remove.append(match[node])
+            else:
+                node_mol = molecule.nodes[match[node]]
+                node_mol.update(node_attrs['replace'])
+                molecule_index.update(match[node])
+    for inter_type, link_interactions in link.removed_interactions.items():
+        for interaction in link_interactions:
+            interaction = _build_link_interaction_from(molecule, interaction,
+                                                       match, evaluated)
+            try:
+                interactions.remove_matching(inter_type, interaction)
+            except ValueError:
+                pass
+    for inter_type, link_interactions in link.interactions.items():
+        for interaction in link_interactions:
+            interaction = _build_link_interaction_from(molecule, interaction,
+                                                       match, evaluated)
+            interactions.add_or_replace(inter_type, *interaction)
+    return nodes_to_remove
+
+
+def _build_link_interaction_from(molecule, interaction, match, evaluated=None):
     atoms = tuple(match[idx] for idx in interaction.atoms)
-    parameters = [
-        param(molecule, match) if callable(param) else param
-        for param in interaction.parameters
-    ]
+    if evaluated is None:
+        evaluated = {}
+    parameters = []
+    for param in interaction.parameters:
+        if callable(param):
+            try:
+                param = evaluated[id(param)]
+            except KeyError:
+                param = param(molecule, match)
+        parameters.append(param)
     new_interaction = interaction._replace(
         atoms=atoms,
         parameters=parameters
@@ -262,31 +882,90 @@ def _build_link_interaction_from(molecule, interaction, match):
     return new_interaction
 
 
+def _may_apply(molecule, molecule_index, requirements):
+    """
+    Tell if a molecule contains all the facts required by a link.
+
+    Parameters
+    ----------
+    molecule: vermouth.molecule.Molecule
+    molecule_index: _MoleculeIndex
+    requirements: frozenset[tuple]
+        The requirements of the link, as given by
+        :func:`vermouth.forcefield.link_requirements`.
+
+    Returns
+    -------
+    bool
+        ``False`` if the link cannot apply to the molecule.
+    """
+    for kind, attr, values in requirements:
+        if kind == 'meta':
+            try:
+                if molecule.meta.get(attr) not in values:
+                    return False
+            except TypeError:
+                continue
+        elif not molecule_index.has_fact(attr, values):
+            return False
+    return True
+
+
 class DoLinks(Processor):
+    def __init__(self):
+        super().__init__()
+        # Links are compiled once, and cached by identity. A reference to the
+        # link is kept with the compiled version so the id cannot be reused.
+        self._compiled_links = {}
+
+    def _compile(self, link):
+        try:
+            _, compiled_link = self._compiled_links[id(link)]
+        except KeyError:
+            compiled_link = _CompiledLink(link)
+            self._compiled_links[id(link)] = (link, compiled_link)
+        return compiled_link
+
     def run_molecule(self, molecule):
         links = molecule.force_field.links
-        _nodes_to_remove = []
-        for link in links:
-            matches = match_link(molecule, link)
-            for match in matches:
-                for node, node_attrs in link.nodes.items():
-                    if 'replace' in node_attrs:
-                        if node_attrs['replace'].get('atomname', False) is None:
-                            _nodes_to_remove.append(match[node])
-                        else:
-                            node_mol = molecule.nodes[match[node]]
-                            node_mol.update(node_attrs['replace'])
-                for inter_type, interactions in link.removed_interactions.items():
-                    for interaction in interactions:
-                        interaction = _build_link_interaction_from(molecule, interaction, match)
-                        try:
-                            molecule.remove_matching_interaction(inter_type, interaction)
-                        except ValueError:
-                            pass
-                for inter_type, interactions in link.interactions.items():
-                    for interaction in interactions:
-                        interaction = _build_link_interaction_from(molecule, interaction, match)
-                        molecule.add_or_replace_interaction(inter_type, *interaction)
-
-            molecule.remove_nodes_from(_nodes_to_remove)
+        requirements = molecule.force_field.link_requirements
+        tracked = {attr for facts in requirements for kind, attr, _ in facts if kind == 'node'}
+        molecule_index = _MoleculeIndex(molecule, tracked)
+        interactions = _InteractionIndex(molecule)
+        n_skipped = 0
+        for link, link_facts in zip(links, requirements):
+            if not _may_apply(molecule, molecule_index, link_facts):
+                n_skipped += 1
+                continue
+            compiled_link = self._compile(link)
+            matches = match_link(molecule, link, molecule_index, compiled_link)
+            evaluated = None
+            if compiled_link.eager:
+                # Applying the link cannot change where it matches, so all
+                # the matches can be found before any is applied. Otherwise,
+                # each match is applied before looking for the next one.
+                # Knowing all the matches, the parameters that depend on the
+                # coordinates are computed at once.
+                matches = list(matches)
+                evaluated = _evaluate_effectors(molecule, compiled_link.effectors, matches)
+            nodes_to_remove = []
+            for idx, match in enumerate(matches):
+                nodes_to_remove.extend(_apply_link_match(
+                    molecule, link, match, molecule_index, interactions,
+                    evaluated[idx] if evaluated is not None else None,
+                ))
+            # The nodes are removed before the next link is matched, so it
+            # does not see them.
+            nodes_to_remove = [node for node in dict.fromkeys(nodes_to_remove)
+                               if node in molecule]
+            if nodes_to_remove:
+                interactions.remove_nodes(nodes_to_remove)
+                # The interactions are taken care of by the index.
+                molecule.remove_nodes_from(nodes_to_remove, interactions=False)
+                for node in nodes_to_remove:
+                    molecule_index.remove(node)
+                    del molecule_index.position[node]
+        interactions.commit()
+        LOGGER.debug('{} links out of {} could not apply to the molecule and were skipped.',
+                     n_skipped, len(links), type='general')
         return molecule
@@ -79,6 +79,24 @@ class GraphMapping:
         self._purge_forbidden(self.block_from)
         self._purge_forbidden(self.block_to)
 
+        # Index the nodes of block_from by residue and atom names, so simple
+        # molecules can be matched without a graph search. See
+        # `match_by_names`.
+        self.name_index = {}
+        for key, node in self.block_from.nodes.items():
+            name = (node.get('resname', ''), node.get('atomname', ''))
+            if name in self.name_index:
+                # Atom names are ambiguous, we cannot match by name.
+                self.name_index = None
+                break
+            self.name_index[name] = key
+
+        # The residue names the block can match, and the maximum number of
+        # residues a match can span. They restrict the graph search to small
+        # parts of the molecules. See `find_matches`.
+        self.resnames = {node.get('resname', '') for node in self.block_from.nodes.values()}
+        self.max_residues = _count_max_residues(self.block_from)
+
         # Since we merged blocks, there may be edges missing in both (between
         # the provided blocks). This is bad. We should add that info to the
         # mapping, somehow.
@@ -197,6 +215,271 @@ class MappingGraphMatcher(nx.isomorphism.isomorphvf2.GraphMatcher):
         return True
 
 
+def _count_max_residues(block):
+    """
+    Count how many residues of a molecule a match of a block can span at most.
+
+    Nodes bonded within a residue of the block can only match nodes bonded
+    within a residue of the molecule (see :func:`edge_matcher`), and nodes only
+    match nodes with the same residue name. Each group of nodes of the block
+    connected within residues therefore spans at most as many residues as it
+    has residue names.
+
+    Parameters
+    ----------
+    block: networkx.Graph
+
+    Returns
+    -------
+    int or None
+        ``None`` if the block is empty or not connected, in which case a match
+        can span any number of residues.
+    """
+    if not block or not nx.is_connected(block):
+        return None
+    within_residues = nx.Graph()
+    within_residues.add_nodes_from(block)
+    within_residues.add_edges_from(
+        (left, right) for left, right in block.edges
+        if block.nodes[left].get('resid') == block.nodes[right].get('resid')
+    )
+    return sum(
+        len({block.nodes[key].get('resname', '') for key in component})
+        for component in nx.connected_components(within_residues)
+    )
+
+
+def index_residues(molecule):
+    """
+    Build the residue graph of a molecule, and index the residues by name.
+
+    Parameters
+    ----------
+    molecule: vermouth.molecule.Molecule
+
+    Returns
+    -------
+    tuple or None
+        The residue graph as built by
+        :func:`~vermouth.graph_utils.make_residue_graph`, a dict of the
+        residue keys for each residue name, and a dict of the residue key for
+        each node key. ``None`` if the residues cannot be used to restrict the
+        graph search: some nodes lack a chain, resid, or resname, or some bonds
+        connect residues with the same resid in different chains.
+    """
+    try:
+        residue_graph = molecule.residue_graph
+    except (KeyError, TypeError):
+        return None
+    for left, right in residue_graph.edges:
+        left_residue = residue_graph.nodes[left]
+        right_residue = residue_graph.nodes[right]
+        if (left_residue['resid'] == right_residue['resid']
+                and left_residue['chain'] != right_residue['chain']):
+            return None
+    by_resname = defaultdict(list)
+    residue_of = {}
+    for residue_key, residue in residue_graph.nodes.items():
+        by_resname[residue['resname']].append(residue_key)
+        residue_of.update(dict.fromkeys(residue['graph'], residue_key))
+    return residue_graph, dict(by_resname), residue_of
+
+
+def find_matches(molecule, mapping, residue_index=None):
+    """
+    Find every way the block of a mapping fits on a molecule.
+
+    The graph search is not done on the whole molecule. Instead, it is done
+    around each residue that carries one of the residue names of the block,
+    including the neighbouring residues the match could span. A match is only
+    reported around the lowest residue it covers, so each match is found
+    once. The matches are the same as those of a search on the whole
+    molecule, but the cost grows linearly with the number of residues.
+
+    Parameters
+    ----------
+    molecule: vermouth.molecule.Molecule
+    mapping: GraphMapping
+    residue_index: tuple or None
+        The output of :func:`index_residues` for `molecule`. If ``None``, the
+        whole molecule is searched.
+
+    Yields
+    ------
+    dict
+        A match from molecule node keys to block node keys.
+    """
+    # TODO: add PTMs as a matching criterion here.
+    # Make sure the atomname and resname match
+    node_match = nx.isomorphism.categorical_node_match(['atomname', 'resname'], ['', ''])
+    # And make sure that we don't accidentally cross a residue boundary,
+    # unless that's allowed by the mapping.
+    edge_match = partial(edge_matcher, molecule, mapping.block_from)
+
+    if residue_index is None or mapping.max_residues is None:
+        graphmatcher = MappingGraphMatcher(molecule, mapping.block_from,
+                                           node_match=node_match, edge_match=edge_match)
+        yield from graphmatcher.subgraph_isomorphisms_iter()
+        return
+
+    residue_graph, by_resname, residue_of = residue_index
+    candidates = set()
+    for resname in mapping.resnames:
+        candidates.update(by_resname.get(resname, ()))
+    for anchor in sorted(candidates):
+        window = {anchor}
+        frontier = {anchor}
+        for _ in range(mapping.max_residues - 1):
+            frontier = {
+                neighbour
+                for residue in frontier
+                for neighbour in residue_graph[residue]
+                if neighbour in candidates and neighbour not in window
+            }
+            window.update(frontier)
+        nodes = [
+            key
+            for residue in sorted(window)
+            for key in residue_graph.nodes[residue]['graph']
+        ]
+        if len(nodes) < len(mapping.block_from):
+            continue
+        node_set = set(nodes)
+        local = nx.Graph()
+        local.add_nodes_from((key, molecule.nodes[key]) for key in nodes)
+        local.add_edges_from(
+            (key, neighbour)
+            for key in nodes
+            for neighbour in molecule.adj[key]
+            if neighbour in node_set
+        )
+        graphmatcher = MappingGraphMatcher(local, mapping.block_from,
+                                           node_match=node_match, edge_match=edge_match)
+        for match in graphmatcher.subgraph_isomorphisms_iter():
+            if min(residue_of[key] for key in match) == anchor:
+                yield match
+
+
+def _single_residue_names(molecule):
+    """
+    Map the atom names of a molecule to the node keys, if the molecule is a
+    single residue with unique atom names.
+
+    Returns
+    -------
+    tuple[str, dict[str, collections.abc.Hashable]] or None
+        The residue name, and the node key for each atom name. ``None`` if the
+        molecule contains more than one residue, or if the atom names are not
+        unique.
+    """
+    residues = set()
+    names = {}
+    for key, node in molecule.nodes.items():
+        residues.add((node.get('chain'), node.get('resid'), node.get('resname', '')))
+        atomname = node.get('atomname', '')
+        if len(residues) > 1 or atomname in names:
+            return None
+        names[atomname] = key
+    if not residues:
+        return None
+    resname = residues.pop()[2]
+    return resname, names
+
+
+def match_by_names(molecule, mapping, residue_names=None):
+    """
+    Find how the block of a mapping fits on a single residue molecule, based
+    on the atom names only.
+
+    When a molecule is a single residue with unique atom names, and the atom
+    names in the mapping block are unique as well, each node of the block can
+    only correspond to the molecule node that has the same name. The graph
+    search done by :class:`MappingGraphMatcher` is then not needed: the
+    correspondence is given by the names, and only has to be validated
+    against the edges.
+
+    Parameters
+    ----------
+    molecule: vermouth.molecule.Molecule
+    mapping: GraphMapping
+    residue_names: tuple or None
+        The output of :func:`_single_residue_names` for `molecule`, if
+        already computed.
+
+    Returns
+    -------
+    list[dict] or None
+        The matches from molecule node keys to block node keys; the list is
+        empty if the block does not fit on the molecule. The list is the same
+        as the one :class:`MappingGraphMatcher` would produce. ``None`` if the
+        match cannot be decided by names.
+    """
+    if residue_names is None:
+        residue_names = _single_residue_names(molecule)
+    if residue_names is None or mapping.name_index is None:
+        return None
+    resname, mol_names = residue_names
+
+    block = mapping.block_from
+    match = {}
+    for (block_resname, atomname), block_key in mapping.name_index.items():
+        if block_resname != resname or atomname not in mol_names:
+            return []
+        match[mol_names[atomname]] = block_key
+
+    # The match must be an induced subgraph isomorphism, and must not cross
+    # residue boundaries in the block as all the molecule is a single
+    # residue (see `edge_matcher`).
+    mol_edges = {
+        frozenset((match[left], match[right]))
+        for left, right in molecule.edges
+        if left in match and right in match
+    }
+    block_edges = set()
+    for left, right in block.edges:
+        if block.nodes[left].get('resid') != block.nodes[right].get('resid'):
+            return []
+        block_edges.add(frozenset((left, right)))
+    if mol_edges != block_edges:
+        return []
+    return [match]
+
+
+def _touching_pairs(molecule, matches):
+    """
+    Find the pairs of matches that share atoms, or that are bonded together.
+
+    The matches are indexed by atom, so only the matches that touch are
+    compared, rather than all the pairs of matches.
+
+    Parameters
+    ----------
+    molecule: networkx.Graph
+    matches: list[dict]
+        Matches from molecule node keys to block node keys.
+
+    Returns
+    -------
+    list[tuple[int, int]]
+        The pairs of indices in `matches`, in the same order as
+        ``combinations(range(len(matches)), 2)``.
+    """
+    matches_per_atom = defaultdict(list)
+    for match_idx, match in enumerate(matches):
+        for mol_idx in match:
+            matches_per_atom[mol_idx].append(match_idx)
+    pairs = []
+    for match_idx, match in enumerate(matches):
+        touching = set()
+        for mol_idx in match:
+            touching.update(matches_per_atom[mol_idx])
+            for neighbour in molecule[mol_idx]:
+                touching.update(matches_per_atom.get(neighbour, ()))
+        pairs.extend((match_idx, other_idx) for other_idx in sorted(touching)
+                     if other_idx > match_idx)
+    return pairs
+
+
 def edge_matcher(graph1, graph2, node11, node12, node21, node22):
     """
     Checks whether the resids for node11 and node12 in graph1 are the same, and
@@ -210,7 +493,7 @@ def edge_matcher(graph1, graph2, node11, node12, node21, node22):
            (node21.get('resid') == node22.get('resid'))
 
 
-def do_mapping(molecule, mappings, to_ff, attribute_keep=()):
+def do_mapping(molecule, mappings, to_ff, attribute_keep=(), pair_mapping=None):
     """
     Creates a new :class:`~vermouth.molecule.Molecule` in force field `to_ff`
     from `molecule`, based on `mappings`. It does this by doing a subgraph
@@ -233,6 +516,10 @@ def do_mapping(molecule, mappings, to_ff, attribute_keep=()):
         The force field to transform to.
     attribute_keep: :class:`~collections.abc.Iterable`
         The attributes to keep from `molecule`
+    pair_mapping: dict[str, GraphMapping] or None
+        The mappings from the force field of `molecule` to `to_ff`, as built
+        by :func:`build_graph_mapping_collection`. They are built from
+        `mappings` if not provided.
 
     Returns
     -------
@@ -245,20 +532,28 @@ def do_mapping(molecule, mappings, to_ff, attribute_keep=()):
     graph_out = Molecule(force_field=to_ff, meta=molecule.meta)
     # We want to keep the 'chain' property from the original molecule.
     attribute_keep = ['chain'] + list(attribute_keep)
-    pair_mapping = build_graph_mapping_collection(molecule.force_field, to_ff, mappings)
+    if pair_mapping is None:
+        pair_mapping = build_graph_mapping_collection(molecule.force_field, to_ff, mappings)
     all_matches = []
+    residue_names = _single_residue_names(molecule)
+    # The residues are only indexed if some mapping needs a graph search.
+    residue_index = None
+    indexed = False
     for resname, mapping in pair_mapping.items():
-        # TODO: add PTMs as a matching criterion here.
-        # Make sure the atomname and resname match
-        node_match = nx.isomorphism.categorical_node_match(['atomname', 'resname'], ['', ''])
-        # And make sure that we don't accidentally cross a residue boundary,
-        # unless that's allowed by the mapping.
-        edge_match = partial(edge_matcher, molecule, mapping.block_from)
-        # We're going to find *every* way block fits on molecule.
-        graphmatcher = MappingGraphMatcher(molecule, mapping.block_from,
-                                           node_match=node_match, edge_match=edge_match)
-        matches = graphmatcher.subgraph_isomorphisms_iter()
-        for match in matches:
+        # Small molecules, such as solvent, ions, or lipids are a single
+        # residue with unique atom names. They are matched on names, without
+        # graph search.
+        matches = None
+        if residue_names is not None:
+            matches = match_by_names(molecule, mapping, residue_names)
+        if matches is not None:
+            for match in matches:
+                all_matches.append((match, resname, mapping))
+            continue
+        if not indexed:
+            residue_index = index_residues(molecule)
+            indexed = True
+        for match in find_matches(molecule, mapping, residue_index):
             all_matches.append((match, resname, mapping))
     mol_to_out = defaultdict(list)
     blocks_per_atom = Counter()
@@ -313,9 +608,12 @@ def do_mapping(molecule, mappings, to_ff, attribute_keep=()):
     # We need to add edges between residues. Within residues comes from the
     # blocks.
     # TODO: backmapping needs some magic here.
-    for match1, match2 in combinations(all_matches, 2):
-        match1 = match1[0]
-        match2 = match2[0]
+    # Only the pairs of matches that share atoms or are bonded can lead to
+    # edges, so we do not look at the other ones.
+    matches = [match for match, _, _ in all_matches]
+    for match_idx, match_jdx in _touching_pairs(molecule, matches):
+        match1 = matches[match_idx]
+        match2 = matches[match_jdx]
         edges = molecule.edges_between(match1.keys(), match2.keys())
         for mol_idx, mol_jdx in edges:
             out_idxs = mol_to_out[mol_idx]
@@ -384,14 +682,28 @@ class DoMapping(Processor):
         self.to_ff = to_ff
         self.delete_unknown = delete_unknown
         self.attribute_keep = attribute_keep
+        # The mappings do not change between molecules, so we build them once
+        # per force field. Force fields are compared by identity, so we key
+        # the cache on their id, and keep a reference to the force field to
+        # make sure the id is not reused.
+        self._pair_mappings = {}
         super().__init__()
 
+    def _get_pair_mapping(self, from_ff):
+        try:
+            _, pair_mapping = self._pair_mappings[id(from_ff)]
+        except KeyError:
+            pair_mapping = build_graph_mapping_collection(from_ff, self.to_ff, self.mappings)
+            self._pair_mappings[id(from_ff)] = (from_ff, pair_mapping)
+        return pair_mapping
+
     def run_molecule(self, molecule):
         return do_mapping(
             molecule,
             mappings=self.mappings,
             to_ff=self.to_ff,
-            attribute_keep=self.attribute_keep
+            attribute_keep=self.attribute_keep,
+            pair_mapping=self._get_pair_mapping(molecule.force_field),
         )
 
     def run_system(self, system):
@@ -0,0 +1,464 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 University of Groningen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Compute the contact map for Virtual Site Go Martini, and write the
+corresponding include files.
+
+:class:`~vermouth.processors.go_vs_includes.GoVirtIncludes` adds the virtual
+sites and the include statements, but the Go potentials themselves used to be
+computed by the third party "create_goVirt.py" script. The processor defined
+here computes them from the atomistic structure stored under the "graph"
+attribute of the coarse grained beads.
+
+Two residues are in contact if they are in contact according to the overlap
+(OV) criterion, or according to the restricted chemical contacts of
+structural units (rCSU) criterion:
+
+* OV: the van der Waals spheres of two heavy atoms, enlarged by a factor
+  1.24, overlap.
+* rCSU: two residues make more attractive than repulsive atomic contacts.
+  Two heavy atoms are in contact if a water molecule cannot fit between their
+  van der Waals spheres. Whether a contact is attractive, repulsive, or
+  neutral depends on the chemical class of the atoms (hydrophobic, aromatic,
+  hydrogen bond donor or acceptor, ...).
+
+The rCSU criterion is an approximation of the one computed by the CSU
+software: contacts are not weighted by the surface through which the atoms
+see each other, and atoms hidden behind other atoms still count. The
+resulting maps are therefore denser than the reference ones.
+
+The contacts are then mapped to the virtual sites on top of the backbone
+beads. A Go potential is set between the virtual sites of two residues in
+contact, unless their backbone beads are too close or too far apart, or the
+residues are too close in sequence.
+"""
+
+from pathlib import Path
+
+import numpy as np
+
+from .. import KDTree
+from ..log_helpers import StyleAdapter, get_logger
+from .processor import Processor
+
+LOGGER = StyleAdapter(get_logger(__name__))
+
+#: Van der Waals radii of the heavy atoms, in nm, as used for the OV map.
+VDW_RADII = {
+    'C': 0.188,
+    'N': 0.164,
+    'O': 0.142,
+    'S': 0.177,
+}
+#: Factor by which the van der Waals radii are enlarged for the OV map.
+OV_FACTOR = 1.24
+#: Radius of a water molecule, in nm.
+WATER_RADIUS = 0.14
+
+NEUTRAL, HYDROPHOBIC, AROMATIC, DONOR, ACCEPTOR, DONOR_ACCEPTOR = range(6)
+
+#: Whether a contact between two atom classes is attractive (1), repulsive
+#: (-1), or neutral (0).
+CONTACT_SIGNS = np.zeros((6, 6), dtype=int)
+for _left, _right, _sign in (
+        (HYDROPHOBIC, HYDROPHOBIC, 1),
+        (HYDROPHOBIC, AROMATIC, 1),
+        (AROMATIC, AROMATIC, 1),
+        (DONOR, ACCEPTOR, 1),
+        (DONOR, DONOR_ACCEPTOR, 1),
+        (ACCEPTOR, DONOR_ACCEPTOR, 1),
+        (DONOR_ACCEPTOR, DONOR_ACCEPTOR, 1),
+        (DONOR, DONOR, -1),
+        (ACCEPTOR, ACCEPTOR, -1),
+        (DONOR, HYDROPHOBIC, -1),
+        (DONOR, AROMATIC, -1),
+        (ACCEPTOR, HYDROPHOBIC, -1),
+        (ACCEPTOR, AROMATIC, -1),
+        (DONOR_ACCEPTOR, HYDROPHOBIC, -1),
+        (DONOR_ACCEPTOR, AROMATIC, -1),
+):
+    CONTACT_SIGNS[_left, _right] = CONTACT_SIGNS[_right, _left] = _sign
+del _left, _right, _sign
+
+_BACKBONE_CLASSES = {
+    'N': DONOR, 'CA': NEUTRAL, 'C': NEUTRAL,
+    'O': ACCEPTOR, 'OXT': ACCEPTOR, 'OC1': ACCEPTOR, 'OC2': ACCEPTOR,
+}
+_AROMATIC_RING = {name: AROMATIC for name in ('CG', 'CD1', 'CD2', 'CE1', 'CE2', 'CZ')}
+#: Classes of the side chain atoms of the amino acids. Carbons are
+#: hydrophobic unless stated otherwise.
+_SIDE_CHAIN_CLASSES = {
+    'ARG': {'CD': NEUTRAL, 'NE': DONOR, 'CZ': NEUTRAL, 'NH1': DONOR, 'NH2': DONOR},
+    'ASN': {'CG': NEUTRAL, 'OD1': ACCEPTOR, 'ND2': DONOR},
+    'ASP': {'CG': NEUTRAL, 'OD1': ACCEPTOR, 'OD2': ACCEPTOR},
+    'GLN': {'CD': NEUTRAL, 'OE1': ACCEPTOR, 'NE2': DONOR},
+    'GLU': {'CD': NEUTRAL, 'OE1': ACCEPTOR, 'OE2': ACCEPTOR},
+    'HIS': {'CG': AROMATIC, 'ND1': DONOR_ACCEPTOR, 'CD2': AROMATIC,
+            'CE1': AROMATIC, 'NE2': DONOR_ACCEPTOR},
+    'LYS': {'CE': NEUTRAL, 'NZ': DONOR},
+    'PHE': _AROMATIC_RING,
+    'PRO': {'N': NEUTRAL, 'CD': NEUTRAL},
+    'SER': {'CB': NEUTRAL, 'OG': DONOR_ACCEPTOR},
+    'THR': {'CB': NEUTRAL, 'OG1': DONOR_ACCEPTOR},
+    'TRP': {'CG': AROMATIC, 'CD1': AROMATIC, 'CD2': AROMATIC, 'NE1': DONOR,
+            'CE2': AROMATIC, 'CE3': AROMATIC, 'CZ2': AROMATIC, 'CZ3': AROMATIC,
+            'CH2': AROMATIC},
+    'TYR': dict(_AROMATIC_RING, OH=DONOR_ACCEPTOR),
+}
+_ELEMENT_CLASSES = {'C': HYDROPHOBIC, 'N': DONOR, 'O': ACCEPTOR, 'S': HYDROPHOBIC}
+
+
+def atom_class(atom):
+    """
+    Find the chemical class of an atom for the rCSU criterion.
+
+    The class is read from the residue and atom names for the amino acids,
+    and guessed from the element otherwise.
+
+    Parameters
+    ----------
+    atom: dict
+        The node attributes of the atom. The "element" attribute is
+        required; "resname" and "atomname" are used if present.
+
+    Returns
+    -------
+    int
+        One of :data:`NEUTRAL`, :data:`HYDROPHOBIC`, :data:`AROMATIC`,
+        :data:`DONOR`, :data:`ACCEPTOR`, or :data:`DONOR_ACCEPTOR`.
+    """
+    atomname = atom.get('atomname')
+    side_chain = _SIDE_CHAIN_CLASSES.get(atom.get('resname'), {})
+    if atomname in side_chain:
+        return side_chain[atomname]
+    if atomname in _BACKBONE_CLASSES:
+        return _BACKBONE_CLASSES[atomname]
+    return _ELEMENT_CLASSES.get(atom.get('element'), NEUTRAL)
+
+
+def _close_pairs(positions, distance):
+    """
+    Find the pairs of positions closer than a distance from each other.
+
+    Returns
+    -------
+    numpy.ndarray
+        An array of shape (n, 2) of indices in `positions`.
+    """
+    tree = KDTree(positions)
+    try:
+        return tree.query_pairs(distance, output_type='ndarray')
+    except TypeError:
+        # The redistributed KDTree only returns sets.
+        return np.array(sorted(tree.query_pairs(distance)), dtype=int).reshape(-1, 2)
+
+
+def residue_contacts(positions, residues, elements, classes, ov_factor=OV_FACTOR,
+                     water_radius=WATER_RADIUS):
+    """
+    Find the pairs of residues in contact according to the OV and the
+    approximate rCSU criteria.
+
+    Parameters
+    ----------
+    positions: numpy.ndarray
+        The positions of the heavy atoms, in nm, as an array of shape (n, 3).
+    residues: numpy.ndarray
+        The residue index of each atom.
+    elements: list[str]
+        The element of each atom. Elements must be keys of
+        :data:`VDW_RADII`.
+    classes: numpy.ndarray
+        The chemical class of each atom, see :func:`atom_class`.
+    ov_factor: float
+        The factor by which the van der Waals radii are enlarged for the OV
+        criterion.
+    water_radius: float
+        The radius of a water molecule for the rCSU criterion, in nm.
+
+    Returns
+    -------
+    numpy.ndarray
+        An array of shape (m, 2) with the sorted pairs of residue indices in
+        contact. The pairs are sorted, and each is listed once.
+    """
+    positions = np.asarray(positions, dtype=float).reshape(-1, 3)
+    residues = np.asarray(residues, dtype=int)
+    classes = np.asarray(classes, dtype=int)
+    if not len(positions):
+        return np.zeros((0, 2), dtype=int)
+    radii = np.array([VDW_RADII[element] for element in elements])
+    max_radius = radii.max()
+    cutoff = max(2 * ov_factor * max_radius, 2 * (max_radius + water_radius))
+    left, right = _close_pairs(positions, cutoff).T
+    between = residues[left] != residues[right]
+    left = left[between]
+    right = right[between]
+
+    distances = np.linalg.norm(positions[left] - positions[right], axis=1)
+    radius_sums = radii[left] + radii[right]
+    n_residues = residues.max() + 1
+    first = np.minimum(residues[left], residues[right])
+    second = np.maximum(residues[left], residues[right])
+    pair_ids = first * n_residues + second
+
+    overlap = np.unique(pair_ids[distances <= ov_factor * radius_sums])
+
+    touching = distances <= radius_sums + 2 * water_radius
+    signs = CONTACT_SIGNS[classes[left[touching]], classes[right[touching]]]
+    csu_ids, inverse = np.unique(pair_ids[touching], return_inverse=True)
+    attractive = np.bincount(inverse, weights=signs > 0, minlength=len(csu_ids))
+    repulsive = np.bincount(inverse, weights=signs < 0, minlength=len(csu_ids))
+    rcsu = csu_ids[attractive > repulsive]
+
+    contacts = np.union1d(overlap, rcsu)
+    return np.stack([contacts // n_residues, contacts % n_residues], axis=1)
+
+
+def _leaf_atoms(graph):
+    """
+    Iterate over the atoms of a graph, descending into the "graph" attribute
+    of the nodes that have one.
+
+    After :class:`~vermouth.processors.apply_blocks.ApplyBlocks`, the "graph"
+    of a bead describes the coarse grained residue, and the atoms are one
+    level deeper.
+
+    Yields
+    ------
+    tuple
+        The key and the node attributes of each atom.
+    """
+    for key, node in graph.nodes.items():
+        subgraph = node.get('graph')
+        if subgraph is None:
+            yield key, node
+        else:
+            yield from _leaf_atoms(subgraph)
+
+
+def _collect_atoms(molecule):
+    """
+    Gather the heavy atoms with a position from the atomistic graphs of the
+    beads, grouped by residue.
+
+    Returns
+    -------
+    tuple
+        The residue keys as a list of (chain, resid) tuples, then the
+        positions, the residue indices, the elements, and the chemical
+        classes of the atoms.
+    """
+    residue_index = {}
+    seen = set()
+    positions = []
+    residues = []
+    elements = []
+    classes = []
+    for bead in molecule.nodes.values():
+        graph = bead.get('graph')
+        if graph is None:
+            continue
+        residue_key = (bead.get('chain'), bead.get('resid'))
+        residue = residue_index.setdefault(residue_key, len(residue_index))
+        for key, atom in _leaf_atoms(graph):
+            element = atom.get('element')
+            position = atom.get('position')
+            if (element not in VDW_RADII or position is None
+                    or (residue, key) in seen):
+                continue
+            position = np.asarray(position, dtype=float)
+            if np.any(np.isnan(position)):
+                continue
+            seen.add((residue, key))
+            positions.append(position)
+            residues.append(residue)
+            elements.append(element)
+            classes.append(atom_class(atom))
+    return list(residue_index), positions, residues, elements, classes
+
+
+def go_pairs(molecule, cutoff_short=0.3, cutoff_long=1.1, res_dist=3, **kwargs):
+    """
+    Find the pairs of Go virtual sites to connect with a Go potential.
+
+    The molecule must contain the virtual sites added by
+    :func:`vermouth.processors.go_vs_includes.add_virtual_sites`, and its
+    beads must have a "graph" attribute with the atomistic structure.
+
+    Parameters
+    ----------
+    molecule: vermouth.molecule.Molecule
+    cutoff_short: float
+        Residues with backbone beads closer than this distance, in nm, are
+        not connected.
+    cutoff_long: float
+        Residues with backbone beads further than this distance, in nm, are
+        not connected.
+    res_dist: int
+        Residues of a same chain are only connected if their resid differ by
+        at least this value.
+    **kwargs:
+        Passed to :func:`residue_contacts`.
+
+    Returns
+    -------
+    list[tuple]
+        For each pair, the keys of the two virtual sites, the keys of the
+        two corresponding backbone beads, and the distance between the
+        backbone beads in nm.
+    """
+    virtual_sites = {}
+    for interaction in molecule.interactions.get('virtual_sitesn', []):
+        if interaction.meta.get('go_vs'):
+            site, backbone = interaction.atoms
+            bead = molecule.nodes[backbone]
+            virtual_sites[(bead.get('chain'), bead.get('resid'))] = (site, backbone)
+
+    residue_keys, positions, residues, elements, classes = _collect_atoms(molecule)
+    contacts = residue_contacts(positions, residues, elements, classes, **kwargs)
+
+    pairs = []
+    for left, right in contacts:
+        left_key = residue_keys[left]
+        right_key = residue_keys[right]
+        if left_key not in virtual_sites or right_key not in virtual_sites:
+            continue
+        if left_key[0] == right_key[0] and abs(left_key[1] - right_key[1]) < res_dist:
+            continue
+        left_site, left_backbone = virtual_sites[left_key]
+        right_site, right_backbone = virtual_sites[right_key]
+        distance = np.linalg.norm(molecule.nodes[left_backbone]['position']
+                                  - molecule.nodes[right_backbone]['position'])
+        if cutoff_short <= distance <= cutoff_long:
+            pairs.append((left_site, right_site, left_backbone, right_backbone, distance))
+    return pairs
+
+
+def write_go_files(molecule, pairs, directory='.', moltype=None, epsilon=9.414):
+    """
+    Write the include files for Virtual Site Go Martini.
+
+    Three files are written, named "<moltype>_<section>_VirtGoSites.itp":
+
+    * "atomtypes" declares the bead types of the virtual sites, and is meant
+      to be included in the ``[ atomtypes ]`` section of the force field;
+    * "nonbond_params" sets the Go potentials between the bead types of the
+      virtual sites, and is meant to be included in the ``[ nonbond_params
+      ]`` section of the force field;
+    * "exclusions" excludes the regular non-bonded interactions between the
+      backbone beads of residues connected by a Go potential. It is included
+      in the ``[ exclusions ]`` section of the molecule by
+      :class:`~vermouth.processors.go_vs_includes.GoVirtIncludes`.
+
+    Parameters
+    ----------
+    molecule: vermouth.molecule.Molecule
+        The molecule, as it will be written in the ITP file.
+    pairs: list[tuple]
+        The pairs as returned by :func:`go_pairs`.
+    directory: str or pathlib.Path
+        The directory in which to write the files.
+    moltype: str or None
+        The molecule type name. Read from the "moltype" meta attribute of the
+        molecule if ``None``.
+    epsilon: float
+        The depth of the Go potentials, in kJ/mol.
+    """
+    if moltype is None:
+        moltype = molecule.meta['moltype']
+    directory = Path(directory)
+    template = str(directory / '{}_{{}}_VirtGoSites.itp'.format(moltype))
+    # Atoms are numbered in the ITP file in the order of the molecule.
+    atom_index = {key: idx for idx, key in enumerate(molecule.nodes, start=1)}
+
+    with open(template.format('atomtypes'), 'w') as outfile:
+        outfile.write('; Virtual sites for Go Martini\n')
+        for interaction in molecule.interactions.get('virtual_sitesn', []):
+            if interaction.meta.get('go_vs'):
+                site = molecule.nodes[interaction.atoms[0]]
+                outfile.write('{} 0.0 0.000 A 0.0 0.0\n'.format(site['atype']))
+
+    sigma_factor = 2 ** (-1 / 6)
+    with open(template.format('nonbond_params'), 'w') as outfile:
+        outfile.write('; OV + rCSU contact map\n')
+        for left_site, right_site, left_backbone, right_backbone, distance in pairs:
+            left = molecule.nodes[left_backbone]
+            right = molecule.nodes[right_backbone]
+            outfile.write(
+                '{} {} 1 {:.10f} {:.10f} ; {}{} {}{} {:.3f}\n'.format(
+                    molecule.nodes[left_site]['atype'],
+                    molecule.nodes[right_site]['atype'],
+                    distance * sigma_factor, epsilon,
+                    left.get('resname'), left.get('resid'),
+                    right.get('resname'), right.get('resid'),
+                    distance,
+                )
+            )
+
+    with open(template.format('exclusions'), 'w') as outfile:
+        outfile.write('; Backbone beads connected by a Go potential\n')
+        for _, _, left_backbone, right_backbone, _ in pairs:
+            outfile.write('{} {}\n'.format(atom_index[left_backbone],
+                                           atom_index[right_backbone]))
+
+
+class GoContactMap(Processor):
+    """
+    Compute the Go contact map of molecules, and write the include files for
+    Virtual Site Go Martini.
+
+    The molecules must have been processed by
+    :class:`~vermouth.processors.go_vs_includes.GoVirtIncludes`, and their
+    beads must have the atomistic structure under their "graph" attribute.
+    See :mod:`vermouth.processors.go_contact_map` for a description of the
+    contact map, and :func:`write_go_files` for the files written.
+
+    Parameters
+    ----------
+    directory: str or pathlib.Path
+        The directory in which to write the files.
+    epsilon: float
+        The depth of the Go potentials, in kJ/mol.
+    cutoff_short: float
+        Residues with backbone beads closer than this distance, in nm, are
+        not connected.
+    cutoff_long: float
+        Residues with backbone beads further than this distance, in nm, are
+        not connected.
+    res_dist: int
+        Residues of a same chain are only connected if their resid differ by
+        at least this value.
+    """
+    def __init__(self, directory='.', epsilon=9.414, cutoff_short=0.3,
+                 cutoff_long=1.1, res_dist=3):
+        super().__init__()
+        self.directory = directory
+        self.epsilon = epsilon
+        self.cutoff_short = cutoff_short
+        self.cutoff_long = cutoff_long
+        self.res_dist = res_dist
+
+    def run_molecule(self, molecule):
+        moltype = molecule.meta.get('moltype')
+        if not moltype:
+            raise ValueError('The molecule does not have a moltype name.')
+        pairs = go_pairs(molecule, cutoff_short=self.cutoff_short,
+                         cutoff_long=self.cutoff_long, res_dist=self.res_dist)
+        LOGGER.info('{} Go contacts for molecule type {}.', len(pairs), moltype,
+                    type='general')
+        write_go_files(molecule, pairs, directory=self.directory,
+                       moltype=moltype, epsilon=self.epsilon)
+        return molecule
@@ -31,8 +31,7 @@ class MergeAllMolecules(Processor):
             return system
 
         molecule = system.molecules[0]
-        for other in system.molecules[1:]:
-            molecule.merge_molecule(other)
+        molecule.concatenate(system.molecules[1:])
 
         system.molecules = [molecule]
         return system
@@ -16,11 +16,14 @@
 """
 Provides a processor that repairs a graph based on a reference.
 """
+from collections.abc import MutableMapping
+from concurrent.futures import ProcessPoolExecutor
+
 import networkx as nx
 
 from .processor import Processor
 from ..graph_utils import *
-from ..ismags import ISMAGS
+from ..ismags import ISMAGS, SYMMETRY_CACHE
 from ..log_helpers import StyleAdapter, get_logger
 from ..utils import format_atom_string
 
@@ -50,7 +53,337 @@ def get_default(dictionary, attr, default):
     return item
 
 
-def make_reference(mol):
+def _match_by_names(reference, residue):
+    """
+    Match a residue on its reference when they have the same atom names, the
+    same elements, and the same edges.
+
+    This is the most common case for residues that are complete in the input.
+    The correspondence is then given by the names, and there is no need for a
+    graph search.
+
+    Parameters
+    ----------
+    reference: networkx.Graph
+    residue: networkx.Graph
+
+    Returns
+    -------
+    dict or None
+        The match from reference node keys to residue node keys. ``None`` if
+        the residue is not an exact, named, copy of the reference.
+    """
+    if len(reference) != len(residue):
+        return None
+    named_graphs = []
+    for graph in (reference, residue):
+        names = {}
+        for key, node in graph.nodes.items():
+            name = node.get('atomname')
+            if name is None or name in names:
+                return None
+            names[name] = key
+        named_graphs.append(names)
+    ref_names, res_names = named_graphs
+    if ref_names.keys() != res_names.keys():
+        return None
+    match = {ref_names[name]: res_names[name] for name in ref_names}
+    for ref_key, res_key in match.items():
+        if reference.nodes[ref_key].get('element') != residue.nodes[res_key].get('element'):
+            return None
+    ref_edges = {frozenset((match[left], match[right])) for left, right in reference.edges}
+    res_edges = {frozenset(edge) for edge in residue.edges}
+    if ref_edges != res_edges:
+        return None
+    return match
+
+
+def _match_with_ismags(reference, residue, symmetry_cache):
+    """
+    Find the largest common subgraph between a residue and its reference.
+
+    Parameters
+    ----------
+    reference: networkx.Graph
+    residue: networkx.Graph
+    symmetry_cache: collections.abc.MutableMapping
+        The cache given to :class:`~vermouth.ismags.ISMAGS`.
+
+    Returns
+    -------
+    dict or None
+        The match from reference node keys to residue node keys. ``None`` if
+        no match can be found.
+    """
+    # We are going to sort the nodes of reference and residue by atomname.
+    # We do this, because the ISMAGS algorithm prefers to match nodes with
+    # lower IDs.
+    # Get a \uFFFF for every node that doesn't have an atomname attribute
+    # or when it's None, since that sorts higher than letters, giving them
+    # the lowest priority in ISMAGS.
+
+    res_names = {idx: get_default(residue.nodes[idx], 'atomname', '\uFFFF') for idx in residue}
+    ref_names = {idx: get_default(reference.nodes[idx], 'atomname', '\uFFFF') for idx in reference}
+
+    # Sort the nodes such that any atomnames that are common to both
+    # reference and residue are first, and then the rest.
+    # Also, sort it all by atomname. This is combined in one by sorting by
+    # the tuple (not common, atomname). False < True.
+
+    # If we want to relabel the nodes in-place we need to find new
+    # non-overlapping labels. The easiest way of doing this is by turning
+    # them into tuples. But this makes everything slow; probably because
+    # ISMAGS does quite a lot of inequality comparisons, and those are way
+    # faster for str/int. So, sacrifice the memory, and relabel by making a
+    # new copy.
+
+    # TODO: include a geometric alignment in the sorting. Humans are really
+    #       good at solving isomorphism problems iff graphs look alike. We
+    #       can do a similar trick here by rot+trans aligning the given
+    #       residue with a reference conformation. And then sort by
+    #       distance
+    new_residue_names = {old: new for new, old in enumerate(sorted(residue,
+                         key=lambda jdx: (res_names[jdx] not in ref_names.values(), res_names[jdx])))}
+    new_reference_names = {old: new for new, old in enumerate(sorted(reference,
+                           key=lambda jdx: (ref_names[jdx] not in res_names.values(), ref_names[jdx])))}
+
+    old_res_names = {v: k for k, v in new_residue_names.items()}
+    old_ref_names = {v: k for k, v in new_reference_names.items()}
+
+    # It would be nice if we were able to relabel them in-place, but it
+    # seems to make everything slower. See above.
+    res_copy = nx.relabel_nodes(residue, new_residue_names, copy=True)
+    ref_copy = nx.relabel_nodes(reference, new_reference_names, copy=True)
+
+    # If we assume residue > reference the tests run *way* faster, but the
+    # actual program becomes *much* *much* slower.
+    ismags = ISMAGS(ref_copy, res_copy,
+                    node_match=nx.isomorphism.categorical_node_match('element', None),
+                    cache=symmetry_cache)
+    # Finding the largest common subgraph is expensive, but the first step
+    # is to try and find a subgraph isomorphism between
+    # residue <= reference, so best case it makes no difference, and worst
+    # case we avoid trying to find that isomorphism twice.
+    match_iter = ismags.largest_common_subgraph()
+    try:
+        # We take only the first found match, since because the nodes are
+        # sorted by atomname, and ISMAGS prefers to take nodes with low ID,
+        # that match should have most matching atomnames.
+        match = next(match_iter)
+    except StopIteration:
+        return None
+    # TODO: Since we only have one isomorphism we don't know whether the
+    # assigment we're making is ambiguous. So iff the residue is small
+    # enough (or a flag is set, whatever), also find the second isomorphism
+    # and check whether it has the same number of correct atomnames. If so,
+    # issue a warning and carry on. We can't do this for all residues,
+    # since that takes a cup of coffee.
+
+    # "unsort" the matches
+    return {old_ref_names[ref]: old_res_names[res] for ref, res in match.items()}
+
+
+def _compact_graph(graph):
+    """
+    Copy a graph with only what is needed to match it with its reference.
+
+    The nodes are relabelled to consecutive integers in the order of the
+    graph, and only keep their atom name and element.
+
+    Parameters
+    ----------
+    graph: networkx.Graph
+
+    Returns
+    -------
+    networkx.Graph
+        The compact copy of the graph.
+    list
+        The original node keys, indexed by the new ones.
+    """
+    keys = list(graph.nodes)
+    index = {key: idx for idx, key in enumerate(keys)}
+    compact = nx.Graph()
+    compact.add_nodes_from(
+        (index[key], {'atomname': node.get('atomname'), 'element': node.get('element')})
+        for key, node in graph.nodes.items()
+    )
+    compact.add_edges_from((index[left], index[right]) for left, right in graph.edges)
+    return compact, keys
+
+
+class _RecordingCache(MutableMapping):
+    """
+    Wrap a symmetry cache to record what is looked for and added to it.
+
+    Attributes
+    ----------
+    added: list[tuple]
+        The items added to the cache.
+    hits: int
+        The number of keys found in the cache.
+    misses: int
+        The number of keys not found in the cache.
+    """
+    def __init__(self, cache):
+        self._cache = cache
+        self.added = []
+        self.hits = 0
+        self.misses = 0
+
+    def __getitem__(self, key):
+        try:
+            value = self._cache[key]
+        except KeyError:
+            self.misses += 1
+            raise
+        self.hits += 1
+        return value
+
+    def __setitem__(self, key, value):
+        self._cache[key] = value
+        self.added.append((key, value))
+
+    def __delitem__(self, key):
+        del self._cache[key]
+
+    def __iter__(self):
+        return iter(self._cache)
+
+    def __len__(self):
+        return len(self._cache)
+
+
+def _seed_symmetry_cache(items):
+    """
+    Fill the symmetry cache of a worker process with the items of the cache
+    of the main process.
+
+    Forked workers inherit the global cache of the main process, which may
+    not be the cache in use; it is emptied first.
+    """
+    SYMMETRY_CACHE.clear()
+    for key, value in items:
+        SYMMETRY_CACHE[key] = value
+
+
+def make_executor(processes, symmetry_cache=None):
+    """
+    Create the worker processes used by :func:`make_reference`.
+
+    The symmetry cache of each worker starts with the content of
+    `symmetry_cache`.
+
+    Parameters
+    ----------
+    processes: int
+        The number of worker processes.
+    symmetry_cache: collections.abc.MutableMapping or None
+        The symmetry cache of the main process; defaults to
+        :data:`vermouth.ismags.SYMMETRY_CACHE`.
+
+    Returns
+    -------
+    concurrent.futures.ProcessPoolExecutor
+    """
+    if symmetry_cache is None:
+        symmetry_cache = SYMMETRY_CACHE
+    return ProcessPoolExecutor(max_workers=processes,
+                               initializer=_seed_symmetry_cache,
+                               initargs=(list(symmetry_cache.items()), ))
+
+
+def _match_compact(task):
+    """
+    Match a compact residue on its compact reference, in a worker process.
+
+    The worker processes use their own symmetry cache,
+    :data:`vermouth.ismags.SYMMETRY_CACHE`. The symmetries they add to it,
+    and how often they find them, are returned so the main process can
+    account for them.
+
+    Returns
+    -------
+    dict or None
+        The match, see :func:`_match_with_ismags`.
+    list[tuple]
+        The items added to the symmetry cache.
+    int
+        The number of symmetries found in the cache.
+    int
+        The number of symmetries not found in the cache.
+    """
+    reference, residue = task
+    cache = _RecordingCache(SYMMETRY_CACHE)
+    match = _match_with_ismags(reference, residue, cache)
+    return match, cache.added, cache.hits, cache.misses
+
+
+def _match_all_with_ismags(pairs, symmetry_cache, processes=None, executor=None):
+    """
+    Match residues on their reference with :func:`_match_with_ismags`.
+
+    Parameters
+    ----------
+    pairs: list[tuple[networkx.Graph, networkx.Graph]]
+        The reference and the residue to match, for each residue.
+    symmetry_cache: collections.abc.MutableMapping
+        The symmetry cache to use when the residues are matched in this
+        process. The symmetries found by the worker processes are added to
+        it, and their lookups are added to its ``hits`` and ``misses``
+        counters if it has any.
+    processes: int or None
+        The number of worker processes. The residues are matched in this
+        process if ``None`` or 1.
+    executor: concurrent.futures.Executor or None
+        The worker processes, as created by :func:`make_executor`. If
+        ``None``, workers are started for this call only.
+
+    Returns
+    -------
+    list[dict or None]
+        The matches, in the order of `pairs`.
+    """
+    if processes is None or processes <= 1 or len(pairs) <= 1:
+        return [_match_with_ismags(reference, residue, symmetry_cache)
+                for reference, residue in pairs]
+
+    compact_references = {}
+    tasks = []
+    keys = []
+    for reference, residue in pairs:
+        # Many residues share a reference; only compact it once.
+        if id(reference) not in compact_references:
+            compact_references[id(reference)] = _compact_graph(reference)
+        compact_reference, reference_keys = compact_references[id(reference)]
+        compact_residue, residue_keys = _compact_graph(residue)
+        tasks.append((compact_reference, compact_residue))
+        keys.append((reference_keys, residue_keys))
+
+    chunksize = max(1, len(tasks) // (4 * processes))
+    if executor is None:
+        with make_executor(processes, symmetry_cache) as own_executor:
+            results = list(own_executor.map(_match_compact, tasks, chunksize=chunksize))
+    else:
+        results = list(executor.map(_match_compact, tasks, chunksize=chunksize))
+
+    matches = []
+    for (compact_match, added, hits, misses), (reference_keys, residue_keys) \
+            in zip(results, keys):
+        for key, value in added:
+            symmetry_cache[key] = value
+        if hasattr(symmetry_cache, 'hits'):
+            symmetry_cache.hits += hits
+            symmetry_cache.misses += misses
+        if compact_match is None:
+            matches.append(None)
+        else:
+            matches.append({reference_keys[ref]: residue_keys[res]
+                            for ref, res in compact_match.items()})
+    return matches
+
+
+def make_reference(mol, symmetry_cache=None, processes=None, executor=None):
     """
     Takes an molecule graph (e.g. as read from a PDB file), and finds and
     returns the graph how it should look like, including all matching nodes
@@ -73,6 +406,17 @@ def make_reference(mol):
         :element: The element.
         :atomname: The atomname.
 
+    symmetry_cache : collections.abc.MutableMapping or None
+        The cache for the symmetries of the reference residues. The symmetry
+        cache shared by the process,
+        :data:`vermouth.ismags.SYMMETRY_CACHE`, is used if ``None``.
+    processes : int or None
+        The number of worker processes used to match the residues that
+        cannot be matched by their atom names.
+    executor : concurrent.futures.Executor or None
+        The worker processes to use, as created by :func:`make_executor`.
+        Workers are started for this call only if ``None``.
+
     Returns
     -------
     networkx.Graph
@@ -88,92 +432,52 @@ def make_reference(mol):
             reference, values are node indices of the provided graph.
     """
     reference_graph = nx.Graph()
-    residues = make_residue_graph(mol)
-    symmetry_cache = {}
+    residues = mol.residue_graph
+    if symmetry_cache is None:
+        symmetry_cache = SYMMETRY_CACHE
+    # The residues are first matched by their names. The ones that cannot be
+    # are then matched all at once, possibly in parallel. If something goes
+    # wrong with a residue, the residues before it are still matched and
+    # reported before the error is raised.
+    todo = []
+    error = None
     for residx in residues:
         # TODO: make separate function for just one residue.
         # TODO: Merge degree 1 nodes (hydrogens!) with the parent node. And
         # check whether the node degrees match?
-
-        resname = residues.node[residx]['resname']
-        resid = residues.node[residx]['resid']
-        chain = residues.node[residx]['chain']
-        residue = residues.node[residx]['graph']
-        reference = mol.force_field.reference_graphs[resname]
-        add_element_attr(reference)
-        add_element_attr(residue)
-        # We are going to sort the nodes of reference and residue by atomname.
-        # We do this, because the ISMAGS algorithm prefers to match nodes with
-        # lower IDs.
-        # Get a \uFFFF for every node that doesn't have an atomname attribute
-        # or when it's None, since that sorts higher than letters, giving them
-        # the lowest priority in ISMAGS.
-
-        res_names = {idx: get_default(residue.nodes[idx], 'atomname', '\uFFFF') for idx in residue}
-        ref_names = {idx: get_default(reference.nodes[idx], 'atomname', '\uFFFF') for idx in reference}
-
-        # Sort the nodes such that any atomnames that are common to both
-        # reference and residue are first, and then the rest.
-        # Also, sort it all by atomname. This is combined in one by sorting by
-        # the tuple (not common, atomname). False < True.
-
-        # If we want to relabel the nodes in-place we need to find new
-        # non-overlapping labels. The easiest way of doing this is by turning
-        # them into tuples. But this makes everything slow; probably because
-        # ISMAGS does quite a lot of inequality comparisons, and those are way
-        # faster for str/int. So, sacrifice the memory, and relabel by making a
-        # new copy.
-
-        # TODO: include a geometric alignment in the sorting. Humans are really
-        #       good at solving isomorphism problems iff graphs look alike. We
-        #       can do a similar trick here by rot+trans aligning the given
-        #       residue with a reference conformation. And then sort by
-        #       distance
-        new_residue_names = {old: new for new, old in enumerate(sorted(residue,
-                             key=lambda jdx: (res_names[jdx] not in ref_names.values(), res_names[jdx])))}
-        new_reference_names = {old: new for new, old in enumerate(sorted(reference,
-                               key=lambda jdx: (ref_names[jdx] not in res_names.values(), ref_names[jdx])))}
-
-        old_res_names = {v: k for k, v in new_residue_names.items()}
-        old_ref_names = {v: k for k, v in new_reference_names.items()}
-
-        # It would be nice if we were able to relabel them in-place, but it
-        # seems to make everything slower. See above.
-        res_copy = nx.relabel_nodes(residue, new_residue_names, copy=True)
-        ref_copy = nx.relabel_nodes(reference, new_reference_names, copy=True)
-
-        # If we assume residue > reference the tests run *way* faster, but the
-        # actual program becomes *much* *much* slower.
-        ismags = ISMAGS(ref_copy, res_copy,
-                        node_match=nx.isomorphism.categorical_node_match('element', None),
-                        cache=symmetry_cache)
-        # Finding the largest common subgraph is expensive, but the first step
-        # is to try and find a subgraph isomorphism between
-        # residue <= reference, so best case it makes no difference, and worst
-        # case we avoid trying to find that isomorphism twice.
-        match_iter = ismags.largest_common_subgraph()
         try:
-            # We take only the first found match, since because the nodes are
-            # sorted by atomname, and ISMAGS prefers to take nodes with low ID,
-            # that match should have most matching atomnames.
-            match = next(match_iter)
-        except StopIteration:
+            resname = residues.node[residx]['resname']
+            resid = residues.node[residx]['resid']
+            chain = residues.node[residx]['chain']
+            # The residue is a view on the molecule; it is copied so that
+            # guessing its elements does not change the molecule.
+            residue = residues.node[residx]['graph'].copy()
+            reference = mol.force_field.reference_graphs[resname]
+            add_element_attr(reference)
+            add_element_attr(residue)
+        except Exception as err:  # pylint: disable=broad-except
+            error = err
+            break
+        match = _match_by_names(reference, residue)
+        todo.append([residx, resname, resid, chain, reference, residue, match])
+
+    unnamed = [item for item in todo if item[-1] is None]
+    matches = _match_all_with_ismags([(item[4], item[5]) for item in unnamed],
+                                     symmetry_cache, processes, executor)
+    for item, match in zip(unnamed, matches):
+        item[-1] = match
+
+    for residx, resname, resid, chain, reference, residue, match in todo:
+        if match is None:
             LOGGER.error("Can't find isomorphism between {}{} and its "
                          "reference.", resname, resid, type='inconsistent-data')
             continue
-        # TODO: Since we only have one isomorphism we don't know whether the
-        # assigment we're making is ambiguous. So iff the residue is small
-        # enough (or a flag is set, whatever), also find the second isomorphism
-        # and check whether it has the same number of correct atomnames. If so,
-        # issue a warning and carry on. We can't do this for all residues,
-        # since that takes a cup of coffee.
-
-        # "unsort" the matches
-        match = {old_ref_names[ref]: old_res_names[res] for ref, res in match.items()}
 
         reference_graph.add_node(residx, chain=chain, reference=reference,
                                  found=residue, resname=resname, resid=resid,
                                  match=match)
+    if error is not None:
+        raise error
     reference_graph.add_edges_from(residues.edges())
     return reference_graph
 
@@ -335,18 +639,34 @@ def repair_graph(molecule, reference_graph, include_graph=True):
 
 
 class RepairGraph(Processor):
-    def __init__(self, delete_unknown=False, include_graph=True):
+    def __init__(self, delete_unknown=False, include_graph=True, processes=None):
         super().__init__()
         self.delete_unknown = delete_unknown
         self.include_graph=include_graph
+        self.processes = processes
+        self._executor = None
 
     def run_molecule(self, molecule):
         molecule = molecule.copy()
-        reference_graph = make_reference(molecule)
+        reference_graph = make_reference(molecule, processes=self.processes,
+                                         executor=self._executor)
         repair_graph(molecule, reference_graph, include_graph=self.include_graph)
         return molecule
 
     def run_system(self, system):
+        # The worker processes are shared by all the molecules. They are
+        # only started if a residue needs them.
+        if self.processes is not None and self.processes > 1:
+            with make_executor(self.processes) as executor:
+                self._executor = executor
+                try:
+                    self._run_system(system)
+                finally:
+                    self._executor = None
+        else:
+            self._run_system(system)
+
+    def _run_system(self, system):
         mols = []
         for idx, molecule in enumerate(system.molecules):
             try:
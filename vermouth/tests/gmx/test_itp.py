@@ -21,11 +21,12 @@ Test the writing of ITP file.
 # Some of the expected outputs do contain trailing whitespaces.
 # pylint: disable=trailing-whitespace
 
+from concurrent.futures import ThreadPoolExecutor
 import io
 import textwrap
 import pytest
 import vermouth
-from vermouth.gmx.itp import write_molecule_itp
+from vermouth.gmx.itp import write_molecule_itp, write_molecule_itps
 from vermouth.molecule import Interaction, Molecule
 
 
@@ -208,3 +209,110 @@ def test_pre_post_section_lines(pre_meta, post_meta):
     # understant what is happening in case of a failure.
     for segment in expected_segments:
         assert textwrap.dedent(segment)[:-1] in itp_content
+
+
+def test_interaction_groups():
+    """
+    Interactions are grouped by conditional and group, keep their order
+    within a group, and are aligned on the widest atom index.
+    """
+    molecule = Molecule(nrexcl=1)
+    molecule.add_nodes_from(
+        (key, {'atype': 'P5', 'resid': 1, 'resname': 'ALA', 'atomname': 'BB',
+               'charge_group': 1, 'charge': 0.5})
+        for key in range(5, 15)
+    )
+    molecule.meta['moltype'] = 'TEST'
+    molecule.interactions['bonds'] = [
+        Interaction(atoms=[14, 5], parameters=['1', '0.3', '500'],
+                    meta={'group': 'Rubber band', 'ifdef': 'RUBBER'}),
+        Interaction(atoms=[5, 6], parameters=['1', 0.35, 1250], meta={}),
+        Interaction(atoms=[13, 6], parameters=['1', '0.3', '500'],
+                    meta={'group': 'Rubber band', 'ifdef': 'RUBBER',
+                          'comment': 'elastic'}),
+        Interaction(atoms=[6, 7], parameters=['1', '0.35', '1250'],
+                    meta={'comment': 'backbone'}),
+    ]
+    molecule.interactions['virtual_sitesn'] = [
+        Interaction(atoms=[14, 5, 6], parameters=['1'], meta={}),
+    ]
+    outfile = io.StringIO()
+    write_molecule_itp(molecule, outfile)
+    sections = outfile.getvalue().split('\n\n')
+    assert sections[1].splitlines()[1] == ' 1 P5 1 ALA BB 1 0.5 '
+    assert sections[2:] == [
+        textwrap.dedent("""\
+            [ bonds ]
+             1  2 1 0.35 1250
+             2  3 1 0.35 1250 ; backbone"""),
+        textwrap.dedent("""\
+            #ifdef RUBBER
+            ; Rubber band
+            10  1 1 0.3 500
+             9  2 1 0.3 500 ; elastic
+            #endif"""),
+        textwrap.dedent("""\
+            [ virtual_sitesn ]
+            10 1  1  2"""),
+        '',
+    ]
+
+
+@pytest.mark.parametrize('processes, start_method', (
+    (None, None),
+    (2, None),
+    (2, 'spawn'),
+))
+def test_write_molecule_itps(tmpdir, monkeypatch, dummy_molecule,
+                             processes, start_method):
+    """
+    Writing several ITP files, possibly in parallel, gives the same files as
+    writing them one by one; failures do not prevent the other files from
+    being written.
+    """
+    if start_method is not None:
+        # Pretend the worker processes do not inherit the molecules, so they
+        # are sent to the workers.
+        monkeypatch.setattr(vermouth.gmx.itp.multiprocessing, 'get_start_method',
+                            lambda: start_method)
+    molecules = []
+    for moltype in ('A', 'B', 'C'):
+        molecule = dummy_molecule.copy()
+        molecule.meta = dict(dummy_molecule.meta, moltype=moltype)
+        molecule.nodes[0]['position'] = [0, 0, 0]
+        molecule.interactions['bonds'] = [
+            Interaction(atoms=[0, 1], parameters=['1', '0.3', '500'], meta={}),
+        ]
+        molecules.append(molecule)
+    paths = [tmpdir / 'A.itp', tmpdir / 'missing' / 'B.itp', tmpdir / 'C.itp']
+    with pytest.raises(OSError):
+        write_molecule_itps(molecules, paths, header=['header'], processes=processes)
+    for molecule, path in zip(molecules[::2], paths[::2]):
+        expected = io.StringIO()
+        write_molecule_itp(molecule, expected, header=['header'])
+        assert path.read() == expected.getvalue()
+
+
+def test_write_molecule_itps_concurrent(tmpdir, dummy_molecule):
+    """
+    Concurrent calls to write_molecule_itps do not mix their molecules.
+    """
+    batches = []
+    for batch in range(2):
+        molecules = []
+        for moltype in ('A', 'B'):
+            molecule = dummy_molecule.copy()
+            molecule.meta = dict(dummy_molecule.meta, moltype=moltype + str(batch))
+            molecules.append(molecule)
+        paths = [tmpdir / '{}{}.itp'.format(moltype, batch) for moltype in 'AB']
+        batches.append((molecules, paths))
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [executor.submit(write_molecule_itps, molecules, paths, processes=2)
+                   for molecules, paths in batches]
+        for future in futures:
+            future.result()
+    for molecules, paths in batches:
+        for molecule, path in zip(molecules, paths):
+            expected = io.StringIO()
+            write_molecule_itp(molecule, expected)
+            assert path.read() == expected.getvalue()
@@ -0,0 +1,154 @@
+# Copyright 2018 University of Groningen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Test the reading of ITP and TOP files.
+"""
+
+import io
+import textwrap
+import pytest
+from vermouth.gmx.itp import write_molecule_itp
+from vermouth.gmx.itp_read import read_itp, read_topology
+from vermouth.molecule import Interaction, Molecule
+
+
+def _write(molecule):
+    outfile = io.StringIO()
+    write_molecule_itp(molecule, outfile, header=['A header.'])
+    return outfile.getvalue()
+
+
+def test_round_trip():
+    """
+    A molecule read from an ITP file is written back identically.
+    """
+    molecule = Molecule(nrexcl=1)
+    molecule.add_nodes_from(
+        (key, {'atype': 'P5', 'resid': key // 2 + 1, 'resname': 'ALA',
+               'atomname': 'BB', 'charge_group': key + 1, 'charge': 0.5,
+               'mass': 72})
+        for key in range(5)
+    )
+    molecule.meta['moltype'] = 'TEST'
+    molecule.interactions['bonds'] = [
+        Interaction(atoms=[0, 1], parameters=['1', '0.35', '1250'], meta={}),
+        Interaction(atoms=[4, 0], parameters=['1', '0.3', '500'],
+                    meta={'group': 'Rubber band', 'ifdef': 'RUBBER',
+                          'comment': 'elastic'}),
+    ]
+    molecule.interactions['constraints'] = [
+        Interaction(atoms=[1, 2], parameters=['1', '0.3'], meta={'ifndef': 'FLEXIBLE'}),
+    ]
+    molecule.interactions['dihedrals'] = [
+        Interaction(atoms=[0, 1, 2, 3], parameters=['1', '-120', '400', '1'], meta={}),
+    ]
+    molecule.interactions['impropers'] = [
+        Interaction(atoms=[0, 1, 2, 4], parameters=['2', '0', '50'], meta={}),
+    ]
+    molecule.interactions['virtual_sitesn'] = [
+        Interaction(atoms=[4, 2, 3], parameters=['1'], meta={}),
+    ]
+    molecule.interactions['exclusions'] = [
+        Interaction(atoms=[0, 3, 4], parameters=[], meta={}),
+    ]
+    text = _write(molecule)
+
+    moltypes = read_itp(io.StringIO(text))
+    assert list(moltypes) == ['TEST']
+    found = moltypes['TEST']
+    assert found.nrexcl == 1
+    assert dict(found.nodes) == dict(molecule.nodes)
+    assert found.interactions['impropers'] == molecule.interactions['impropers']
+    assert found.interactions['bonds'][1].meta == molecule.interactions['bonds'][1].meta
+    assert set(found.edges) == {(0, 1), (0, 4), (1, 2)}
+    assert _write(found) == text
+
+
+def test_preprocessor(tmpdir):
+    """
+    Includes, macros, and conditionals are followed; conditionals within
+    interaction sections are kept.
+    """
+    (tmpdir / 'sub').mkdir()
+    (tmpdir / 'sub' / 'atoms.itp').write(textwrap.dedent("""\
+        #ifdef BIG
+        1 P5 1 ALA BB 1 1.0 \\
+          144
+        #else
+        1 P5 1 ALA BB 1 1.0 72
+        #endif
+        2 P5 1 ALA SC1 2
+        """))
+    (tmpdir / 'topol.top').write(textwrap.dedent("""\
+        #define BIG
+        [ defaults ]
+        1 1
+        [ moleculetype ]
+        ; name nrexcl
+        TEST 1
+        [ atoms ]
+        #include "sub/atoms.itp"
+        #ifndef NOBONDS
+        [ bonds ]
+        1 2 1 0.3 1000
+        #endif
+
+        [ angles ]
+        #ifdef FLEXIBLE
+        1 2 1 2 120 25
+        #else
+        1 2 1 2 120 50
+        #endif
+
+        [ system ]
+        Test
+        [ molecules ]
+        TEST 3
+        """))
+    moltypes, molecules = read_topology(str(tmpdir / 'topol.top'))
+    assert molecules == [('TEST', 3)]
+    molecule = moltypes['TEST']
+    assert molecule.nodes[0]['mass'] == 144
+    assert 'mass' not in molecule.nodes[1]
+    # The block around the [ bonds ] section starts in the [ atoms ]
+    # section, it is evaluated.
+    assert molecule.interactions['bonds'][0].meta == {}
+    assert [interaction.meta for interaction in molecule.interactions['angles']] == [
+        {'ifdef': 'FLEXIBLE'}, {'ifndef': 'FLEXIBLE'},
+    ]
+
+    moltypes, _ = read_topology(str(tmpdir / 'topol.top'), defines=['NOBONDS'],
+                                keep_conditionals=False)
+    molecule = moltypes['TEST']
+    assert 'bonds' not in molecule.interactions
+    assert molecule.interactions['angles'][0].parameters == ['2', '120', '50']
+
+
+@pytest.mark.parametrize('text', (
+    '#include "missing.itp"\n',
+    '#ifdef A\n',
+    '#endif\n',
+    '#pragma once\n',
+    '[ moleculetype ]\nTEST 1\n[ unknown ]\n',
+    '[ atoms ]\n1 P5 1 ALA BB 1\n',
+    '[ moleculetype ]\nTEST 1\n[ atoms ]\n1 P5 1 ALA BB 1\n[ bonds ]\n1 2 1\n',
+    '[ moleculetype ]\nTEST 1\n[ bonds ]\n#ifdef A\n[ atoms ]\n#endif\n',
+))
+def test_read_itp_errors(text):
+    """
+    Malformed files raise an IOError.
+    """
+    with pytest.raises(IOError):
+        read_itp(io.StringIO(text))
@@ -0,0 +1,261 @@
+# Copyright 2018 University of Groningen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Test :mod:`vermouth.checkpoint`.
+"""
+
+import numpy as np
+import pytest
+
+from vermouth import System
+from vermouth.forcefield import ForceField
+from vermouth.molecule import Molecule
+from vermouth.checkpoint import (
+    Checkpointer, CheckpointError, stage_key, hash_file,
+    topology_key, system_positions, refresh_positions, TopologyArtifact,
+)
+
+
+@pytest.fixture
+def force_field():
+    """
+    An empty force field.
+    """
+    return ForceField('dummy_ff')
+
+
+@pytest.fixture
+def system(force_field):
+    """
+    A system with a single small molecule.
+    """
+    molecule = Molecule()
+    molecule.add_nodes_from([
+        (0, {'atomname': 'A', 'resid': 1}),
+        (1, {'atomname': 'B', 'resid': 1}),
+    ])
+    molecule.add_edge(0, 1)
+    molecule.meta['moltype'] = 'test'
+    system = System()
+    system.add_molecule(molecule)
+    system.force_field = force_field
+    return system
+
+
+def _stage(name, calls):
+    """
+    Build a stage function that adds a node attribute and records its call.
+    """
+    def function(system):
+        calls.append(name)
+        for molecule in system.molecules:
+            for node in molecule.nodes.values():
+                node[name] = True
+        return system
+    return function
+
+
+def test_stage_key():
+    """
+    Stage keys depend on the previous key, the name, and the options.
+    """
+    key = stage_key('input', 'stage', {'a': 1, 'b': 'x'})
+    assert key == stage_key('input', 'stage', {'b': 'x', 'a': 1})
+    assert key != stage_key('other', 'stage', {'a': 1, 'b': 'x'})
+    assert key != stage_key('input', 'other', {'a': 1, 'b': 'x'})
+    assert key != stage_key('input', 'stage', {'a': 2, 'b': 'x'})
+    assert stage_key('input', 'stage') == stage_key('input', 'stage', {})
+
+
+def test_hash_file(tmpdir):
+    """
+    File hashes depend on the content only.
+    """
+    path_a = tmpdir / 'a.txt'
+    path_b = tmpdir / 'b.txt'
+    path_a.write('content')
+    path_b.write('content')
+    assert hash_file(path_a) == hash_file(path_b)
+    path_b.write('other content')
+    assert hash_file(path_a) != hash_file(path_b)
+
+
+def test_save_load(tmpdir, system, force_field):
+    """
+    A saved system is restored with the same content and force field.
+    """
+    checkpointer = Checkpointer(tmpdir, 'input', {force_field.name: force_field})
+    checkpointer.save(system, 'key')
+    loaded = checkpointer.load('key')
+    assert loaded.force_field is force_field
+    assert loaded.molecules[0].force_field is force_field
+    assert dict(loaded.molecules[0].nodes(data=True)) == dict(system.molecules[0].nodes(data=True))
+    assert list(loaded.molecules[0].edges) == list(system.molecules[0].edges)
+    assert loaded.molecules[0].meta == system.molecules[0].meta
+    assert checkpointer.load('missing') is None
+
+
+def test_load_unknown_force_field(tmpdir, system, force_field):
+    """
+    Restoring a checkpoint that refers to an unknown force field fails.
+    """
+    Checkpointer(tmpdir, 'input', {force_field.name: force_field}).save(system, 'key')
+    with pytest.raises(CheckpointError):
+        Checkpointer(tmpdir, 'input', {}).load('key')
+
+
+def test_run_resume(tmpdir, system, force_field):
+    """
+    Stages with a valid checkpoint are not run again.
+    """
+    force_fields = {force_field.name: force_field}
+
+    calls = []
+    stages = [(name, {'option': 0}, _stage(name, calls)) for name in 'abc']
+    result = Checkpointer(tmpdir, 'input', force_fields).run(stages, system)
+    assert calls == ['a', 'b', 'c']
+    assert all(node['c'] for node in result.molecules[0].nodes.values())
+
+    calls = []
+    stages = [(name, {'option': 0}, _stage(name, calls)) for name in 'abc']
+    result = Checkpointer(tmpdir, 'input', force_fields).run(stages, None)
+    assert calls == []
+    assert all(node['c'] for node in result.molecules[0].nodes.values())
+
+    # Changing the options of a stage invalidates that stage and the ones
+    # after it.
+    calls = []
+    stages = [(name, {'option': int(name == 'b')}, _stage(name, calls))
+              for name in 'abc']
+    Checkpointer(tmpdir, 'input', force_fields).run(stages, None)
+    assert calls == ['b', 'c']
+
+    # Changing the input invalidates everything.
+    calls = []
+    stages = [(name, {'option': 0}, _stage(name, calls)) for name in 'abc']
+    Checkpointer(tmpdir, 'other', force_fields).run(stages, system)
+    assert calls == ['a', 'b', 'c']
+
+
+def test_run_chained(tmpdir, system, force_field):
+    """
+    Successive calls to :meth:`Checkpointer.run` are chained.
+    """
+    force_fields = {force_field.name: force_field}
+    checkpointer = Checkpointer(tmpdir, 'input', force_fields)
+    checkpointer.run([('a', {}, _stage('a', []))], system)
+    first_key = checkpointer.key
+    assert first_key == stage_key('input', 'a', {})
+    checkpointer.run([('b', {}, _stage('b', []))], system)
+    assert checkpointer.key == stage_key(first_key, 'b', {})
+
+
+def test_run_corrupted(tmpdir, system, force_field, caplog):
+    """
+    A corrupted checkpoint is ignored and the stage is run again.
+    """
+    # Braces in the path must not be taken as format fields in the warning.
+    tmpdir = tmpdir.mkdir('{braces}')
+    force_fields = {force_field.name: force_field}
+    calls = []
+    stages = [(name, {}, _stage(name, calls)) for name in 'ab']
+    checkpointer = Checkpointer(tmpdir, 'input', force_fields)
+    checkpointer.run(stages, system)
+    with open(str(checkpointer.path(checkpointer.key)), 'wb') as outfile:
+        outfile.write(b'not a pickle')
+
+    calls = []
+    stages = [(name, {}, _stage(name, calls)) for name in 'ab']
+    Checkpointer(tmpdir, 'input', force_fields).run(stages, None)
+    assert calls == ['b']
+    assert any(record.type == 'checkpoint' and '{braces}' in record.getMessage()
+               for record in caplog.records)
+
+
+def test_topology_key(system):
+    """
+    The topology key ignores the coordinates, but not the atoms.
+    """
+    reference = topology_key(system)
+    system.molecules[0].nodes[0]['position'] = np.array([1., 2., 3.])
+    assert topology_key(system) == reference
+    assert topology_key(system, {'to_ff': 'other'}) != reference
+    system.molecules[0].nodes[0]['atomname'] = 'C'
+    assert topology_key(system) != reference
+
+
+def test_system_positions(system):
+    """
+    The positions are gathered by node key, skipping atoms without one.
+    """
+    assert system_positions(system) == {}
+    system.molecules[0].nodes[1]['position'] = np.array([1., 2., 3.])
+    molecule = Molecule()
+    molecule.add_node(5, position=np.zeros(3))
+    system.add_molecule(molecule)
+    positions = system_positions(system)
+    assert list(positions) == [1, 5]
+    assert np.allclose(positions[1], [1, 2, 3])
+    assert np.allclose(positions[5], [0, 0, 0])
+
+
+def test_refresh_positions(system, force_field):
+    """
+    Atoms and the beads built on them are moved to the new positions.
+    """
+    atomistic = system.molecules[0]
+    atomistic.nodes[0]['position'] = np.zeros(3)
+    atomistic.nodes[1]['position'] = np.ones(3)
+    atomistic.add_node(2, atomname='H', resid=1)
+    intermediate = Molecule(force_field=force_field)
+    intermediate.add_node(0, graph=atomistic.subgraph([0, 1]),
+                          mapping_weights={0: 1, 1: 3})
+    # Beads as built by ApplyBlocks, and a charge dummy.
+    beads = Molecule(force_field=force_field)
+    beads.add_node(0, graph=intermediate.subgraph([0]))
+    beads.add_node(1, graph=Molecule())
+    # A bead built directly on the atoms.
+    flat = Molecule(force_field=force_field)
+    flat.add_node(0, graph=atomistic.subgraph([0, 1]))
+
+    positions = {0: np.array([4., 0, 0]), 1: np.array([0., 4, 0]),
+                 2: np.array([9., 9, 9])}
+    refresh_positions(atomistic, positions)
+    assert np.allclose(atomistic.nodes[1]['position'], [0, 4, 0])
+    # Atoms without a position are not in the input structure.
+    assert 'position' not in atomistic.nodes[2]
+    refresh_positions(beads, positions)
+    assert np.allclose(beads.nodes[0]['position'], [1, 3, 0])
+    assert 'position' not in beads.nodes[1]
+    refresh_positions(flat, positions)
+    assert np.allclose(flat.nodes[0]['position'], [2, 2, 0])
+
+
+def test_topology_artifact(tmpdir, system, force_field):
+    """
+    An artifact is restored with its systems and force fields.
+    """
+    path = tmpdir / 'artifact.pickle'
+    force_fields = {force_field.name: force_field}
+    assert TopologyArtifact.load(path, force_fields) is None
+    TopologyArtifact('key', system, ['a'], system.copy(), relink=True).save(path)
+    loaded = TopologyArtifact.load(path, force_fields)
+    assert loaded.key == 'key'
+    assert loaded.annotated_keys == ['a']
+    assert loaded.relink
+    assert loaded.coarse.force_field is force_field
+    assert list(loaded.universal.molecules[0].nodes) == [0, 1]
+    with pytest.raises(CheckpointError):
+        TopologyArtifact.load(path, {})
@@ -0,0 +1,261 @@
+# Copyright 2018 University of Groningen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Test the :class:`~vermouth.processors.deduplicate.DeduplicateMolecules`
+processor.
+"""
+# pylint: disable=redefined-outer-name
+
+import logging
+import os
+
+import numpy as np
+import pytest
+
+import vermouth
+import vermouth.forcefield
+from vermouth.map_input import (
+    read_mapping_directory, generate_all_self_mappings, combine_mappings,
+)
+from vermouth.molecule import Molecule
+from vermouth.processors.deduplicate import (
+    DeduplicateMolecules, molecule_fingerprint, group_identical_molecules,
+)
+from vermouth.processors.processor import Processor
+from vermouth.tests.datafiles import PDB_HB
+from vermouth.log_helpers import StyleAdapter, get_logger
+
+LOGGER = StyleAdapter(get_logger(__name__))
+
+
+def _make_molecule(first_key, chain, shift=0, atomnames=('A', 'B', 'C')):
+    molecule = Molecule()
+    for idx, atomname in enumerate(atomnames):
+        molecule.add_node(
+            first_key + idx,
+            atomname=atomname,
+            resname='RES',
+            resid=1,
+            chain=chain,
+            atomid=first_key + idx + 1,
+            position=np.array([idx + shift, 0, 0], dtype=float),
+        )
+    molecule.add_edges_from(zip(molecule.nodes, list(molecule.nodes)[1:]),
+                            distance=1.0 + shift)
+    molecule.meta['test'] = 'value'
+    return molecule
+
+
+class _AddAtom(Processor):
+    """
+    Adds a node after the last one, and an interaction, in place.
+    """
+    def __init__(self):
+        super().__init__()
+        self.n_calls = 0
+
+    def run_molecule(self, molecule):
+        self.n_calls += 1
+        last = max(molecule)
+        new = last + 1
+        molecule.add_node(new, atomname='D', resname='RES', resid=1,
+                          chain=molecule.nodes[last]['chain'])
+        molecule.add_edge(last, new)
+        molecule.add_interaction('bonds', (last, new), ['1', '0.3'])
+        for node in molecule.nodes.values():
+            node['visited'] = True
+        return molecule
+
+
+class _Coarsen(Processor):
+    """
+    Builds a new molecule with one node per pair of input nodes.
+    """
+    def __init__(self):
+        super().__init__()
+        self.n_calls = 0
+
+    def run_molecule(self, molecule):
+        self.n_calls += 1
+        keys = list(molecule.nodes)
+        new_molecule = Molecule(meta=molecule.meta)
+        for new_key, start in enumerate(range(0, len(keys), 2)):
+            sources = keys[start:start + 2]
+            new_molecule.add_node(
+                new_key,
+                atomname='B{}'.format(new_key),
+                chain=molecule.nodes[sources[0]]['chain'],
+                graph=molecule.subgraph(sources),
+                mapping_weights={source: 1 for source in sources},
+            )
+        new_molecule.add_edges_from(zip(new_molecule.nodes, list(new_molecule.nodes)[1:]))
+        return new_molecule
+
+
+def test_fingerprint_ignores_copies():
+    """
+    Molecules differing only by per copy attributes share a fingerprint.
+    """
+    reference = molecule_fingerprint(_make_molecule(0, 'A'))
+    assert molecule_fingerprint(_make_molecule(10, 'B', shift=3)) == reference
+    assert molecule_fingerprint(_make_molecule(0, 'A', atomnames='ABD')) != reference
+    molecule = _make_molecule(0, 'A')
+    molecule.add_edge(0, 2)
+    assert molecule_fingerprint(molecule) != reference
+    molecule = _make_molecule(0, 'A')
+    molecule.meta['test'] = 'other'
+    assert molecule_fingerprint(molecule) != reference
+    molecule = _make_molecule(0, 'A')
+    molecule.nodes[2]['chain'] = 'B'
+    assert molecule_fingerprint(molecule) != reference
+
+
+def test_group_identical_molecules():
+    """
+    Molecules are grouped in order of first appearance.
+    """
+    molecules = [
+        _make_molecule(0, 'A', atomnames='ABD'),
+        _make_molecule(3, 'B'),
+        _make_molecule(6, 'C', atomnames='ABD'),
+        _make_molecule(9, 'D'),
+        _make_molecule(12, 'E', atomnames='XY'),
+    ]
+    assert group_identical_molecules(molecules) == [[0, 2], [1, 3], [4]]
+
+
+def _run(processor, molecules, deduplicate, keep_keys=True):
+    system = vermouth.System()
+    system.molecules = molecules
+    if deduplicate:
+        processor = DeduplicateMolecules(processor, keep_keys=keep_keys)
+    processor.run_system(system)
+    return system.molecules
+
+
+def _assert_same_molecules(left, right):
+    assert len(left) == len(right)
+    for left_molecule, right_molecule in zip(left, right):
+        assert left_molecule == right_molecule
+        assert left_molecule.meta == right_molecule.meta
+        assert list(left_molecule.nodes) == list(right_molecule.nodes)
+
+
+@pytest.mark.parametrize('keep_keys, processor_class', (
+    (True, _AddAtom),
+    (False, _Coarsen),
+))
+def test_deduplicate_molecules(keep_keys, processor_class):
+    """
+    Deduplicated processing gives the same result as processing every molecule.
+    """
+    def molecules():
+        return [_make_molecule(0, 'A'), _make_molecule(3, 'B', shift=2),
+                _make_molecule(6, 'C', atomnames='XY'),
+                _make_molecule(8, 'D', shift=4)]
+    processor = processor_class()
+    expected = _run(processor, molecules(), deduplicate=False)
+    assert processor.n_calls == 4
+    processor = processor_class()
+    found = _run(processor, molecules(), deduplicate=True, keep_keys=keep_keys)
+    assert processor.n_calls == 2
+    _assert_same_molecules(found, expected)
+    for found_molecule, expected_molecule in zip(found, expected):
+        for key in expected_molecule:
+            found_node = found_molecule.nodes[key]
+            expected_node = expected_molecule.nodes[key]
+            assert found_node['chain'] == expected_node['chain']
+            if 'graph' in expected_node:
+                assert list(found_node['graph']) == list(expected_node['graph'])
+                assert found_node['mapping_weights'] == expected_node['mapping_weights']
+    # Meta dicts must not be shared between copies.
+    assert len({id(molecule.meta) for molecule in found}) == len(found)
+
+
+class _WarnPerNode(_AddAtom):
+    """
+    Adds an atom like :class:`_AddAtom`, and logs a warning per node and a
+    debug message per molecule.
+    """
+    def run_molecule(self, molecule):
+        for key in molecule:
+            LOGGER.warning('Node {} is odd.', key, type='unmapped-atom')
+        LOGGER.debug('Processed a molecule.')
+        return super().run_molecule(molecule)
+
+
+def test_deduplicate_warnings(caplog):
+    """
+    Deduplication logs the same messages as processing every molecule.
+    """
+    def molecules():
+        return [_make_molecule(0, 'A'), _make_molecule(3, 'B', shift=2),
+                _make_molecule(6, 'C', atomnames='XY'),
+                _make_molecule(8, 'D', shift=4)]
+
+    def count(deduplicate):
+        caplog.clear()
+        _run(_WarnPerNode(), molecules(), deduplicate=deduplicate)
+        records = [record for record in caplog.records
+                   if record.name == __name__]
+        return (
+            sum(record.levelno == logging.WARNING for record in records),
+            sum(record.levelno == logging.DEBUG for record in records),
+        )
+
+    caplog.set_level(logging.DEBUG)
+    assert count(deduplicate=False) == (11, 4)
+    assert count(deduplicate=True) == (11, 4)
+
+
+def test_deduplicate_pipeline():
+    """
+    Deduplication gives the same result as the regular pipeline on a protein.
+    """
+    universal = vermouth.forcefield.get_native_force_field('universal')
+    martini = vermouth.forcefield.get_native_force_field('martini22')
+    mappings = read_mapping_directory(os.path.join(vermouth.DATA_PATH, 'mappings'))
+    combine_mappings(mappings, generate_all_self_mappings([universal, martini]))
+
+    def run(deduplicate):
+        system = vermouth.System()
+        vermouth.PDBInput(str(PDB_HB), exclude=('HOH', 'HEME')).run_system(system)
+        system.force_field = universal
+        vermouth.MakeBonds().run_system(system)
+        processors = [
+            (vermouth.RepairGraph(include_graph=False), True),
+            (vermouth.CanonicalizeModifications(), True),
+            (vermouth.AttachMass(attribute='mass'), None),
+            (vermouth.DoMapping(mappings=mappings, to_ff=martini,
+                                attribute_keep=('cgsecstruct', )), False),
+            (vermouth.DoAverageBead(ignore_missing_graphs=True), None),
+            (vermouth.ApplyBlocks(), False),
+            (vermouth.DoLinks(), True),
+        ]
+        for processor, keep_keys in processors:
+            if deduplicate and keep_keys is not None:
+                processor = DeduplicateMolecules(processor, keep_keys=keep_keys)
+            processor.run_system(system)
+        return system
+
+    expected = run(deduplicate=False)
+    found = run(deduplicate=True)
+    _assert_same_molecules(found.molecules, expected.molecules)
+    for found_molecule, expected_molecule in zip(found.molecules, expected.molecules):
+        for key, expected_node in expected_molecule.nodes.items():
+            found_node = found_molecule.nodes[key]
+            assert found_node['chain'] == expected_node['chain']
+            assert np.allclose(found_node['position'], expected_node['position'],
+                               equal_nan=True)
@@ -15,8 +15,17 @@
 # limitations under the License.
 
 from collections import defaultdict
+from functools import partial
+from itertools import combinations
+import random
 
-from vermouth.processors.do_mapping import do_mapping
+import pytest
+
+from vermouth.processors.do_mapping import (
+    do_mapping, match_by_names, build_graph_mapping_collection,
+    MappingGraphMatcher, edge_matcher, find_matches, index_residues,
+    _touching_pairs,
+)
 import vermouth.forcefield
 from vermouth.molecule import Molecule, Block
 import networkx.algorithms.isomorphism as iso
@@ -237,5 +246,121 @@ def test_peptide():
     
     assert _equal_graphs(cg, expected)
 
+def _vf2_matches(molecule, mapping):
+    node_match = iso.categorical_node_match(['atomname', 'resname'], ['', ''])
+    matcher = MappingGraphMatcher(molecule, mapping.block_from,
+                                  node_match=node_match,
+                                  edge_match=partial(edge_matcher, molecule, mapping.block_from))
+    return list(matcher.subgraph_isomorphisms_iter())
+
+
+@pytest.mark.parametrize('resname', ('GLY', 'ILE', 'LEU', 'TRP'))
+@pytest.mark.parametrize('shuffle', (False, True))
+def test_match_by_names(resname, shuffle):
+    """
+    Matching single residues on names gives the same result as the graph
+    search.
+    """
+    mappings = {'universal': {'martini22': {}}}
+    for name in ('GLY', 'ILE', 'LEU'):
+        block = FF_UNIVERSAL.blocks[name]
+        mapping = {(0, atom): [(0, 'BB')] for atom in block}
+        mappings['universal']['martini22'][name] = (mapping, _map_weights(mapping), ())
+    pair_mapping = build_graph_mapping_collection(FF_UNIVERSAL, FF_MARTINI, mappings)
+
+    molecule = FF_UNIVERSAL.blocks[resname].to_molecule()
+    if shuffle:
+        keys = list(molecule.nodes)
+        random.Random(1).shuffle(keys)
+        shuffled = Molecule(force_field=FF_UNIVERSAL)
+        shuffled.add_nodes_from((key, molecule.nodes[key]) for key in keys)
+        shuffled.add_edges_from(molecule.edges)
+        molecule = shuffled
+    for key in molecule:
+        molecule.nodes[key]['chain'] = 'A'
+
+    for mapping in pair_mapping.values():
+        found = match_by_names(molecule, mapping)
+        assert found is not None
+        assert found == _vf2_matches(molecule, mapping)
+
+
+def test_match_by_names_undecidable():
+    """
+    Molecules with several residues are not matched on names.
+    """
+    mapping = {(0, 'C1'): [(0, 'B1')], (0, 'C2'): [(0, 'B1')], (0, 'C3'): [(0, 'B1')]}
+    mappings = {'universal': {'martini22': {'IPO': (mapping, _map_weights(mapping), ())}}}
+    pair_mapping = build_graph_mapping_collection(FF_UNIVERSAL, FF_MARTINI, mappings)
+    assert match_by_names(AA_MOL, pair_mapping['IPO']) is None
+    single = AA_MOL.subgraph([0, 1, 2])
+    assert match_by_names(single, pair_mapping['IPO']) == _vf2_matches(single, pair_mapping['IPO'])
+    single.remove_edge(1, 2)
+    assert match_by_names(single, pair_mapping['IPO']) == []
+
+
+@pytest.mark.parametrize('name, max_residues', (('IPO', 1), ('IPO_large', 3)))
+def test_find_matches(name, max_residues):
+    """
+    Searching around residues finds the same matches as searching the whole
+    molecule, also for mappings spanning several residues.
+    """
+    block = FF_UNIVERSAL.blocks[name]
+    mapping = {(resid - 1, atomname): [(0, 'B1')]
+               for resid, atomname in {(node['resid'], node['atomname'])
+                                       for node in block.nodes.values()}}
+    mappings = {'universal': {'martini22': {name: (mapping, _map_weights(mapping), ())}}}
+    graph_mapping = build_graph_mapping_collection(FF_UNIVERSAL, FF_MARTINI, mappings)[name]
+    assert graph_mapping.max_residues == max_residues
+
+    # Two copies of AA_MOL in the same molecule, bonded together.
+    molecule = AA_MOL.copy()
+    offset = len(AA_MOL)
+    for key, node in AA_MOL.nodes.items():
+        molecule.add_node(key + offset, **dict(node, resid=node['resid'] + 3))
+    molecule.add_edges_from((left + offset, right + offset) for left, right in AA_MOL.edges)
+    molecule.add_edge(7, offset + 1)
+
+    residue_index = index_residues(molecule)
+    assert residue_index is not None
+    expected = list(find_matches(molecule, graph_mapping, None))
+    found = list(find_matches(molecule, graph_mapping, residue_index))
+    assert expected
+    assert sorted(found, key=lambda match: sorted(match.items())) ==\
+        sorted(expected, key=lambda match: sorted(match.items()))
+
+
+def test_index_residues_chain_crossing():
+    """
+    Residues are not used to restrict the search when a bond crosses chains
+    within a resid.
+    """
+    molecule = AA_MOL.copy()
+    assert index_residues(molecule) is not None
+    for key in (2, 3):
+        molecule.nodes[key]['chain'] = 'B'
+    for key in (3, 4, 5):
+        molecule.nodes[key]['resid'] = 1
+    assert index_residues(molecule) is None
+    del molecule.nodes[0]['chain']
+    assert index_residues(molecule) is None
+
+
+def test_touching_pairs():
+    """
+    The indexed pairs of matches are the pairs that share atoms or are bonded,
+    in the same order as all the combinations.
+    """
+    matches = [{0: 'a', 1: 'b'}, {2: 'a'}, {7: 'a', 8: 'b'}, {4: 'a'},
+               {1: 'a', 2: 'b'}, {5: 'a'}]
+    expected = [
+        (idx, jdx) for idx, jdx in combinations(range(len(matches)), 2)
+        if set(matches[idx]) & set(matches[jdx])
+        or list(AA_MOL.edges_between(matches[idx], matches[jdx]))
+    ]
+    assert _touching_pairs(AA_MOL, matches) == expected
+    assert expected == [(0, 1), (0, 4), (1, 4), (3, 5)]
+
+
 if __name__ == '__main__':
     test_peptide()
@@ -19,10 +19,11 @@ Test the functions required to use DSSP.
 import os
 import itertools
 
+import numpy as np
 import pytest
 
 import vermouth
-from vermouth.dssp import dssp
+from vermouth.dssp import dssp, kabsch_sander
 from vermouth.pdb.pdb import read_pdb
 from vermouth.tests.datafiles import (
     PDB_PROTEIN,
@@ -356,3 +357,184 @@ def test_run_dssp(savefile, tmpdir):
     else:
         # Is the directory empty?
         assert not os.listdir(str(tmpdir))
+
+
+def test_builtin_dssp():
+    """
+    Test that the built-in DSSP agrees with the reference DSSP output.
+    """
+    molecule = read_pdb(str(PDB_PROTEIN))
+    assert kabsch_sander.dssp_molecule(molecule) == SECSTRUCT_1BTA
+
+
+@pytest.mark.parametrize('savedir', [True, False])
+def test_annotate_builtin_dssp(savedir, tmpdir):
+    """
+    Test that :class:`dssp.AnnotateDSSP` uses the built-in DSSP when asked,
+    and writes a file that can be read back if requested.
+    """
+    molecule = read_pdb(str(PDB_PROTEIN))
+    system = vermouth.System()
+    system.add_molecule(molecule)
+    processor = dssp.AnnotateDSSP(executable=dssp.BUILTIN_DSSP,
+                                  savedir=str(tmpdir) if savedir else None)
+    processor.run_system(system)
+    found = list(dssp.sequence_from_residues(molecule, 'secstruct'))
+    assert found == SECSTRUCT_1BTA
+    if savedir:
+        with open(str(tmpdir / 'chain_A.ssd')) as infile:
+            assert dssp.read_dssp2(infile) == SECSTRUCT_1BTA
+    else:
+        assert not os.listdir(str(tmpdir))
+
+
+def test_builtin_dssp_missing_atoms():
+    """
+    Residues without a complete backbone are coil, and break the chain.
+    """
+    molecule = read_pdb(str(PDB_PROTEIN))
+    residues = list(molecule.iter_residues())
+    # Residue 16 is in the middle of the first helix.
+    for key in residues[15]:
+        if molecule.nodes[key]['atomname'] == 'O':
+            molecule.remove_node(key)
+    found = kabsch_sander.dssp_molecule(molecule)
+    assert len(found) == len(SECSTRUCT_1BTA)
+    assert found[15] == 'C'
+    assert found[:12] == SECSTRUCT_1BTA[:12]
+    assert found[30:] == SECSTRUCT_1BTA[30:]
+
+
+def test_hbond_energies():
+    """
+    Test the DSSP hydrogen bond energy on ideal geometries.
+    """
+    nitrogen = np.array([[0, 0, 0], [0, 0, 0]], dtype=float)
+    hydrogen = np.array([[1, 0, 0], [1, 0, 0]], dtype=float)
+    # Linear bond with a 2.9 A N-O distance, and overlapping atoms.
+    oxygen = np.array([[2.9, 0, 0], [1.2, 0, 0]])
+    carbon = np.array([[4.13, 0, 0], [2.43, 0, 0]])
+    energies = kabsch_sander.hbond_energies(nitrogen, hydrogen, carbon, oxygen)
+    expected = -27.888 * (1 / 1.9 - 1 / 3.13 + 1 / 4.13 - 1 / 2.9)
+    assert energies[0] == pytest.approx(expected, abs=1e-3)
+    assert energies[1] == -9.9
+
+
+def _fake_dssp(tmpdir, status=0):
+    """
+    Write an executable that reads its input and outputs the reference DSSP
+    output for 1BTA, or fails.
+    """
+    path = tmpdir / 'fake_dssp'
+    if status:
+        path.write('#!/bin/sh\ncat > /dev/null\necho failure >&2\nexit {}\n'.format(status))
+    else:
+        path.write('#!/bin/sh\ncat > /dev/null\nsleep 0.2\ncat "{}"\n'.format(DSSP_OUTPUT))
+    path.chmod(0o755)
+    return str(path)
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='The fake DSSP is a shell script.')
+@pytest.mark.parametrize('processes', [None, 3])
+def test_annotate_dssp_concurrent(processes, tmpdir):
+    """
+    Test that :class:`dssp.AnnotateDSSP` annotates all the molecules in order
+    when DSSP runs concurrently.
+    """
+    system = vermouth.System()
+    for chain in 'ABCD':
+        molecule = read_pdb(str(PDB_PROTEIN))
+        for node in molecule.nodes.values():
+            node['chain'] = chain
+        system.add_molecule(molecule)
+    molecules = list(system.molecules)
+    processor = dssp.AnnotateDSSP(executable=_fake_dssp(tmpdir),
+                                  processes=processes)
+    processor.run_system(system)
+    assert system.molecules == molecules
+    for molecule in system.molecules:
+        found = list(dssp.sequence_from_residues(molecule, 'secstruct'))
+        assert found == SECSTRUCT_1BTA
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='The fake DSSP is a shell script.')
+def test_annotate_dssp_concurrent_error(tmpdir):
+    """
+    Test that a failing DSSP raises a :exc:`dssp.DSSPError` when DSSP runs
+    concurrently.
+    """
+    system = vermouth.System()
+    for _ in range(3):
+        system.add_molecule(read_pdb(str(PDB_PROTEIN)))
+    processor = dssp.AnnotateDSSP(executable=_fake_dssp(tmpdir, status=1),
+                                  processes=2)
+    with pytest.raises(dssp.DSSPError):
+        processor.run_system(system)
+
+
+def test_secondary_structure_key():
+    """
+    Test that secondary structure keys only depend on the backbone, the
+    residue names, and the executable.
+    """
+    molecule = read_pdb(str(PDB_PROTEIN))
+    key = dssp.secondary_structure_key(molecule)
+    assert key == dssp.secondary_structure_key(read_pdb(str(PDB_PROTEIN)))
+    assert key != dssp.secondary_structure_key(molecule, dssp.BUILTIN_DSSP)
+
+    side_chain = next(key for key, node in molecule.nodes.items()
+                      if node['atomname'] == 'CB')
+    molecule.nodes[side_chain]['position'] = molecule.nodes[side_chain]['position'] + 1
+    assert dssp.secondary_structure_key(molecule) == key
+
+    backbone = next(key for key, node in molecule.nodes.items()
+                    if node['atomname'] == 'CA')
+    molecule.nodes[backbone]['position'] = molecule.nodes[backbone]['position'] + 0.01
+    assert dssp.secondary_structure_key(molecule) != key
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='The fake DSSP is a shell script.')
+def test_annotate_dssp_cache(tmpdir):
+    """
+    Test that DSSP does not run for molecules found in the cache.
+    """
+    calls = tmpdir / 'calls'
+    executable = tmpdir / 'counting_dssp'
+    executable.write('#!/bin/sh\necho call >> "{}"\nexec "{}"\n'
+                     .format(calls, _fake_dssp(tmpdir)))
+    executable.chmod(0o755)
+
+    cache = dssp.SecondaryStructureCache()
+    for _ in range(2):
+        molecule = read_pdb(str(PDB_PROTEIN))
+        dssp.annotate_dssp(molecule, str(executable), cache=cache)
+        found = list(dssp.sequence_from_residues(molecule, 'secstruct'))
+        assert found == SECSTRUCT_1BTA
+    assert calls.read().splitlines() == ['call']
+    assert (cache.hits, cache.misses, len(cache)) == (1, 1, 1)
+
+    path = tmpdir / 'cache.pickle'
+    cache.save(path)
+    loaded = dssp.SecondaryStructureCache()
+    loaded.load(path)
+    assert list(loaded.items()) == list(cache.items())
+
+
+def test_secondary_structure_cache_lru(tmpdir):
+    """
+    The least recently used assignations are evicted first.
+    """
+    cache = dssp.SecondaryStructureCache(maxsize=2)
+    cache['a'] = ['H']
+    cache['b'] = ['E']
+    assert cache['a'] == ['H']
+    cache['c'] = ['C']
+    assert list(cache) == ['a', 'c']
+    with pytest.raises(KeyError):
+        cache['b']  # pylint: disable=pointless-statement
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    path = tmpdir / 'not_a_cache.pickle'
+    path.write('garbage')
+    with pytest.raises(ValueError):
+        cache.load(path)
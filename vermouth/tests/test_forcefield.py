@@ -143,3 +143,34 @@ def test_init_empty_force_field_error_neither():
     """
     with pytest.raises(TypeError):
         vermouth.forcefield.ForceField()
+
+
+def test_link_requirements(empty_force_field):
+    """
+    The requirements of the links are the facts a molecule must contain.
+    """
+    link = vermouth.molecule.Link()
+    link.add_nodes_from((
+        (0, {'atomname': 'BB', 'order': 0, 'replace': {'atype': 'P5'}}),
+        (1, {'atomname': vermouth.molecule.Choice(['SC1', 'SC2']), 'order': 1}),
+        (2, {'resname': vermouth.molecule.NotDefinedOrNot('GLY')}),
+    ))
+    link.molecule_meta = {'scfix': True,
+                          'extdih': vermouth.molecule.NotDefinedOrNot(True)}
+    link.patterns = [[(0, {'cgsecstruct': 'H'})]]
+    empty_force_field.links.append(link)
+    expected = frozenset((
+        ('node', 'atomname', frozenset(['BB'])),
+        ('node', 'atomname', frozenset(['SC1', 'SC2'])),
+        ('node', 'cgsecstruct', frozenset(['H'])),
+        ('meta', 'scfix', frozenset([True])),
+    ))
+    assert empty_force_field.link_requirements == [expected]
+
+    # With alternative patterns, none of them is required.
+    link.patterns.append([(0, {'cgsecstruct': 'E'})])
+    empty_force_field.links.append(vermouth.molecule.Link())
+    assert vermouth.forcefield.link_requirements(link) == expected - {
+        ('node', 'cgsecstruct', frozenset(['H']))
+    }
+    assert empty_force_field.link_requirements[1] == frozenset()
@@ -209,3 +209,99 @@ def test_distance_matrix():
     matrix = geometry.distance_matrix(coordinates[:6], coordinates[6:15])
     assert matrix.shape == (6, 9)
     assert np.allclose(matrix, reference)
+
+
+def test_batched_kernels():
+    """
+    The batched kernels agree with their scalar counterparts.
+    """
+    points = np.random.RandomState(42).uniform(-2, 2, size=(20, 4, 3))
+
+    distances = geometry.pair_distances(points[:, :2])
+    assert distances.shape == (20, )
+    assert np.array_equal(
+        distances,
+        [np.sqrt(np.sum(np.diff(pair, axis=0)**2)) for pair in points[:, :2]],
+    )
+
+    vectors_ba = points[:, 0] - points[:, 1]
+    vectors_bc = points[:, 2] - points[:, 1]
+    assert np.allclose(
+        geometry.angles(vectors_ba, vectors_bc),
+        [geometry.angle(ba, bc) for ba, bc in zip(vectors_ba, vectors_bc)],
+    )
+    assert np.allclose(geometry.dihedrals(points),
+                       [geometry.dihedral(quad) for quad in points])
+    assert np.allclose(geometry.dihedral_phases(points),
+                       [geometry.dihedral_phase(quad) for quad in points])
+    assert geometry.dihedrals(np.zeros((0, 4, 3))).shape == (0, )
+
+
+@pytest.mark.parametrize('box, vectors, expected', (
+    ([2, 3, 4], [[1.5, -1.6, 2.5], [0.2, 0.3, -0.4]],
+     [[-0.5, 1.4, -1.5], [0.2, 0.3, -0.4]]),
+    # Dimensions with a length of 0 are not periodic.
+    ([2, 0, 0], [[1.5, -1.6, 2.5]], [[-0.5, -1.6, 2.5]]),
+    ([[2, 0, 0], [1, 2, 0], [0, 0, 2]], [[0.2, 1.9, 0]], [[-0.8, -0.1, 0]]),
+))
+def test_minimum_image(box, vectors, expected):
+    assert np.allclose(geometry.minimum_image(np.array(vectors), box), expected)
+
+
+@pytest.mark.parametrize('box', (
+    [1, 2],
+    [[1, 0, 1], [0, 1, 0], [0, 0, 1]],
+))
+def test_minimum_image_invalid_box(box):
+    with pytest.raises(ValueError):
+        geometry.minimum_image(np.zeros((1, 3)), box)
+
+
+def test_batched_kernels_pbc():
+    """
+    The batched kernels give the same result for points split across the
+    periodic boundaries.
+    """
+    box = np.array([3., 3.5, 4.])
+    random = np.random.RandomState(7)
+    # Compact groups of points, so the minimum image is the real vector.
+    points = random.uniform(0, 3, size=(15, 1, 3)) + random.uniform(-0.4, 0.4, size=(15, 4, 3))
+    split = points + random.randint(-2, 3, size=points.shape) * box
+
+    assert np.allclose(geometry.pair_distances(split[:, :2], box),
+                       geometry.pair_distances(points[:, :2]))
+    assert np.allclose(geometry.distances(split[:, 0], split[:, 1], box),
+                       geometry.pair_distances(points[:, :2]))
+    assert np.allclose(geometry.triplet_angles(split[:, :3], box),
+                       geometry.triplet_angles(points[:, :3]))
+    assert np.allclose(geometry.dihedrals(split, box), geometry.dihedrals(points))
+    assert np.allclose(geometry.dihedral_phases(split, box),
+                       geometry.dihedral_phases(points))
+    assert np.allclose(geometry.distance_matrix(split[:, 0], split[:, 1], box),
+                       geometry.distance_matrix(points[:, 0], points[:, 1], box))
+
+
+@pytest.mark.parametrize('max_pairs', (1, 7, 40, geometry.DEFAULT_MAX_PAIRS))
+@pytest.mark.parametrize('box', (None, [2, 2, 2]))
+def test_pairs_within(max_pairs, box):
+    """
+    The chunked distances are the same as the full distance matrix.
+    """
+    random = np.random.RandomState(3)
+    coordinates_a = random.uniform(0, 2, size=(12, 3))
+    coordinates_b = random.uniform(0, 2, size=(8, 3))
+    matrix = geometry.distance_matrix(coordinates_a, coordinates_b, box)
+
+    blocks = list(geometry.iter_distance_matrix(coordinates_a, coordinates_b,
+                                                box, max_pairs))
+    assert all(len(block) * len(coordinates_b) <= max(max_pairs, len(coordinates_b))
+               for _, block in blocks)
+    assert np.array_equal(np.concatenate([block for _, block in blocks]), matrix)
+
+    index_a, index_b, distances = geometry.pairs_within(
+        coordinates_a, coordinates_b, 0.9, box, max_pairs
+    )
+    expected_a, expected_b = np.where(matrix < 0.9)
+    assert np.array_equal(index_a, expected_a)
+    assert np.array_equal(index_b, expected_b)
+    assert np.array_equal(distances, matrix[expected_a, expected_b])
@@ -0,0 +1,155 @@
+# Copyright 2018 University of Groningen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Test the :class:`vermouth.processors.go_contact_map.GoContactMap` processor.
+"""
+
+# Pylint issues false warnings because of pytest's fixtures.
+# pylint: disable=redefined-outer-name
+
+import numpy as np
+import pytest
+from vermouth import Molecule
+from vermouth.processors import GoContactMap
+from vermouth.processors.go_contact_map import (
+    residue_contacts, atom_class, go_pairs,
+    HYDROPHOBIC, DONOR, ACCEPTOR, NEUTRAL,
+)
+from vermouth.processors.go_vs_includes import add_virtual_sites
+
+
+@pytest.mark.parametrize('elements, classes, distance, expected', (
+    # The enlarged van der Waals spheres overlap.
+    ('CC', (NEUTRAL, NEUTRAL), 0.4, [[0, 1]]),
+    # No overlap, and no water in between, but the contact is repulsive.
+    ('OO', (ACCEPTOR, ACCEPTOR), 0.5, []),
+    # No overlap, and no water in between, and the contact is attractive.
+    ('NO', (DONOR, ACCEPTOR), 0.5, [[0, 1]]),
+    # No overlap, and no water in between, and the contact is neutral.
+    ('NO', (NEUTRAL, ACCEPTOR), 0.5, []),
+    # A water molecule fits between the atoms.
+    ('CC', (HYDROPHOBIC, HYDROPHOBIC), 0.7, []),
+))
+def test_residue_contacts(elements, classes, distance, expected):
+    """
+    Pairs of atoms from two residues are in contact or not.
+    """
+    positions = [[0, 0, 0], [distance, 0, 0]]
+    found = residue_contacts(positions, [0, 1], elements, classes)
+    assert found.tolist() == expected
+    # Atoms from a same residue are never in contact.
+    found = residue_contacts(positions, [0, 0], elements, classes)
+    assert found.tolist() == []
+
+
+def test_residue_contacts_majority():
+    """
+    rCSU contacts require more attractive than repulsive atom contacts.
+    """
+    positions = [[0, 0, 0], [0.5, 0, 0], [0, 2, 0], [0.5, 2, 0], [0, 4, 0], [0.5, 4, 0]]
+    residues = [0, 1, 0, 1, 0, 1]
+    elements = 'NONOOO'
+    classes = [DONOR, ACCEPTOR, DONOR, ACCEPTOR, ACCEPTOR, ACCEPTOR]
+    assert residue_contacts(positions, residues, elements, classes).tolist() == [[0, 1]]
+    classes[2] = ACCEPTOR
+    assert residue_contacts(positions, residues, elements, classes).tolist() == []
+
+
+@pytest.mark.parametrize('atom, expected', (
+    ({'resname': 'LEU', 'atomname': 'CD1', 'element': 'C'}, HYDROPHOBIC),
+    ({'resname': 'LEU', 'atomname': 'N', 'element': 'N'}, DONOR),
+    ({'resname': 'PRO', 'atomname': 'N', 'element': 'N'}, NEUTRAL),
+    ({'resname': 'ASP', 'atomname': 'OD1', 'element': 'O'}, ACCEPTOR),
+    ({'resname': 'HEM', 'atomname': 'FE', 'element': 'FE'}, NEUTRAL),
+))
+def test_atom_class(atom, expected):
+    """
+    Atom classes are read from the names, or guessed from the element.
+    """
+    assert atom_class(atom) == expected
+
+
+@pytest.fixture
+def molecule_for_go():
+    """
+    A coarse grained molecule with one backbone bead per residue.
+
+    Each bead has an atomistic graph with a single carbon atom on top of
+    the bead. Residues 0 and 4 have atoms in contact, and so do residues 0
+    and 1. Residue 6 has atoms in contact with residue 0, but its backbone
+    bead is further than the long cutoff.
+    """
+    positions = {
+        0: [0, 0, 0],
+        1: [0.35, 0, 0],
+        2: [3, 0, 0],
+        3: [6, 0, 0],
+        4: [-0.35, 0, 0],
+        5: [9, 0, 0],
+        6: [0, 0, 0.35],
+    }
+    molecule = Molecule()
+    for resid, position in positions.items():
+        atoms = Molecule()
+        atoms.add_node(resid, atomname='CB', resname='LEU', resid=resid,
+                       element='C', position=np.array(position, dtype=float))
+        molecule.add_node(
+            resid, atomname='BB', resname='LEU', resid=resid, chain='A',
+            charge_group=resid, graph=atoms,
+            position=np.array(position, dtype=float) * (4 if resid == 6 else 1),
+        )
+    molecule.meta['moltype'] = 'TEST'
+    add_virtual_sites(molecule, prefix='TEST', backbone='BB', atomname='CA',
+                      charge=0)
+    return molecule
+
+
+def test_go_pairs(molecule_for_go):
+    """
+    Contacts are filtered on sequence separation and backbone distance.
+    """
+    pairs = go_pairs(molecule_for_go)
+    assert len(pairs) == 1
+    left_site, right_site, left_backbone, right_backbone, distance = pairs[0]
+    assert (left_backbone, right_backbone) == (0, 4)
+    assert molecule_for_go.nodes[left_site]['atype'] == 'TEST_0'
+    assert molecule_for_go.nodes[right_site]['atype'] == 'TEST_4'
+    assert distance == pytest.approx(0.35)
+
+
+def test_go_contact_map(tmpdir, molecule_for_go):
+    """
+    The processor writes the three include files.
+    """
+    GoContactMap(directory=str(tmpdir), epsilon=5).run_molecule(molecule_for_go)
+    atomtypes = (tmpdir / 'TEST_atomtypes_VirtGoSites.itp').read().splitlines()
+    assert atomtypes[1:] == ['TEST_{} 0.0 0.000 A 0.0 0.0'.format(resid)
+                             for resid in range(7)]
+    nonbond = (tmpdir / 'TEST_nonbond_params_VirtGoSites.itp').read().splitlines()
+    assert len(nonbond) == 2
+    fields = nonbond[1].split()
+    assert fields[:3] == ['TEST_0', 'TEST_4', '1']
+    assert float(fields[3]) == pytest.approx(0.35 * 2 ** (-1 / 6))
+    assert float(fields[4]) == pytest.approx(5)
+    exclusions = (tmpdir / 'TEST_exclusions_VirtGoSites.itp').read().splitlines()
+    assert exclusions[1:] == ['1 5']
+
+
+def test_go_contact_map_no_moltype():
+    """
+    The processor raises an exception if the moltype is not defined.
+    """
+    with pytest.raises(ValueError):
+        GoContactMap().run_molecule(Molecule())
@@ -115,6 +115,102 @@ def test_asymmetric_self_isomorphism(graphs):
     assert make_into_set(ismags_answer) == make_into_set(nx_answer)
 
 
+def test_node_keys(graphs):
+    """
+    Isomorphisms are reported with the original node keys, whatever they are.
+    """
+    relabeled = nx.relabel_nodes(graphs, {node: 'n{:02d}'.format(node) for node in graphs})
+    subgraph = relabeled.subgraph(sorted(relabeled)[:-1])
+    ismags = vermouth.ismags.ISMAGS(relabeled, subgraph)
+    ismags_answer = list(ismags.find_isomorphisms(False))
+    graph_matcher = nx.isomorphism.GraphMatcher(relabeled, subgraph)
+    nx_answer = list(graph_matcher.subgraph_isomorphisms_iter())
+    assert make_into_set(ismags_answer) == make_into_set(nx_answer)
+    assert all(len(found) == len(subgraph) for found in ismags.find_isomorphisms(True))
+    assert make_into_set(ismags.largest_common_subgraph(False)) == make_into_set(nx_answer)
+
+
+def test_mixed_node_keys(graphs):
+    """
+    Node keys that cannot be compared with each other are supported.
+    """
+    kinds = (lambda node: node, 'n{}'.format, lambda node: ('n', node))
+    mixed = nx.relabel_nodes(graphs, {node: kinds[node % 3](node) for node in graphs})
+    ismags = vermouth.ismags.ISMAGS(mixed, mixed)
+    assert make_into_set(ismags.find_isomorphisms(True)) == make_into_set([{n: n for n in mixed}])
+    graph_matcher = nx.isomorphism.GraphMatcher(mixed, mixed)
+    nx_answer = list(graph_matcher.isomorphisms_iter())
+    assert make_into_set(ismags.find_isomorphisms(False)) == make_into_set(nx_answer)
+
+    subgraph = mixed.subgraph(list(mixed)[:-1])
+    ismags = vermouth.ismags.ISMAGS(mixed, subgraph)
+    graph_matcher = nx.isomorphism.GraphMatcher(mixed, subgraph)
+    nx_answer = list(graph_matcher.subgraph_isomorphisms_iter())
+    assert make_into_set(ismags.largest_common_subgraph(False)) == make_into_set(nx_answer)
+    assert all(len(found) == len(subgraph) for found in ismags.largest_common_subgraph(True))
+
+
+def test_intersect():
+    assert vermouth.ismags.intersect([{1, 2, 3}, {2, 3, 4}, {3, 2}]) == {2, 3}
+    assert vermouth.ismags.intersect([frozenset('ab')]) == frozenset('ab')
+
+
+def test_symmetry_cache(graphs, tmpdir):
+    """
+    Symmetries found through a cache, in memory or read from disk, are the
+    same as without cache.
+    """
+    reference = list(vermouth.ismags.ISMAGS(graphs, graphs).find_isomorphisms(True))
+    cache = vermouth.ismags.SymmetryCache()
+    for _ in range(2):
+        ismags = vermouth.ismags.ISMAGS(graphs, graphs, cache=cache)
+        assert list(ismags.find_isomorphisms(True)) == reference
+    assert (cache.hits, cache.misses, len(cache)) == (1, 1, 1)
+
+    path = tmpdir / 'symmetries.pickle'
+    cache.save(path)
+    loaded = vermouth.ismags.SymmetryCache()
+    loaded.load(path)
+    assert list(loaded.items()) == list(cache.items())
+    ismags = vermouth.ismags.ISMAGS(graphs, graphs, cache=loaded)
+    assert list(ismags.find_isomorphisms(True)) == reference
+    assert loaded.misses == 0
+
+
+def test_symmetry_cache_lru(tmpdir):
+    """
+    The least recently used symmetries are evicted first.
+    """
+    cache = vermouth.ismags.SymmetryCache(maxsize=2)
+    cache['a'] = 1
+    cache['b'] = 2
+    assert cache['a'] == 1
+    cache['c'] = 3
+    assert list(cache) == ['a', 'c']
+    assert 'b' not in cache
+    with pytest.raises(KeyError):
+        cache['b']  # pylint: disable=pointless-statement
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    path = tmpdir / 'not_a_cache.pickle'
+    path.write('garbage')
+    with pytest.raises(ValueError):
+        cache.load(path)
+
+
+def test_symmetry_key():
+    """
+    Symmetry keys describe the graph, its partitions, and its edge colors.
+    """
+    graph = nx.path_graph(3)
+    key = vermouth.ismags.symmetry_key(graph, [{0, 2}, {1}], {(0, 1): 0, (1, 2): 0})
+    assert key == vermouth.ismags.symmetry_key(
+        nx.path_graph(3), [{0, 2}, {1}], {(0, 1): 0, (1, 2): 0}
+    )
+    assert key != vermouth.ismags.symmetry_key(graph, [{0}, {1}, {2}], {(0, 1): 0, (1, 2): 0})
+    assert key != vermouth.ismags.symmetry_key(graph, [{0, 2}, {1}], {(0, 1): 0, (1, 2): 1})
+
+
 def test_broken_edgecase():
     """
     In this edgecase the ordering of the nodes matters for the symmetries
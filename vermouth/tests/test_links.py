@@ -14,10 +14,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import logging
+
+import networkx as nx
 import pytest
 import numpy as np
 from vermouth.processors import do_links, DoLinks
-from vermouth.molecule import Molecule, Link
+from vermouth.molecule import (
+    Molecule, Link, Choice, NotDefinedOrNot, Interaction, DeleteInteraction,
+    ParamDistance,
+)
 import vermouth.forcefield
 
 @pytest.mark.parametrize(
@@ -274,3 +280,218 @@ def test_link_processor(mol_nodes, mol_edges, link_nodes, link_edges,
     out = DoLinks().run_molecule(mol)
     assert dict(out.nodes(data=True)) == dict(expected_nodes)
     assert set(out.edges(data=False)) == set(expected_edges)
+
+
+def _graph_matcher_matches(molecule, link):
+    """
+    Find the matches of a link with the generic graph matcher.
+    """
+    matcher = nx.isomorphism.GraphMatcher(molecule, link, node_match=do_links._atoms_match)
+    return [
+        list({value: key for key, value in raw_match.items()}.items())
+        for raw_match in matcher.subgraph_isomorphisms_iter()
+        if do_links._valid_match(molecule, link, raw_match)
+    ]
+
+
+def _polymer():
+    """
+    A branched polymer with a ring, and atom names that repeat.
+    """
+    nodes = []
+    edges = []
+    for resid in range(1, 6):
+        first = len(nodes)
+        nodes.append((first, {'atomname': 'BB', 'resname': 'A', 'resid': resid}))
+        nodes.append((first + 1, {'atomname': 'SC1', 'resname': 'A', 'resid': resid}))
+        nodes.append((first + 2, {'atomname': 'SC2', 'resname': 'A', 'resid': resid}))
+        nodes.append((first + 3, {'atomname': 'SC1', 'resname': 'A', 'resid': resid}))
+        edges.extend([(first, first + 1), (first + 1, first + 2),
+                      (first + 2, first + 3), (first + 3, first + 1)])
+        if resid > 1:
+            edges.append((first - 4, first))
+    return nodes, edges
+
+
+@pytest.mark.parametrize('link_nodes, link_edges', (
+    ([(0, {'atomname': 'BB', 'order': 0}), (1, {'atomname': 'BB', 'order': 1})],
+     [(0, 1)]),
+    ([(0, {'atomname': 'BB', 'order': 0}), (1, {'atomname': 'BB', 'order': '>'}),
+      (2, {'atomname': 'BB', 'order': '>>'})],
+     [(0, 1), (1, 2)]),
+    ([(0, {'atomname': 'BB'}), (1, {'atomname': 'BB'})],
+     [(0, 1)]),
+    ([(0, {'order': 0}), (1, {'atomname': 'SC1'}), (2, {'atomname': 'SC2'})],
+     [(0, 1), (1, 2)]),
+    ([(0, {'atomname': Choice(['SC1', 'SC2'])}), (1, {'atomname': 'SC1'}),
+      (2, {'atomname': NotDefinedOrNot('BB')})],
+     [(0, 1), (1, 2), (2, 0)]),
+    ([(0, {'atomname': 'SC2'}), (1, {'atomname': 'SC1'}), (2, {'atomname': 'SC1'})],
+     [(0, 1), (0, 2)]),
+    ([(0, {'atomname': 'BB'}), (1, {'atomname': 'SC2'})],
+     []),
+))
+def test_match_link(link_nodes, link_edges):
+    """
+    The link matching engine finds the same matches as the generic graph
+    matcher, in the same order.
+    """
+    molecule = make_mol(*_polymer())
+    link = make_link(link_nodes, link_edges)
+    expected = _graph_matcher_matches(molecule, link)
+    found = [list(match.items()) for match in do_links.match_link(molecule, link)]
+    assert found == expected
+
+
+def test_link_processor_rename():
+    """
+    Nodes renamed by a link are matched with their new name by the rest of the
+    matches of the same link.
+    """
+    ff = vermouth.forcefield.ForceField('dummy')
+    ff.links = [make_link([(0, {'atomname': 'a', 'replace': {'atomname': 'b'}}),
+                           (1, {'atomname': 'a'})], [(0, 1)])]
+    mol = make_mol([(idx, {'atomname': 'a'}) for idx in range(3)],
+                   [(0, 1), (1, 2)], force_field=ff)
+    out = DoLinks().run_molecule(mol)
+    assert [out.nodes[idx]['atomname'] for idx in range(3)] == ['b', 'b', 'a']
+
+
+def test_link_processor_skip(caplog):
+    """
+    Links that require facts the molecule does not contain are skipped.
+    """
+    caplog.set_level(logging.DEBUG)
+    ff = vermouth.forcefield.ForceField('dummy')
+    meta_link = make_link([(0, {'atomname': 'a', 'replace': {'charge': 3}})])
+    meta_link.molecule_meta = {'scfix': True}
+    ff.links = [
+        make_link([(0, {'atomname': 'a', 'replace': {'charge': 1}})]),
+        make_link([(0, {'atomname': 'x', 'replace': {'charge': 2}})]),
+        meta_link,
+        # This link renames a node, so the next one can apply.
+        make_link([(0, {'atomname': 'b', 'replace': {'atomname': 'y'}})]),
+        make_link([(0, {'atomname': 'y', 'replace': {'charge': 4}})]),
+    ]
+    mol = make_mol([(0, {'atomname': 'a'}), (1, {'atomname': 'b'})], [(0, 1)],
+                   force_field=ff)
+    out = DoLinks().run_molecule(mol)
+    assert out.nodes[0]['charge'] == 1
+    assert out.nodes[1] == {'atomname': 'y', 'charge': 4}
+    assert any('2 links out of 5' in record.getMessage() for record in caplog.records)
+
+
+@pytest.mark.parametrize('link_nodes, non_edges, expected', (
+    ([(0, {'atomname': 'a', 'replace': {'charge': 1}})], [], False),
+    ([(0, {'atomname': 'a', 'replace': {'atomname': 'b'}})], [], True),
+    ([(0, {'atomname': 'a', 'replace': {'atomname': None}})], [], False),
+    ([(0, {'atomname': 'a', 'order': 0, 'replace': {'resid': 2}})], [], True),
+    ([(0, {'atomname': 'a', 'replace': {'resid': 2}})], [], False),
+    ([(0, {'atomname': 'a', 'replace': {'resid': 2}})],
+     [[0, {'atomname': 'b'}]], True),
+    ([(0, {'atomname': 'a', 'replace': {'charge': 1}})],
+     [[0, {'charge': 0}]], True),
+))
+def test_rewrites_own_matches(link_nodes, non_edges, expected):
+    link = make_link(link_nodes)
+    link.non_edges = non_edges
+    assert do_links._rewrites_own_matches(link) == expected
+
+
+def test_link_processor_interactions():
+    """
+    Links add, replace, and remove interactions in the order they are defined.
+    """
+    ff = vermouth.forcefield.ForceField('dummy')
+    first = make_link([(0, {'atomname': 'a'}), (1, {'atomname': 'b'})], [(0, 1)])
+    first.interactions['bonds'] = [
+        Interaction(atoms=(0, 1), parameters=['1'], meta={}),
+        Interaction(atoms=(0, 1), parameters=['2'], meta={'version': 1}),
+    ]
+    first.removed_interactions['angles'] = [
+        DeleteInteraction(atoms=(0, 1), atom_attrs=[{}, {}], parameters=[],
+                          meta={}),
+    ]
+    second = make_link([(0, {'atomname': 'a'}), (1, {'atomname': 'b'})], [(0, 1)])
+    second.interactions['bonds'] = [
+        Interaction(atoms=(0, 1), parameters=['3'], meta={}),
+    ]
+    # Nothing matches this one, it must not fail.
+    second.removed_interactions['bonds'] = [
+        DeleteInteraction(atoms=(1, 0), atom_attrs=[{}, {}], parameters=[],
+                          meta={}),
+    ]
+    ff.links = [first, second]
+    mol = make_mol([(0, {'atomname': 'a'}), (1, {'atomname': 'b'}),
+                    (2, {'atomname': 'c'})],
+                   [(0, 1), (1, 2)], force_field=ff)
+    mol.add_interaction('bonds', (1, 2), ['0'])
+    mol.add_interaction('angles', (0, 1), ['x'])
+    mol.add_interaction('angles', (0, 1), ['y'])
+    out = DoLinks().run_molecule(mol)
+    assert out.interactions['bonds'] == [
+        Interaction(atoms=(1, 2), parameters=['0'], meta={}),
+        Interaction(atoms=(0, 1), parameters=['3'], meta={}),
+        Interaction(atoms=(0, 1), parameters=['2'], meta={'version': 1}),
+    ]
+    assert out.interactions['angles'] == [
+        Interaction(atoms=(0, 1), parameters=['y'], meta={}),
+    ]
+
+
+def test_link_processor_parameter_effectors():
+    """
+    Parameters that depend on the coordinates are computed for each match.
+    """
+    ff = vermouth.forcefield.ForceField('dummy')
+    link = make_link([(0, {'atomname': 'BB', 'order': 0}),
+                      (1, {'atomname': 'BB', 'order': 1})], [(0, 1)])
+    link.interactions['bonds'] = [
+        Interaction(atoms=(0, 1),
+                    parameters=['1', ParamDistance([0, 1], format_spec='.3f'),
+                                '1250'],
+                    meta={}),
+    ]
+    ff.links = [link]
+    positions = np.array([[0, 0, 0], [0, 0, 0.3], [0.4, 0, 0.3], [0.4, 0.25, 0.3]])
+    mol = make_mol([(idx, {'atomname': 'BB', 'resid': idx + 1, 'position': position})
+                    for idx, position in enumerate(positions)],
+                   [(0, 1), (1, 2), (2, 3)], force_field=ff)
+    assert do_links._batch_effectors(link) == [link.interactions['bonds'][0].parameters[1]]
+    out = DoLinks().run_molecule(mol)
+    assert out.interactions['bonds'] == [
+        Interaction(atoms=(0, 1), parameters=['1', '0.300', '1250'], meta={}),
+        Interaction(atoms=(1, 2), parameters=['1', '0.400', '1250'], meta={}),
+        Interaction(atoms=(2, 3), parameters=['1', '0.250', '1250'], meta={}),
+    ]
+
+    link.nodes[1]['replace'] = {'position': np.zeros(3)}
+    assert do_links._batch_effectors(link) == []
+
+
+def test_link_processor_remove_nodes():
+    """
+    Nodes removed by a link are gone, with their interactions, for the next
+    links.
+    """
+    ff = vermouth.forcefield.ForceField('dummy')
+    ff.links = [
+        make_link([(0, {'atomname': 'x', 'replace': {'atomname': None}})]),
+        make_link([(0, {'atomname': 'a'}), (1, {'atomname': 'x'})], [(0, 1)]),
+    ]
+    ff.links[1].interactions['bonds'] = [
+        Interaction(atoms=(0, 1), parameters=[], meta={}),
+    ]
+    mol = make_mol([(0, {'atomname': 'a'}), (1, {'atomname': 'x'}),
+                    (2, {'atomname': 'b'}), (3, {'atomname': 'x'})],
+                   [(0, 1), (0, 2), (2, 3)], force_field=ff)
+    mol.add_interaction('bonds', (0, 1), [])
+    mol.add_interaction('bonds', (2, 3), [])
+    mol.add_interaction('bonds', (0, 2), [])
+    mol.add_interaction('angles', (0, 2, 3), [])
+    out = DoLinks().run_molecule(mol)
+    assert list(out.nodes) == [0, 2]
+    assert list(out.edges) == [(0, 2)]
+    assert out.interactions == {
+        'bonds': [Interaction(atoms=(0, 2), parameters=[], meta={})],
+    }
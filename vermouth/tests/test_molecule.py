@@ -19,6 +19,7 @@ import pytest
 import hypothesis
 import hypothesis.strategies as st
 import hypothesis_networkx.strategy as hnst
+import networkx as nx
 import vermouth
 import vermouth.molecule
 from vermouth.molecule import Interaction, Molecule, Block, Link, DeleteInteraction
@@ -240,6 +241,61 @@ def test_copy_interactions_mod(molecule, molecule_copy):
     assert n_bonds_copy > n_bonds
 
 
+def test_copy_independent(molecule):
+    """
+    Changes made to a molecule or to its copies are not seen by the others.
+    """
+    molecule.add_edge(1, 2, attribute='original')
+    molecule_copy = molecule.copy()
+    second_copy = molecule_copy.copy()
+    molecule.nodes[0]['atomname'] = 'mod'
+    molecule.edges[1, 2]['attribute'] = 'mod'
+    molecule.interactions['bonds'].append(Interaction(atoms=(1, 2), parameters=[], meta={}))
+    for other in (molecule_copy, second_copy):
+        assert other.nodes[0]['atomname'] != 'mod'
+        assert other.edges[1, 2]['attribute'] == 'original'
+        assert len(other.interactions['bonds']) == len(molecule.interactions['bonds']) - 1
+    # Both ends of an edge still share the same attributes.
+    molecule_copy.adj[2][1]['attribute'] = 'copy'
+    assert molecule_copy.adj[1][2]['attribute'] == 'copy'
+    assert second_copy.edges[1, 2]['attribute'] == 'original'
+    molecule_copy.remove_node(1)
+    assert 1 in second_copy and 1 in molecule
+    assert list(second_copy.neighbors(2)) == [0, 1]
+    assert list(molecule_copy.neighbors(2)) == [0]
+    assert copy.deepcopy(second_copy) == second_copy
+
+
+def test_copy_handles_before_copy(molecule):
+    """
+    Node attributes, neighbours, and interaction lists fetched before a copy
+    only belong to the original molecule.
+    """
+    molecule.add_edge(2, 3, weight=1)
+    node = molecule.nodes[0]
+    neighbours = molecule.adj[2]
+    bonds = molecule.interactions['bonds']
+    molecule_copy = molecule.copy()
+    node['atomname'] = 'ZZ'
+    neighbours[3]['weight'] = 99
+    bonds.append(Interaction(atoms=(2, 3), parameters=[], meta={}))
+    assert molecule.nodes[0]['atomname'] == 'ZZ'
+    assert molecule.edges[2, 3]['weight'] == 99
+    assert molecule_copy.nodes[0]['atomname'] != 'ZZ'
+    assert molecule_copy.edges[2, 3]['weight'] == 1
+    assert len(molecule_copy.interactions['bonds']) == len(bonds) - 1
+
+    # The same holds for handles fetched from the copy.
+    node = molecule_copy.nodes[1]
+    neighbours = molecule_copy.adj[3]
+    second_copy = molecule_copy.copy()
+    node['atomname'] = 'YY'
+    neighbours[2]['weight'] = 42
+    assert molecule_copy.edges[2, 3]['weight'] == 42
+    assert second_copy.nodes[1].get('atomname') != 'YY'
+    assert second_copy.edges[2, 3]['weight'] == 1
+
+
 def test_subgraph_base(molecule_subgraph):
     assert tuple(molecule_subgraph) == (2, 0)  # order matters!
     assert (0, 2) in molecule_subgraph.edges
@@ -252,6 +308,21 @@ def test_subgraph_interactions(molecule_subgraph):
     assert (0, 1) not in bond_atoms
 
 
+def test_subgraph_independent(molecule):
+    """
+    The node and edge attributes of a subgraph are not shared with the
+    molecule, and self loops are kept.
+    """
+    molecule.add_edge(0, 0, weight=1)
+    molecule.edges[0, 2]['weight'] = 1
+    subgraph = molecule.subgraph([2, 0])
+    assert (0, 0) in subgraph.edges
+    subgraph.nodes[0]['atomname'] = 'ZZ'
+    subgraph.edges[0, 2]['weight'] = 99
+    assert molecule.nodes[0]['atomname'] != 'ZZ'
+    assert molecule.edges[0, 2]['weight'] == 1
+
+
 def test_link_predicate_match():
     lp = vermouth.molecule.LinkPredicate(None)
     with pytest.raises(NotImplementedError):
@@ -978,6 +1049,19 @@ def test_molecule_equal(mol):
     assert mol is not mol_copy
 
 
+@hypothesis.given(random_molecule(max_nodes=6), random_molecule(max_nodes=6))
+def test_share_moltype_with(left, right):
+    """
+    Sharing a moltype is the same as being isomorphic, whatever the node order.
+    """
+    assert left.share_moltype_with(left.copy())
+    reordered = Molecule()
+    reordered.add_nodes_from(reversed(list(left.nodes(data=True))))
+    reordered.add_edges_from(left.edges)
+    assert left.share_moltype_with(reordered)
+    assert left.share_moltype_with(right) == nx.is_isomorphic(left, right)
+
+
 @hypothesis.given(random_block())
 def test_block_equal(block):
     """
@@ -1172,3 +1256,157 @@ def test_same_non_edges(left, right, expected):
     link_right.non_edges = right
     assert link_left.same_non_edges(link_right) == expected
     assert link_right.same_non_edges(link_left) == expected
+
+
+def _residue_molecule():
+    molecule = Molecule()
+    molecule.add_nodes_from([
+        (0, {'chain': 'A', 'resid': 1, 'resname': 'ALA'}),
+        (3, {'chain': 'A', 'resid': 2, 'resname': 'GLY'}),
+        (1, {'chain': 'A', 'resid': 1, 'resname': 'ALA'}),
+        (2, {'chain': 'A', 'resid': 2, 'resname': 'GLY'}),
+    ])
+    molecule.add_edges_from([(0, 1), (1, 2), (2, 3)])
+    return molecule
+
+
+def test_structure_version():
+    """
+    Structural changes, and only these, increment the structure version.
+    """
+    molecule = _residue_molecule()
+    changes = [
+        lambda: molecule.add_node(4),
+        lambda: molecule.add_edge(3, 4),
+        lambda: molecule.remove_edge(3, 4),
+        lambda: molecule.add_edges_from([(3, 4)]),
+        lambda: molecule.remove_edges_from([(3, 4)]),
+        lambda: molecule.remove_node(4),
+        lambda: molecule.add_nodes_from([5, 6]),
+        lambda: molecule.remove_nodes_from([5, 6]),
+    ]
+    for change in changes:
+        version = molecule.structure_version
+        change()
+        assert molecule.structure_version > version
+    version = molecule.structure_version
+    molecule.nodes[0]['atomname'] = 'CA'
+    molecule.meta['test'] = True
+    molecule.add_interaction('bonds', (0, 1), [])
+    assert molecule.structure_version == version
+
+
+def test_residue_graph_cache():
+    """
+    The residue graph is reused until the residues of the molecule change.
+    """
+    molecule = _residue_molecule()
+    residue_graph = molecule.residue_graph
+    assert molecule.residue_graph is residue_graph
+    assert list(molecule.iter_residues()) == [(0, 1), (3, 2)]
+    assert list(residue_graph.edges) == [(0, 1)]
+    # The residues are views on the molecule.
+    molecule.nodes[0]['atomname'] = 'CA'
+    assert residue_graph.nodes[0]['graph'].nodes[0]['atomname'] == 'CA'
+    assert molecule.residue_graph is residue_graph
+
+    molecule.nodes[3]['resid'] = 3
+    assert molecule.residue_graph is not residue_graph
+    assert list(molecule.iter_residues()) == [(0, 1), (2, ), (3, )]
+
+    residue_graph = molecule.residue_graph
+    molecule.remove_edge(1, 2)
+    assert molecule.residue_graph is not residue_graph
+    assert list(molecule.residue_graph.edges) == [(1, 2)]
+
+    residue_graph = molecule.residue_graph
+    copied = copy.deepcopy(molecule)
+    assert copied.residue_graph is not residue_graph
+    assert list(copied.iter_residues()) == list(molecule.iter_residues())
+
+
+def _merge_parts():
+    parts = []
+    for idx, nrexcl in enumerate((1, 1, 1, 1)):
+        part = Molecule(nrexcl=nrexcl)
+        if idx != 2:
+            part.add_nodes_from([
+                (3, {'atomname': 'A', 'resid': 1}),
+                (1, {'atomname': 'B', 'resid': 2, 'charge_group': 2}),
+            ])
+            part.add_edge(3, 1, attribute='dropped')
+            part.add_interaction('bonds', (3, 1), ['1'], meta={'index': idx})
+        if idx == 3:
+            part.add_interaction('angles', (3, 1, 3), [])
+        parts.append(part)
+    return parts
+
+
+def test_concatenate():
+    """
+    Concatenating molecules is the same as merging them one by one.
+    """
+    expected = Molecule()
+    expected_correspondences = [expected.merge_molecule(part) for part in _merge_parts()]
+    found = Molecule()
+    found_correspondences = found.concatenate(_merge_parts())
+    assert found_correspondences == expected_correspondences
+    assert found == expected
+    assert found.nrexcl == expected.nrexcl == 1
+    assert list(found.nodes(data=True)) == list(expected.nodes(data=True))
+    assert found.nodes[6] == {'atomname': 'B', 'resid': 6, 'charge_group': 6}
+    # Merging again follows the last node.
+    assert found.merge_molecule(_merge_parts()[1]) == {3: 7, 1: 8}
+    # Copies do not inherit the last node of the original molecule.
+    assert Molecule()._last_node_cache is None
+    found_copy = found.copy()
+    assert found_copy._last_node_cache is None
+    found_copy.remove_node(8)
+    assert found_copy.merge_molecule(_merge_parts()[1]) == {3: 8, 1: 9}
+
+
+def test_concatenate_check_first():
+    """
+    No molecule is merged if one of them cannot be.
+    """
+    parts = _merge_parts()
+    parts[-1].nrexcl = 2
+    molecule = Molecule()
+    with pytest.raises(ValueError):
+        molecule.concatenate(parts)
+    assert not molecule
+    assert not molecule.interactions
+
+
+@pytest.mark.parametrize('effector_class', (
+    vermouth.molecule.ParamDistance,
+    vermouth.molecule.ParamAngle,
+    vermouth.molecule.ParamDihedral,
+    vermouth.molecule.ParamDihedralPhase,
+))
+@pytest.mark.parametrize('format_spec', (None, '.3f'))
+def test_link_parameter_effector_batch(effector_class, format_spec):
+    """
+    Test that LinkParameterEffector.batch computes the same values as calling
+    the effector on each match.
+    """
+    positions = np.random.RandomState(1).uniform(-2, 2, size=(12, 3))
+    molecule = Molecule()
+    molecule.add_nodes_from((idx, {'position': position})
+                            for idx, position in enumerate(positions))
+    n_keys = effector_class.n_keys_asked
+    keys = ['A{}'.format(idx) for idx in range(n_keys)]
+    effector = effector_class(keys, format_spec=format_spec)
+    matches = [dict(zip(keys, nodes))
+               for nodes in itertools.permutations(range(5), n_keys)]
+
+    found = effector.batch(molecule, matches)
+    expected = [effector(molecule, match) for match in matches]
+    assert len(found) == len(expected)
+    if format_spec is None:
+        assert np.allclose(found, expected)
+    else:
+        assert all(isinstance(value, str) for value in found)
+        assert np.allclose(np.array(found, dtype=float),
+                           np.array(expected, dtype=float), atol=1e-3)
+    assert effector.batch(molecule, []) == []
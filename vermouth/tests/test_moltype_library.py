@@ -0,0 +1,100 @@
+# Copyright 2018 University of Groningen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Test the :class:`vermouth.moltype_library.MoltypeLibrary`.
+"""
+
+import io
+import os
+
+import numpy as np
+
+import vermouth
+import vermouth.forcefield
+from vermouth.gmx.itp import write_molecule_itp
+from vermouth.map_input import (
+    read_mapping_directory, generate_all_self_mappings, combine_mappings,
+)
+from vermouth.moltype_library import MoltypeLibrary, moltype_key
+from vermouth.tests.datafiles import PDB_HB
+from vermouth.tests.test_deduplicate import _make_molecule
+
+
+def test_moltype_key():
+    """
+    The key ignores what differs between copies, and depends on the context.
+    """
+    reference = moltype_key(_make_molecule(0, 'A'))
+    assert reference == moltype_key(_make_molecule(10, 'B', shift=3))
+    assert reference != moltype_key(_make_molecule(0, 'A', atomnames='ABD'))
+    assert reference != moltype_key(_make_molecule(0, 'A'), {'to_ff': 'other'})
+    molecule = _make_molecule(0, 'A')
+    molecule.nodes[0]['unstable'] = object()
+    assert moltype_key(molecule) is None
+
+
+def _atomistic_system():
+    universal = vermouth.forcefield.get_native_force_field('universal')
+    system = vermouth.System()
+    vermouth.PDBInput(str(PDB_HB), exclude=('HOH', 'HEME')).run_system(system)
+    system.force_field = universal
+    vermouth.MakeBonds().run_system(system)
+    vermouth.RepairGraph(include_graph=False).run_system(system)
+    vermouth.CanonicalizeModifications().run_system(system)
+    vermouth.AttachMass(attribute='mass').run_system(system)
+    return system
+
+
+def _itp(molecule):
+    outfile = io.StringIO()
+    write_molecule_itp(molecule, outfile, moltype='TEST')
+    return outfile.getvalue()
+
+
+def test_library(tmpdir):
+    """
+    A molecule rebuilt from the library is the same as a mapped one.
+    """
+    universal = vermouth.forcefield.get_native_force_field('universal')
+    martini = vermouth.forcefield.get_native_force_field('martini22')
+    mappings = read_mapping_directory(os.path.join(vermouth.DATA_PATH, 'mappings'))
+    combine_mappings(mappings, generate_all_self_mappings([universal, martini]))
+
+    system = _atomistic_system()
+    atomistic = system.molecules[0]
+    library = MoltypeLibrary(str(tmpdir), {'martini22': martini})
+    key = library.key(atomistic)
+    assert library.load(key, atomistic) is None
+    vermouth.DoMapping(mappings=mappings, to_ff=martini,
+                       attribute_keep=('cgsecstruct', )).run_system(system)
+    vermouth.DoAverageBead(ignore_missing_graphs=True).run_system(system)
+    vermouth.ApplyBlocks().run_system(system)
+    vermouth.DoLinks().run_system(system)
+    expected = system.molecules[0]
+    assert library.save(key, atomistic, expected)
+
+    atomistic = _atomistic_system().molecules[0]
+    assert library.key(atomistic) == key
+    found = library.load(key, atomistic)
+    assert (library.hits, library.misses) == (1, 1)
+    vermouth.DoAverageBead(ignore_missing_graphs=True).run_molecule(found)
+    assert _itp(found) == _itp(expected)
+    assert found.force_field is martini
+    assert len(found.edges) == len(expected.edges)
+    for found_node, expected_node in zip(found.nodes.values(),
+                                         expected.nodes.values()):
+        assert found_node['chain'] == expected_node['chain']
+        assert np.allclose(found_node['position'], expected_node['position'])
+        assert found_node.get('cgsecstruct') == expected_node.get('cgsecstruct')
@@ -191,3 +191,77 @@ def test_identify_ptms(known_ptm_graphs, atoms, edges, expected):
     found = canmod.identify_ptms(molecule, ptms, known_ptms)
     found = [(ptm.name, match) for ptm, match in found]
     assert found == expected
+
+
+@pytest.mark.parametrize('atoms, edges, expected', [
+    (
+        {
+            0: {'atomname': 'N', 'PTM_atom': False, 'element': 'N', 'resid': 1},
+            1: {'atomname': 'H', 'PTM_atom': True, 'element': 'H', 'resid': 1},
+        },
+        [(0, 1)],
+        ['NH'],
+    ),
+    (
+        {
+            0: {'atomname': 'C', 'PTM_atom': False, 'element': 'C', 'resid': 1},
+            1: {'atomname': 'O', 'PTM_atom': True, 'element': 'O', 'resid': 1},
+            2: {'atomname': 'O', 'PTM_atom': True, 'element': 'O', 'resid': 2},
+            3: {'atomname': 'C', 'PTM_atom': False, 'element': 'C', 'resid': 2},
+        },
+        [(0, 1), (1, 2), (2, 3)],
+        ['COOC'],
+    ),
+    (
+        # A single anchor is not enough for COOC
+        {
+            0: {'atomname': 'C', 'PTM_atom': False, 'element': 'C', 'resid': 1},
+            1: {'atomname': 'O', 'PTM_atom': True, 'element': 'O', 'resid': 1},
+            2: {'atomname': 'O', 'PTM_atom': True, 'element': 'O', 'resid': 1},
+            3: {'atomname': 'N', 'PTM_atom': False, 'element': 'N', 'resid': 1},
+            4: {'atomname': 'H', 'PTM_atom': True, 'element': 'H', 'resid': 1},
+        },
+        [(0, 1), (1, 2), (3, 4)],
+        ['NH'],
+    ),
+])
+def test_library_candidates(known_ptm_graphs, atoms, edges, expected):
+    """
+    Only the modifications with a compatible composition are candidates, and
+    they come in the library order.
+    """
+    molecule = make_molecule(atoms, edges)
+    library = canmod.ModificationLibrary(known_ptm_graphs)
+    found = [ptm.name for ptm in library.candidates(molecule)]
+    assert found == expected
+    allowed = [ptm.name for ptm, _ in canmod.allowed_ptms(molecule, [], library)]
+    reference = [ptm.name for ptm, _ in canmod.allowed_ptms(molecule, [], known_ptm_graphs)]
+    assert allowed == reference
+
+
+def test_fix_ptm_coverings(known_ptm_graphs):
+    """
+    Identical modified residues are solved once, and canonicalized the same
+    way.
+    """
+    for ptm in known_ptm_graphs:
+        ptm.nodes[[key for key in ptm if ptm.nodes[key]['PTM_atom']][0]]['replace'] = {'atomname': 'HN'}
+    atoms = {}
+    edges = []
+    for resid in (1, 2, 3):
+        first = len(atoms)
+        common = {'resid': resid, 'resname': 'RES', 'chain': 'A'}
+        atoms[first] = dict(atomname='N', PTM_atom=False, element='N',
+                            atomid=first + 1, **common)
+        atoms[first + 1] = dict(atomname='X', PTM_atom=True, element='H',
+                                atomid=first + 2, **common)
+        edges.append((first, first + 1))
+        if resid > 1:
+            edges.append((first - 2, first))
+    molecule = make_molecule(atoms, edges)
+    library = canmod.ModificationLibrary(known_ptm_graphs)
+    canmod.fix_ptm(molecule, library)
+    assert len(library.coverings) == 1
+    for key in (1, 3, 5):
+        assert molecule.nodes[key]['atomname'] == 'HN'
+        assert [ptm.name for ptm in molecule.nodes[key]['modifications']] == ['NH']
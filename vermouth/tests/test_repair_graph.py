@@ -244,3 +244,120 @@ def test_renaming(renamed_graph):
             assert node['resname'] == 'GLU0'
         else:
             assert node['resname'] == 'GLY'
+
+
+@pytest.mark.parametrize('resname', ('GLY', 'PHE', 'ARG', 'HIS'))
+def test_match_by_names(resname):
+    """
+    Complete residues are matched on names as ISMAGS would match them.
+    """
+    force_field = vermouth.forcefield.get_native_force_field('universal')
+    reference = force_field.reference_graphs[resname]
+    vermouth.processors.repair_graph.add_element_attr(reference)
+    residue = nx.relabel_nodes(reference, {key: idx for idx, key
+                                           in enumerate(reversed(list(reference)))})
+    expected = vermouth.processors.repair_graph._match_with_ismags(reference, residue, {})
+    found = vermouth.processors.repair_graph._match_by_names(reference, residue)
+    assert found == expected
+
+
+def test_match_by_names_incomplete():
+    """
+    Residues that differ from their reference are not matched on names.
+    """
+    force_field = vermouth.forcefield.get_native_force_field('universal')
+    reference = force_field.reference_graphs['GLY']
+    vermouth.processors.repair_graph.add_element_attr(reference)
+    residue = reference.copy()
+    residue.remove_node(next(iter(residue)))
+    assert vermouth.processors.repair_graph._match_by_names(reference, residue) is None
+    residue = reference.copy()
+    residue.remove_edge(*next(iter(residue.edges)))
+    assert vermouth.processors.repair_graph._match_by_names(reference, residue) is None
+
+
+def _unnamed_molecule():
+    """
+    A molecule which residues cannot all be matched by their atom names.
+    """
+    force_field = vermouth.forcefield.get_native_force_field('universal')
+    molecule = vermouth.molecule.Molecule(force_field=force_field)
+    for resid, resname in enumerate(('GLY', 'PHE', 'ARG', 'GLY'), start=1):
+        reference = force_field.reference_graphs[resname]
+        offset = len(molecule)
+        keys = {key: offset + idx for idx, key in enumerate(reference)}
+        for key, node in reference.nodes.items():
+            if node['atomname'].startswith('H') and resid % 2:
+                # Missing hydrogens prevent the match by names.
+                continue
+            molecule.add_node(keys[key], **node, resname=resname, resid=resid, chain='A')
+        molecule.add_edges_from((keys[left], keys[right]) for left, right in reference.edges
+                                if keys[left] in molecule and keys[right] in molecule)
+    # This residue does not look like its reference at all.
+    molecule.add_node(len(molecule) + 100, atomname='X', element='Xe', resname='ALA',
+                      resid=5, chain='A')
+    return molecule
+
+
+def test_make_reference_processes(caplog):
+    """
+    Matching the residues in worker processes gives the same result, and the
+    same errors, as matching them in the main process.
+    """
+    molecule = _unnamed_molecule()
+    expected = vermouth.processors.repair_graph.make_reference(molecule)
+    expected_errors = [record.getMessage() for record in caplog.records]
+    caplog.clear()
+    found = vermouth.processors.repair_graph.make_reference(molecule, processes=2)
+    assert [record.getMessage() for record in caplog.records] == expected_errors
+    assert len(expected_errors) == 1
+    assert list(found.nodes) == list(expected.nodes)
+    for residx in expected:
+        assert found.nodes[residx]['match'] == expected.nodes[residx]['match']
+
+
+def test_make_reference_executor():
+    """
+    The symmetries found by the worker processes end up in the symmetry cache
+    of the main process, and the workers can be reused between molecules.
+    """
+    molecule = _unnamed_molecule()
+    expected = vermouth.processors.repair_graph.make_reference(
+        molecule, symmetry_cache=vermouth.ismags.SymmetryCache()
+    )
+    cache = vermouth.ismags.SymmetryCache()
+    with vermouth.processors.repair_graph.make_executor(2, cache) as executor:
+        for _ in range(2):
+            found = vermouth.processors.repair_graph.make_reference(
+                molecule, symmetry_cache=cache, processes=2, executor=executor
+            )
+            for residx in expected:
+                assert found.nodes[residx]['match'] == expected.nodes[residx]['match']
+    assert len(cache) > 0
+    assert cache.misses > 0
+    assert cache.hits + cache.misses >= 2 * len(cache)
+
+
+def test_repair_graph_executor(monkeypatch):
+    """
+    RepairGraph starts its worker processes once for the whole system.
+    """
+    repair_graph = vermouth.processors.repair_graph
+    executors = []
+    make_executor = repair_graph.make_executor
+
+    def counting_make_executor(*args, **kwargs):
+        executor = make_executor(*args, **kwargs)
+        executors.append(executor)
+        return executor
+
+    monkeypatch.setattr(repair_graph, 'make_executor', counting_make_executor)
+    system = vermouth.System()
+    system.force_field = vermouth.forcefield.get_native_force_field('universal')
+    system.add_molecule(_unnamed_molecule())
+    system.add_molecule(_unnamed_molecule())
+    processor = vermouth.RepairGraph(include_graph=False, processes=2)
+    processor.run_system(system)
+    assert len(executors) == 1
+    assert processor._executor is None
+    assert len(system.molecules) == 2
@@ -220,3 +220,41 @@ def test_are_different_custom(left, right, expected):
     Test :func:`are_different` on handcrafted cases.
     """
     assert utils.are_different(left, right) == expected
+
+
+class _OtherCache(utils.LRUCache):
+    description = 'other cache'
+
+
+def test_lru_cache_eviction():
+    """
+    Test that :class:`LRUCache` drops the least recently used items.
+    """
+    cache = utils.LRUCache(maxsize=2)
+    cache['a'] = 1
+    cache['b'] = 2
+    assert cache['a'] == 1
+    cache['c'] = 3
+    assert set(cache) == {'a', 'c'}
+    assert (cache.hits, cache.misses) == (1, 0)
+    with pytest.raises(KeyError):
+        cache['b']  # pylint: disable=pointless-statement
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.items()
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_lru_cache_save_load(tmpdir):
+    """
+    Test that :class:`LRUCache` files are only read back by the same kind of
+    cache.
+    """
+    path = str(tmpdir / 'cache.pickle')
+    cache = utils.LRUCache()
+    cache['a'] = 1
+    cache.save(path)
+    loaded = utils.LRUCache()
+    loaded.load(path)
+    assert loaded.items() == [('a', 1)]
+    with pytest.raises(ValueError):
+        _OtherCache().load(path)
@@ -18,9 +18,12 @@ Provides several generic utility functions
 
 import string
 import numpy as np
+import collections
 import collections.abc
 import numbers
 import itertools
+import pickle
+import threading
 import warnings
 
 
@@ -196,3 +199,134 @@ def are_different(left, right):
         )
 
     return left != right
+
+
+class LRUCache(collections.abc.MutableMapping):
+    """
+    A bounded cache that can be written to, and read from, disk.
+
+    When the cache is full, the least recently used items are evicted. The
+    cache counts how often it is queried successfully or not. It can be used
+    from multiple threads.
+
+    Subclasses describe what they store with :attr:`description` and
+    :attr:`file_format`; a file is only read back by a cache with the same
+    description and format.
+
+    Parameters
+    ----------
+    maxsize: int or None
+        The maximum number of items to keep. The cache is not bounded if
+        ``None``.
+
+    Attributes
+    ----------
+    maxsize: int or None
+    hits: int
+        The number of keys found in the cache.
+    misses: int
+        The number of keys looked for but not found.
+    file_format: int
+        The version of the format of the files.
+    description: str
+        What the cache contains. It is written to the files with
+        :attr:`file_format`.
+    """
+    file_format = 1
+    description = 'cache'
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getitem__(self, key):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                raise
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if self.maxsize is not None:
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self._data[key]
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._data))
+
+    def __len__(self):
+        return len(self._data)
+
+    def items(self):
+        """
+        The items of the cache, from the least to the most recently used.
+
+        Unlike looking for a key, this does not count as a hit, and does not
+        change the order of the items.
+
+        Returns
+        -------
+        list[tuple]
+        """
+        with self._lock:
+            return list(self._data.items())
+
+    def save(self, path):
+        """
+        Write the content of the cache to a file.
+
+        Parameters
+        ----------
+        path: str or pathlib.Path
+        """
+        items = self.items()
+        with open(str(path), 'wb') as outfile:
+            pickle.dump(((self.description, self.file_format), items),
+                        outfile, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def load(self, path):
+        """
+        Add the content of a file written by :meth:`save` to the cache.
+
+        Parameters
+        ----------
+        path: str or pathlib.Path
+
+        Raises
+        ------
+        ValueError
+            The file is not a cache, or was written in an other format.
+        """
+        with open(str(path), 'rb') as infile:
+            try:
+                content = pickle.load(infile)
+            except Exception as error:
+                raise ValueError('"{}" is not a {}: {}'
+                                 .format(path, self.description, error)) from error
+        try:
+            tag, items = content
+        except (TypeError, ValueError):
+            tag = None
+        if tag != (self.description, self.file_format):
+            raise ValueError('"{}" is not a {} in the format {}.'
+                             .format(path, self.description, self.file_format))
+        for key, value in items:
+            self[key] = value